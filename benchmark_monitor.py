@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the park availability monitor
+Runs check cycles against a local stand-in for the Recreation.gov API
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import yaml
+
+from park_monitor import ParkAvailabilityMonitor
+
+
+class MockRecreationHandler(BaseHTTPRequestHandler):
+    """Serves /api/search, campground and permit availability from generated data"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        """Keep the benchmark output clean"""
+
+    def do_GET(self):
+        """Route a GET request to the matching endpoint"""
+        server = self.server
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        with server.lock:
+            server.stats['requests'] += 1
+
+        if url.path == '/__stats':
+            return self._send_json(server.stats)
+
+        if server.options['latency_ms']:
+            time.sleep(server.options['latency_ms'] / 1000)
+
+        if server.rng.random() < server.options['error_rate']:
+            with server.lock:
+                server.stats['throttled'] += 1
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if url.path == '/api/search':
+            self._send_json(self._search(params))
+        elif url.path.startswith('/api/camps/availability/campground/'):
+            self._send_json(self._availability(url.path.rsplit('/', 1)[1], params))
+        elif url.path.startswith('/api/permitcontent/'):
+            self._send_json(self._permit_content(url.path.rsplit('/', 1)[1]))
+        elif url.path.startswith('/api/permits/') and url.path.endswith('/availability/month'):
+            self._send_json(self._permit_availability(url.path.split('/')[3], params))
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def _search(self, params: dict) -> dict:
+        """List a park's campgrounds (or permits), one page at a time"""
+        filters = params.get('fq', [])
+        park_id = next((f.split(':', 1)[1] for f in filters if f.startswith('entity_id:')), '0')
+        options = self.server.options
+
+        if 'entity_type:permit' in filters:
+            results = [{'entity_id': f"{park_id}9{i}", 'name': f"Permit {i}", 'entity_type': 'permit'}
+                       for i in range(options['permits'])]
+        else:
+            results = [{'entity_id': f"{park_id}{i:03d}", 'name': f"Campground {park_id}-{i}",
+                        'entity_type': 'campground'}
+                       for i in range(options['campgrounds'])]
+
+        start = int(params.get('start', ['0'])[0])
+        size = int(params.get('size', ['100'])[0])
+        return {'results': results[start:start + size], 'total': len(results)}
+
+    def _availability(self, campground_id: str, params: dict) -> dict:
+        """Generate a deterministic availability payload for a campground"""
+        options = self.server.options
+        start = date.fromisoformat(params['start_date'][0][:10])
+        end = date.fromisoformat(params['end_date'][0][:10])
+        nights = [(start + timedelta(days=i)).isoformat() + 'T00:00:00Z'
+                  for i in range((end - start).days + 1)]
+
+        # Seeded per campground and cycle so runs are reproducible
+        rng = random.Random(f"{options['seed']}-{campground_id}-{self.server.stats['epoch']}")
+        campsites = {}
+        for i in range(options['sites']):
+            campsites[f"{campground_id}{i:04d}"] = {
+                'site': f"{i:03d}",
+                'loop': f"Loop {'ABCD'[i % 4]}",
+                'campsite_type': 'TENT ONLY NONELECTRIC' if i % 3 else 'STANDARD NONELECTRIC',
+                'availabilities': {
+                    night: 'Available' if rng.random() < options['availability'] else 'Reserved'
+                    for night in nights
+                }
+            }
+        return {'campsites': campsites}
+
+    def _permit_content(self, permit_id: str) -> dict:
+        """Name a permit's divisions (trailheads)"""
+        return {'payload': {'divisions': {
+            f"{permit_id}{i:02d}": {'name': f"Trailhead {i}"} for i in range(self.server.options['divisions'])
+        }}}
+
+    def _permit_availability(self, permit_id: str, params: dict) -> dict:
+        """Generate a month of per-division quota for a permit"""
+        options = self.server.options
+        start = date.fromisoformat(params['start_date'][0][:10]).replace(day=1)
+        days = ((start + timedelta(days=32)).replace(day=1) - start).days
+
+        rng = random.Random(f"{options['seed']}-{permit_id}-{start}-{self.server.stats['epoch']}")
+        availability = {}
+        for i in range(options['divisions']):
+            availability[f"{permit_id}{i:02d}"] = {'date_availability': {
+                (start + timedelta(days=d)).isoformat() + 'T00:00:00Z': {
+                    'total': 20,
+                    'remaining': rng.randint(1, 5) if rng.random() < options['availability'] else 0
+                }
+                for d in range(days)
+            }}
+        return {'payload': {'permit_id': permit_id, 'availability': availability}}
+
+    def _send_json(self, data: dict):
+        """Write a JSON response"""
+        body = json.dumps(data).encode()
+        with self.server.lock:
+            self.server.stats['bytes'] += len(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(options: dict, ready):
+    """Run the mock server in a child process, reporting its port on `ready`"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockRecreationHandler)
+    server.daemon_threads = True
+    server.options = options
+    server.rng = random.Random(options['seed'])
+    server.lock = threading.Lock()
+    server.stats = {'requests': 0, 'throttled': 0, 'bytes': 0, 'epoch': 0}
+
+    # Availability changes every `churn_seconds` so later cycles see deltas
+    if options['churn_seconds']:
+        def churn():
+            while True:
+                time.sleep(options['churn_seconds'])
+                server.stats['epoch'] += 1
+        threading.Thread(target=churn, daemon=True).start()
+
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+def write_config(directory: str, base_url: str, options: dict) -> str:
+    """Write a monitor config pointed at the mock server"""
+    config = {
+        'api': {'base_url': base_url},
+        'parks': [
+            {'name': f"Park {i}", 'park_id': str(1000 + i), 'check_camping': True,
+             'check_permits': options['permits'] > 0}
+            for i in range(options['parks'])
+        ],
+        'target_dates': {'start_date': options['start_date'], 'end_date': options['end_date']},
+        'notifications': {
+            'email': {'enabled': False},
+            'webhook': {'enabled': False},
+            'sms': {'enabled': False}
+        },
+        'monitoring': {
+            'check_interval_minutes': 60,
+            'max_retries': 3,
+            'retry_delay_seconds': 0.01,
+            'requests_per_second': options['rate'],
+            'burst': options['rate'],
+            'fetch_mode': options['fetch_mode'],
+            'max_concurrency': options['concurrency'],
+            'max_connections_per_host': options['concurrency']
+        },
+        'cache': {'discovery_file': os.path.join(directory, 'discovery_cache.json')},
+        'storage': {'database': os.path.join(directory, 'availability.db')},
+        'logging': {'level': 'ERROR', 'console_output': False}
+    }
+
+    path = os.path.join(directory, 'config.yaml')
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return path
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in megabytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports ru_maxrss in kilobytes, macOS in bytes
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_benchmark(options: dict) -> list:
+    """Start the mock server, run the requested cycles and collect timings"""
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(options, ready), daemon=True)
+    server.start()
+    base = f"http://127.0.0.1:{ready.get(timeout=10)}"
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            monitor = ParkAvailabilityMonitor(write_config(directory, f"{base}/api", options))
+
+            # Time JSON decoding and parsing without changing the monitor's behaviour
+            parse_stats = {'seconds': 0.0, 'count': 0}
+            parse = monitor._decode_campground_month
+
+            def timed_parse(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return parse(*args, **kwargs)
+                finally:
+                    parse_stats['seconds'] += time.perf_counter() - started
+                    parse_stats['count'] += 1
+
+            monitor._decode_campground_month = timed_parse
+
+            results = []
+            for cycle in range(1, options['cycles'] + 1):
+                before = monitor.session.get(f"{base}/__stats").json()
+                connections = monitor.transport.stats()['connections']
+                parse_stats.update(seconds=0.0, count=0)
+
+                started = time.perf_counter()
+                monitor.run_once()
+                wall = time.perf_counter() - started
+
+                after = monitor.session.get(f"{base}/__stats").json()
+                requests_made = after['requests'] - before['requests'] - 1
+
+                results.append({
+                    'cycle': cycle,
+                    'wall_seconds': round(wall, 3),
+                    'requests': requests_made,
+                    'requests_per_second': round(requests_made / wall, 1) if wall else 0.0,
+                    'throttled': after['throttled'] - before['throttled'],
+                    'megabytes': round((after['bytes'] - before['bytes']) / 1e6, 2),
+                    'connections': monitor.transport.stats()['connections'] - connections,
+                    'parsed_units': parse_stats['count'],
+                    'parse_ms_per_unit': round(1000 * parse_stats['seconds'] / parse_stats['count'], 3)
+                    if parse_stats['count'] else 0.0,
+                    'peak_rss_mb': round(peak_rss_mb(), 1)
+                })
+
+            monitor.close_notifiers()
+            monitor.store.close()
+            return results
+    finally:
+        server.terminate()
+
+
+def print_report(options: dict, results: list):
+    """Print a table of per-cycle results"""
+    print("=" * 78)
+    print("California National Parks Monitor - Offline Benchmark")
+    print("=" * 78)
+    print(f"{options['parks']} parks x {options['campgrounds']} campgrounds x {options['sites']} sites, "
+          f"{options['start_date']} to {options['end_date']}")
+    print(f"fetch_mode={options['fetch_mode']} concurrency={options['concurrency']} "
+          f"latency={options['latency_ms']}ms 429-rate={options['error_rate']}")
+    print("-" * 78)
+    print(f"{'cycle':>5} {'wall s':>8} {'reqs':>6} {'req/s':>8} {'429s':>5} {'MB':>7} {'conns':>5} "
+          f"{'parsed':>7} {'ms/parse':>9} {'RSS MB':>8}")
+    for r in results:
+        print(f"{r['cycle']:>5} {r['wall_seconds']:>8} {r['requests']:>6} {r['requests_per_second']:>8} "
+              f"{r['throttled']:>5} {r['megabytes']:>7} {r['connections']:>5} {r['parsed_units']:>7} "
+              f"{r['parse_ms_per_unit']:>9} {r['peak_rss_mb']:>8}")
+    print("=" * 78)
+
+
+def main():
+    """Parse options, run the benchmark and report"""
+    parser = argparse.ArgumentParser(
+        description='Benchmark check cycles against a local mock of the Recreation.gov API'
+    )
+    parser.add_argument('--parks', type=int, default=8, help='Number of parks (default: 8)')
+    parser.add_argument('--campgrounds', type=int, default=20, help='Campgrounds per park (default: 20)')
+    parser.add_argument('--permits', type=int, default=0, help='Permits per park (default: 0)')
+    parser.add_argument('--divisions', type=int, default=5, help='Trailheads per permit (default: 5)')
+    parser.add_argument('--sites', type=int, default=100, help='Sites per campground (default: 100)')
+    parser.add_argument('--start-date', default='2026-06-01', help='Window start (default: 2026-06-01)')
+    parser.add_argument('--end-date', default='2026-06-30', help='Window end (default: 2026-06-30)')
+    parser.add_argument('--availability', type=float, default=0.05,
+                        help='Fraction of nights available (default: 0.05)')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Added latency per request (default: 20)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with 429 (default: 0)')
+    parser.add_argument('--churn-seconds', type=float, default=0,
+                        help='Regenerate availability this often; 0 keeps it fixed (default: 0)')
+    parser.add_argument('--cycles', type=int, default=3, help='Check cycles to run (default: 3)')
+    parser.add_argument('--fetch-mode', choices=['sync', 'async'], default='async',
+                        help='Monitor fetch mode (default: async)')
+    parser.add_argument('--concurrency', type=int, default=16, help='Max in-flight requests (default: 16)')
+    parser.add_argument('--rate', type=float, default=1000, help='Requests per second limit (default: 1000)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+    parser.add_argument('--json', metavar='PATH', help='Also write results to a JSON file')
+
+    args = parser.parse_args()
+    options = {key: value for key, value in vars(args).items() if key != 'json'}
+
+    results = run_benchmark(options)
+    print_report(options, results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'options': options, 'results': results}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,6 @@
+"""
+pytest configuration for the park availability monitor
+"""
+
+# test_monitor.py is the interactive setup checker, not a test module
+collect_ignore = ['test_monitor.py']
@@ -5,58 +5,3612 @@ Monitors Recreation.gov for camping and permit availability in June 2026
 """
 
 import requests
-import yaml
 import logging
 import time
-import smtplib
 import json
-from datetime import datetime, timedelta
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from typing import List, Dict, Optional
-import schedule
+import functools
+import hashlib
+import io
+import heapq
+import itertools
+import os
+import queue
+import random
+import socket
+import sqlite3
+import sys
+import threading
+import zlib
+import bisect
+from array import array
+from collections import Counter, deque
+from contextlib import contextmanager
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from datetime import date, datetime, time as dt_time, timedelta
+from html import escape
+from string import Template
+from typing import List, Dict, Optional, TYPE_CHECKING
+from urllib.parse import parse_qsl, urlencode, urlparse
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError
+
+try:
+    import ijson  # Optional: streams large availability payloads
+except ImportError:
+    ijson = None
+
+if TYPE_CHECKING:
+    import smtplib  # Imported when first needed at runtime
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats records as one JSON object per line.
+    
+    Fields passed with `extra=` (park, campground, status, latency_ms, ...)
+    become top-level keys next to time, level and message.
+    """
+    
+    # Attributes every LogRecord has; anything else came from `extra`
+    STANDARD = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+    
+    def format(self, record: logging.LogRecord) -> str:
+        """Render a record as a JSON line"""
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in self.STANDARD:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RotatingLogFile(logging.FileHandler):
+    """Log file rotated by size and/or age, optionally gzipping the rotated files.
+    
+    Rotated files are numbered like logging's RotatingFileHandler (`.1`
+    is the newest), with `.gz` appended when compressed.
+    """
+    
+    def __init__(self, filename: str, max_bytes: int = 0, rotate_hours: float = 0,
+                 backup_count: int = 7, compress: bool = False):
+        """Open `filename`; 0 turns off the size or age limit"""
+        super().__init__(filename, encoding='utf-8', delay=True)
+        self.max_bytes = max_bytes
+        self.interval = rotate_hours * 3600
+        self.rollover_at = time.time() + self.interval if self.interval else None
+        self.backup_count = backup_count
+        self.suffix = '.gz' if compress else ''
+    
+    def emit(self, record: logging.LogRecord):
+        """Write a record, rotating first if the file is too old or too large"""
+        try:
+            line = self.format(record) + self.terminator
+            if self._due(len(line.encode('utf-8'))):
+                self.rotate()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(line)
+            self.flush()
+        except Exception:
+            self.handleError(record)
+    
+    def rotate(self):
+        """Shift the numbered backups along and move the current file to `.1`"""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        
+        base = self.baseFilename
+        if self.backup_count > 0:
+            for number in range(self.backup_count - 1, 0, -1):
+                source = f"{base}.{number}{self.suffix}"
+                if os.path.exists(source):
+                    os.replace(source, f"{base}.{number + 1}{self.suffix}")
+            if os.path.exists(base):
+                if self.suffix:
+                    self._compress(base, f"{base}.1{self.suffix}")
+                else:
+                    os.replace(base, f"{base}.1")
+        elif os.path.exists(base):
+            os.remove(base)
+        
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+    
+    def _due(self, size: int) -> bool:
+        """Whether the file must rotate before `size` more bytes are written"""
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        if not self.max_bytes:
+            return False
+        if self.stream is not None:
+            written = self.stream.tell()
+        else:
+            try:
+                written = os.path.getsize(self.baseFilename)
+            except OSError:
+                return False
+        return written > 0 and written + size > self.max_bytes
+    
+    @staticmethod
+    def _compress(source: str, dest: str):
+        """Gzip the file being rotated out"""
+        import gzip
+        import shutil
+        
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+
+class LogQueueHandler(logging.Handler):
+    """Hands records to a QueueListener thread untouched.
+    
+    logging's QueueHandler formats and copies each record so it can be
+    pickled to another process; the listener here shares the process, so
+    the calling thread only pays for the enqueue.
+    """
+    
+    def __init__(self, log_queue: queue.SimpleQueue):
+        """Enqueue onto `log_queue`"""
+        super().__init__()
+        self.queue = log_queue
+    
+    def emit(self, record: logging.LogRecord):
+        """Enqueue the record as is"""
+        self.queue.put_nowait(record)
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every outbound API request"""
+    
+    def __init__(self, rate: float, capacity: float):
+        """Refill at `rate` tokens per second, holding at most `capacity`"""
+        if not rate > 0:
+            raise ValueError(f"rate must be positive, got {rate!r}")
+        if not capacity >= 1:
+            raise ValueError(f"capacity must be at least 1, got {capacity!r}")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+    
+    def acquire(self, deadline: Optional[float] = None) -> bool:
+        """Block until a token is available and consume it.
+        
+        Returns False without a token if one would not be available before
+        the monotonic `deadline`.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            
+            if deadline is not None and now + wait >= deadline:
+                return False
+            time.sleep(wait)
+    
+    def pause(self, seconds: float):
+        """Hold back all callers for `seconds` (e.g. when the API sends Retry-After)"""
+        if seconds <= 0:
+            return
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class Metrics:
+    """Thread-safe counters, gauges and latency histograms for a Prometheus scrape.
+    
+    Series are keyed by (name, sorted label pairs). Recording a value is a
+    dict lookup and a bisect under one lock, so instrumentation stays cheap
+    next to the network calls it measures.
+    """
+    
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+    BOUNDS = tuple(f'{bound:g}' for bound in BUCKETS) + ('+Inf',)
+    
+    def __init__(self):
+        """Start with no series"""
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+        self.local = threading.local()  # Per-thread stack of open phases
+    
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def set(self, name: str, value: float, **labels):
+        """Set a gauge"""
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+    
+    def observe(self, name: str, value: float, **labels):
+        """Record one observation in a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.BUCKETS, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(self.BUCKETS) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    @contextmanager
+    def phase(self, name: str):
+        """Count a block's time towards a cycle phase, excluding nested phases"""
+        stack = getattr(self.local, 'phases', None)
+        if stack is None:
+            stack = self.local.phases = []
+        
+        stack.append(0.0)  # Time spent in phases nested inside this one
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.inc('parkmonitor_phase_seconds_total', elapsed - nested, phase=name)
+    
+    def counter_values(self, name: str) -> Dict[tuple, float]:
+        """Current values of a counter, keyed by label pairs"""
+        with self.lock:
+            return {labels: value for (series, labels), value in self.counters.items() if series == name}
+    
+    def render(self) -> str:
+        """Format every series in the Prometheus text exposition format"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self.histograms.items())
+        
+        lines = []
+        typed = set()
+        
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+        
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        
+        for (name, labels), value in gauges:
+            declare(name, 'gauge')
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        
+        for (name, labels), (buckets, total, count) in histograms:
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, bucket in zip(self.BOUNDS, buckets):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+        
+        return '\n'.join(lines) + '\n'
+    
+    @staticmethod
+    def _labels(labels: tuple) -> str:
+        """Format label pairs as {key="value",...}"""
+        if not labels:
+            return ''
+        pairs = ','.join(
+            f'{key}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+            for key, value in labels
+        )
+        return '{' + pairs + '}'
+
+
+class MetricsServer:
+    """Serves a Metrics registry at /metrics from a background thread"""
+    
+    def __init__(self, metrics: Metrics, host: str, port: int):
+        """Bind the HTTP server; call start() to begin serving"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+    
+    def start(self):
+        """Serve requests on a daemon thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever, name='MetricsServer', daemon=True)
+        self.thread.start()
+    
+    def close(self):
+        """Stop serving and release the port"""
+        if self.thread is not None:
+            self.server.shutdown()
+            self.thread = None
+        self.server.server_close()
+
+
+class FetchSkipped(requests.RequestException):
+    """A request that was not sent because of the cycle deadline or an open circuit"""
+    
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """Per-key circuit breakers for campgrounds and endpoints that keep failing.
+    
+    A key opens after `threshold` consecutive failures and its requests are
+    skipped until `cooldown` seconds pass. Then the circuit is half-open:
+    one probe request goes through, and success closes it while failure
+    re-opens it with the cooldown doubled, up to `max_cooldown`.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+    
+    def __init__(self, threshold: int, cooldown: float, max_cooldown: float):
+        """Open after `threshold` failures for `cooldown`-`max_cooldown` seconds"""
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self.failures = {}  # key -> consecutive failures
+        self.open_until = {}  # key -> monotonic time a probe is allowed, while not closed
+        self.cooldowns = {}  # key -> cooldown of the current open period
+        self.probing = set()  # Half-open keys with a probe in flight
+        self.lock = threading.Lock()
+    
+    def state(self, key) -> str:
+        """Current state of `key`'s circuit"""
+        with self.lock:
+            return self._state(key, time.monotonic())
+    
+    def allow(self, key) -> bool:
+        """Whether a request for `key` may be sent now; claims the probe when half-open"""
+        with self.lock:
+            state = self._state(key, time.monotonic())
+            if state == self.HALF_OPEN and key not in self.probing:
+                self.probing.add(key)
+                return True
+            return state == self.CLOSED
+    
+    def record(self, key, ok: bool) -> Optional[str]:
+        """Record a request's outcome, returning the new state if it changed"""
+        with self.lock:
+            now = time.monotonic()
+            before = self._state(key, now)
+            self.probing.discard(key)
+            
+            if ok:
+                self.failures.pop(key, None)
+                self.open_until.pop(key, None)
+                self.cooldowns.pop(key, None)
+            else:
+                failures = self.failures[key] = self.failures.get(key, 0) + 1
+                if key in self.open_until:
+                    # A failed probe (or a request already in flight when it opened)
+                    cooldown = min(self.max_cooldown, self.cooldowns[key] * 2)
+                elif failures >= self.threshold:
+                    cooldown = self.cooldown
+                else:
+                    return None
+                self.cooldowns[key] = cooldown
+                self.open_until[key] = now + cooldown
+            
+            after = self._state(key, now)
+            return after if after != before else None
+    
+    def cancel(self, key):
+        """Give up a claimed probe without an outcome, e.g. when it was skipped"""
+        with self.lock:
+            self.probing.discard(key)
+    
+    def open_count(self) -> int:
+        """Number of circuits that are open or half-open"""
+        with self.lock:
+            return len(self.open_until)
+    
+    def _state(self, key, now: float) -> str:
+        """State of `key` at `now`; the caller holds the lock"""
+        until = self.open_until.get(key)
+        if until is None:
+            return self.CLOSED
+        if key in self.probing or now >= until:
+            return self.HALF_OPEN
+        return self.OPEN
+
+
+class RequestScheduler:
+    """Rate-limited GET requests with retries, backoff and Retry-After handling.
+    
+    Requests also respect a per-cycle deadline set by start_cycle() and a
+    circuit breaker per campground (or permit, or endpoint). Requests that
+    either one rules out raise FetchSkipped and are listed by finish_cycle().
+    """
+    
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    
+    def __init__(self, session: requests.Session, monitoring: dict, logger: logging.Logger,
+                 metrics: Optional[Metrics] = None):
+        """Configure limits from the `monitoring` config section"""
+        self.session = session
+        self.logger = logger
+        self.metrics = metrics or Metrics()
+        self.max_retries = monitoring.get('max_retries', 3)
+        self.retry_delay = monitoring.get('retry_delay_seconds', 30)
+        self.max_backoff = monitoring.get('max_backoff_seconds', 300)
+        rate = monitoring.get('requests_per_second', 5)
+        self.bucket = TokenBucket(rate, monitoring.get('burst', max(1, rate)))
+        self.throttle = True  # Turned off when replaying recorded responses
+        
+        self.breaker = CircuitBreaker(
+            monitoring.get('circuit_failure_threshold', 3),
+            monitoring.get('circuit_cooldown_seconds', 120),
+            monitoring.get('circuit_max_cooldown_seconds', 1800)
+        )
+        self.deadline = None  # Monotonic end of the current cycle's time budget
+        self.skipped = {}  # Circuit key -> reason, for requests skipped this cycle
+        self.lock = threading.Lock()
+    
+    def start_cycle(self, budget: Optional[float]):
+        """Start a cycle that must finish within `budget` seconds (None for no limit)"""
+        with self.lock:
+            self.deadline = time.monotonic() + budget if budget else None
+            self.skipped = {}
+    
+    def finish_cycle(self) -> Dict[str, str]:
+        """End the cycle, returning {circuit key: reason} for the requests it skipped"""
+        with self.lock:
+            skipped, self.skipped = self.skipped, {}
+            self.deadline = None
+        return skipped
+    
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """GET a URL, retrying throttled, failed and 5xx responses"""
+        endpoint, campground_id = self._endpoint(url)
+        circuit = self._circuit(url, endpoint, campground_id)
+        
+        try:
+            if not self.breaker.allow(circuit):
+                raise FetchSkipped('circuit open')
+            with self.metrics.phase('search' if endpoint == 'search' else 'fetch'):
+                response = self._get(url, endpoint, campground_id, **kwargs)
+        except FetchSkipped as e:
+            self.breaker.cancel(circuit)
+            with self.lock:
+                self.skipped.setdefault(circuit, e.reason)
+            self.metrics.inc('parkmonitor_skipped_requests_total', endpoint=endpoint, reason=e.reason)
+            raise
+        except requests.RequestException:
+            self._record_outcome(circuit, False)
+            raise
+        
+        # Throttling is the API protecting itself, not this endpoint failing
+        self._record_outcome(circuit, response.status_code < 500)
+        return response
+    
+    def _get(self, url: str, endpoint: str, campground_id: Optional[str], **kwargs) -> requests.Response:
+        """Retry loop behind get()"""
+        deadline = self.deadline
+        
+        for attempt in range(self.max_retries + 1):
+            if self.throttle and not self.bucket.acquire(deadline):
+                raise FetchSkipped('deadline')
+            
+            # Never wait on a slow server past the end of the cycle
+            clamped = False
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise FetchSkipped('deadline')
+                if kwargs.get('timeout') is None or kwargs['timeout'] > remaining:
+                    kwargs['timeout'] = remaining
+                    clamped = True
+            
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.metrics.inc('parkmonitor_http_requests_total', endpoint=endpoint, status='error')
+                if clamped and isinstance(e, requests.Timeout):
+                    raise FetchSkipped('deadline') from e
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt) if self.throttle else 0
+                if not self._time_left(deadline, delay):
+                    raise
+                self.logger.warning(f"Request to {url} failed ({e}), retrying in {delay:.1f}s",
+                                    extra={'endpoint': endpoint, 'campground': campground_id,
+                                           'status': 'error', 'attempt': attempt + 1})
+                time.sleep(delay)
+                continue
+            
+            seconds = time.perf_counter() - started
+            self._record(endpoint, campground_id, response, seconds)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(
+                    f"GET {url} -> {response.status_code} in {seconds * 1000:.0f}ms",
+                    extra={'endpoint': endpoint, 'campground': campground_id,
+                           'status': response.status_code, 'latency_ms': round(seconds * 1000, 1)}
+                )
+            
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            
+            if not self.throttle:
+                continue
+            
+            retry_after = self._retry_after(response)
+            delay = retry_after if retry_after is not None else self._backoff(attempt)
+            if not self._time_left(deadline, delay):
+                return response
+            
+            self.logger.warning(
+                f"Got {response.status_code} from {url}, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s",
+                extra={'endpoint': endpoint, 'campground': campground_id,
+                       'status': response.status_code, 'attempt': attempt + 1}
+            )
+            
+            if retry_after is not None:
+                # The API asked every client to back off, not just this request
+                self.bucket.pause(retry_after)
+            else:
+                time.sleep(delay)
+        
+        return response
+    
+    @staticmethod
+    def _endpoint(url: str) -> tuple:
+        """Classify a URL as (endpoint label, campground id or None)"""
+        path = urlparse(url).path
+        if '/camps/availability/campground/' in path:
+            return 'availability', path.rstrip('/').rsplit('/', 1)[1]
+        if '/permits/' in path or '/permitcontent/' in path:
+            return 'permit', None
+        if path.endswith('/search'):
+            return 'search', None
+        return 'other', None
+    
+    @staticmethod
+    def _circuit(url: str, endpoint: str, campground_id: Optional[str]) -> str:
+        """Circuit breaker key for a URL: the campground, the permit, or the endpoint"""
+        if campground_id is not None:
+            return campground_id
+        if endpoint == 'permit':
+            # /permits/{id}/availability/month and /permitcontent/{id}
+            parts = urlparse(url).path.split('/')
+            index = next(i for i, part in enumerate(parts) if part in ('permits', 'permitcontent'))
+            return f"permit:{parts[index + 1]}"
+        return endpoint
+    
+    @staticmethod
+    def _time_left(deadline: Optional[float], seconds: float) -> bool:
+        """Whether `seconds` of waiting still ends before `deadline`"""
+        return deadline is None or time.monotonic() + seconds < deadline
+    
+    def _record_outcome(self, circuit: str, ok: bool):
+        """Feed a request's outcome to the circuit breaker and log state changes"""
+        state = self.breaker.record(circuit, ok)
+        if state == CircuitBreaker.OPEN:
+            self.logger.warning(
+                f"Circuit for {circuit} opened after {self.breaker.failures.get(circuit, 0)} failures; "
+                f"skipping it for {self.breaker.cooldowns.get(circuit, 0):g}s"
+            )
+        elif state == CircuitBreaker.CLOSED:
+            self.logger.info(f"Circuit for {circuit} closed again")
+        if state is not None:
+            self.metrics.set('parkmonitor_open_circuits', self.breaker.open_count())
+    
+    def _record(self, endpoint: str, campground_id: Optional[str],
+                response: requests.Response, seconds: float):
+        """Record one response's status, latency and size"""
+        metrics = self.metrics
+        metrics.inc('parkmonitor_http_requests_total', endpoint=endpoint,
+                    status=f"{response.status_code // 100}xx")
+        metrics.observe('parkmonitor_http_request_seconds', seconds, endpoint=endpoint)
+        metrics.inc('parkmonitor_http_response_bytes_total', len(response.content), endpoint=endpoint)
+        if response.status_code == 429:
+            metrics.inc('parkmonitor_http_throttled_total', endpoint=endpoint)
+        if campground_id is not None:
+            # One series per campground shows which ones are slow to answer
+            metrics.set('parkmonitor_campground_fetch_seconds', seconds, campground_id=campground_id)
+    
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with jitter for the given attempt number"""
+        delay = min(self.max_backoff, self.retry_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+    
+    def _retry_after(self, response: requests.Response) -> Optional[float]:
+        """Parse a Retry-After header given in seconds or as an HTTP date"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        
+        try:
+            return min(self.max_backoff, max(0.0, float(value)))
+        except ValueError:
+            pass
+        
+        from email.utils import parsedate_to_datetime
+        
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return min(self.max_backoff, max(0.0, retry_at.timestamp() - time.time()))
+        except (TypeError, ValueError):
+            return None
+
+
+class DiscoveryCache:
+    """On-disk cache of the campgrounds and permits listed for each park"""
+    
+    def __init__(self, path: str, ttl_hours: float, logger: logging.Logger):
+        """Load cached entries from `path`; entries older than `ttl_hours` are refreshed"""
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.refreshing = {}
+        self.entries = {}
+        self.generation = 0  # Bumped whenever a background refresh replaces an entry
+        
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Ignoring unreadable discovery cache {path}: {e}")
+    
+    def get(self, park_id: str, entity_type: str, loader) -> List[tuple]:
+        """Return cached (entity_id, name) pairs, calling `loader` on a miss.
+        
+        Stale entries are served immediately while a background thread
+        refreshes them, so a cycle never waits on /search for a known park.
+        """
+        key = f"{park_id}:{entity_type}"
+        
+        with self.lock:
+            entry = self.entries.get(key)
+        
+        if entry is None:
+            return self._store(key, loader())
+        
+        if time.time() - entry['fetched_at'] > self.ttl:
+            self._refresh_in_background(key, loader)
+        
+        return [tuple(item) for item in entry['items']]
+    
+    def wait_for_refreshes(self, timeout: Optional[float] = None):
+        """Block until in-flight background refreshes finish"""
+        for thread in list(self.refreshing.values()):
+            thread.join(timeout)
+    
+    def _refresh_in_background(self, key: str, loader):
+        """Start a refresh thread for `key` unless one is already running"""
+        with self.lock:
+            if key in self.refreshing:
+                return
+            thread = threading.Thread(target=self._refresh, args=(key, loader), daemon=True)
+            self.refreshing[key] = thread
+        thread.start()
+    
+    def _refresh(self, key: str, loader):
+        """Reload one entry, keeping the stale copy if the reload fails"""
+        try:
+            self._store(key, loader())
+            with self.lock:
+                self.generation += 1
+            self.logger.debug(f"Refreshed discovery cache for {key}")
+        except Exception as e:
+            self.logger.warning(f"Failed to refresh discovery cache for {key}: {e}")
+        finally:
+            with self.lock:
+                self.refreshing.pop(key, None)
+    
+    def _store(self, key: str, items: List[tuple]) -> List[tuple]:
+        """Record fresh items for `key` and persist the cache atomically"""
+        with self.lock:
+            self.entries[key] = {'fetched_at': time.time(), 'items': [list(item) for item in items]}
+            
+            if self.path:
+                tmp_path = f"{self.path}.tmp"
+                try:
+                    with open(tmp_path, 'w') as f:
+                        json.dump(self.entries, f)
+                    os.replace(tmp_path, self.path)
+                except OSError as e:
+                    self.logger.warning(f"Failed to write discovery cache {self.path}: {e}")
+        
+        return items
+
+
+class DateWindow:
+    """Maps the nights of the target window to bit offsets"""
+    
+    __slots__ = ('start', 'days', 'full_mask', '_offsets')
+    
+    def __init__(self, start_date: str, end_date: str):
+        """Cover every night from `start_date` through `end_date` inclusive"""
+        self.start = date.fromisoformat(start_date)
+        self.days = (date.fromisoformat(end_date) - self.start).days + 1
+        self.full_mask = (1 << self.days) - 1
+        self._offsets = {}
+    
+    def offset(self, date_str: str) -> int:
+        """Bit offset of an ISO date (or datetime) string, or -1 outside the window"""
+        offset = self._offsets.get(date_str)
+        if offset is None:
+            offset = (date.fromisoformat(date_str[:10]) - self.start).days
+            if not 0 <= offset < self.days:
+                offset = -1
+            self._offsets[date_str] = offset
+        return offset
+    
+    def range_mask(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> int:
+        """Bits for the nights from `start_date` through `end_date`, clamped to the window"""
+        first = (date.fromisoformat(start_date) - self.start).days if start_date else 0
+        last = (date.fromisoformat(end_date) - self.start).days if end_date else self.days - 1
+        first, last = max(first, 0), min(last, self.days - 1)
+        if first > last:
+            return 0
+        return ((1 << (last - first + 1)) - 1) << first
+    
+    def translate(self, mask: int, source: 'DateWindow') -> int:
+        """Re-lay a mask built on `source` onto this window, dropping nights outside it"""
+        shift = (source.start - self.start).days
+        mask = mask << shift if shift >= 0 else mask >> -shift
+        return mask & self.full_mask
+    
+    def date(self, offset: int) -> str:
+        """ISO date for a bit offset"""
+        return (self.start + timedelta(days=offset)).isoformat()
+    
+    def dates(self, mask: int) -> List[str]:
+        """ISO dates of every set bit, in order"""
+        dates = []
+        while mask:
+            low_bit = mask & -mask
+            dates.append(self.date(low_bit.bit_length() - 1))
+            mask ^= low_bit
+        return dates
+    
+    @staticmethod
+    def runs(mask: int) -> List[tuple]:
+        """(first, last) bit offsets of each run of consecutive set bits, in order"""
+        runs = []
+        offset = 0
+        while mask:
+            gap = (mask & -mask).bit_length() - 1
+            mask >>= gap
+            offset += gap
+            length = (mask ^ (mask + 1)).bit_length() - 1
+            runs.append((offset, offset + length - 1))
+            mask >>= length
+            offset += length
+        return runs
+
+
+class SiteAvailability:
+    """Compact availability for one campsite: one bit per night of the window.
+    
+    Supports item access for the keys the old result dicts had, so
+    notification templates can keep using site['available_dates'].
+    """
+    
+    __slots__ = ('campground_id', 'campground_name', 'site_id', 'site_name',
+                 'site_type', 'loop', 'mask', 'window')
+    
+    FIELDS = ('campground_name', 'campground_id', 'site_name', 'site_id',
+              'site_type', 'loop', 'available_dates')
+    
+    def __init__(self, campground_id: str, campground_name: str, site_id: str,
+                 site_name: str, mask: int, window: DateWindow,
+                 site_type: Optional[str] = None, loop: Optional[str] = None):
+        """Create a record; bit N of `mask` is night N of `window`"""
+        self.campground_id = campground_id
+        self.campground_name = campground_name
+        self.site_id = site_id
+        self.site_name = site_name
+        self.site_type = site_type
+        self.loop = loop
+        self.mask = mask
+        self.window = window
+    
+    @property
+    def available_dates(self) -> List[str]:
+        """ISO dates available at this site"""
+        return self.window.dates(self.mask)
+    
+    def with_mask(self, mask: int) -> 'SiteAvailability':
+        """Copy of this record with a different availability mask"""
+        return SiteAvailability(
+            self.campground_id, self.campground_name, self.site_id,
+            self.site_name, mask, self.window, self.site_type, self.loop
+        )
+    
+    def on_window(self, window: DateWindow) -> 'SiteAvailability':
+        """Copy of this record laid out on another window"""
+        if window is self.window:
+            return self
+        return SiteAvailability(
+            self.campground_id, self.campground_name, self.site_id, self.site_name,
+            window.translate(self.mask, self.window), window, self.site_type, self.loop
+        )
+    
+    def to_dict(self) -> Dict:
+        """Plain dict form, as returned before the compact representation"""
+        return {field: getattr(self, field) for field in self.FIELDS}
+    
+    def __getitem__(self, key: str):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __repr__(self) -> str:
+        return f"SiteAvailability({self.campground_id}/{self.site_id}, {bin(self.mask)})"
+
+
+class PermitAvailability:
+    """Compact availability for one permit division (a trailhead or entry point).
+    
+    Bit N of `mask` is set when night N of the window has enough quota
+    left; `remaining` maps those bit offsets to the quota left. Supports
+    item access like SiteAvailability.
+    """
+    
+    __slots__ = ('permit_id', 'permit_name', 'division_id', 'division_name',
+                 'mask', 'remaining', 'window')
+    
+    FIELDS = ('permit_name', 'permit_id', 'division_name', 'division_id',
+              'available_dates', 'quota')
+    
+    def __init__(self, permit_id: str, permit_name: str, division_id: str,
+                 division_name: str, mask: int, window: DateWindow,
+                 remaining: Optional[Dict[int, int]] = None):
+        """Create a record; bit N of `mask` is night N of `window`"""
+        self.permit_id = permit_id
+        self.permit_name = permit_name
+        self.division_id = division_id
+        self.division_name = division_name
+        self.mask = mask
+        self.remaining = remaining or {}
+        self.window = window
+    
+    @property
+    def available_dates(self) -> List[str]:
+        """ISO dates with quota left at this division"""
+        return self.window.dates(self.mask)
+    
+    @property
+    def quota(self) -> Dict[str, int]:
+        """Quota left on each available date"""
+        offset = self.window.offset
+        return {date_str: self.remaining.get(offset(date_str), 0) for date_str in self.available_dates}
+    
+    def with_mask(self, mask: int, remaining: Optional[Dict[int, int]] = None) -> 'PermitAvailability':
+        """Copy of this record with a different availability mask"""
+        if remaining is None:
+            remaining = {bit: left for bit, left in self.remaining.items() if mask >> bit & 1}
+        return PermitAvailability(
+            self.permit_id, self.permit_name, self.division_id,
+            self.division_name, mask, self.window, remaining
+        )
+    
+    def on_window(self, window: DateWindow) -> 'PermitAvailability':
+        """Copy of this record laid out on another window"""
+        if window is self.window:
+            return self
+        shift = (self.window.start - window.start).days
+        remaining = {bit + shift: left for bit, left in self.remaining.items()
+                     if 0 <= bit + shift < window.days}
+        return PermitAvailability(
+            self.permit_id, self.permit_name, self.division_id, self.division_name,
+            window.translate(self.mask, self.window), window, remaining
+        )
+    
+    def to_dict(self) -> Dict:
+        """Plain dict form"""
+        return {field: getattr(self, field) for field in self.FIELDS}
+    
+    def __getitem__(self, key: str):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __repr__(self) -> str:
+        return f"PermitAvailability({self.permit_id}/{self.division_id}, {bin(self.mask)})"
+
+
+class StayQuery:
+    """One stay a park is watched for: N consecutive nights at matching sites"""
+    
+    __slots__ = ('min_nights', 'site_types', 'loops', 'nights_mask')
+    
+    def __init__(self, query_config: dict, window: DateWindow):
+        """Build from a `stay_queries` entry in a park's config"""
+        self.min_nights = max(1, int(query_config.get('min_nights', 1)))
+        self.site_types = {t.upper() for t in query_config.get('site_types', [])}
+        self.loops = {l.upper() for l in query_config.get('loops', [])}
+        # end_date is the last night of the stay, matching target_dates
+        self.nights_mask = window.range_mask(
+            query_config.get('start_date'), query_config.get('end_date')
+        )
+    
+    def accepts(self, site: SiteAvailability) -> bool:
+        """Whether a site's type and loop pass this query's filters"""
+        if self.site_types and (site.site_type or '').upper() not in self.site_types:
+            return False
+        if self.loops and (site.loop or '').upper() not in self.loops:
+            return False
+        return True
+
+
+class StayQueryEngine:
+    """Finds runs of consecutive available nights across many sites at once.
+    
+    Candidate site masks are packed side by side into one integer, with a
+    zero guard bit between sites so runs never span two of them. Each
+    query is then a handful of shift-and-AND steps over the packed value,
+    taking O(log N) big-integer operations for a stay of N nights no
+    matter how many sites are searched.
+    """
+    
+    def __init__(self, queries: List[StayQuery], window: DateWindow):
+        """Answer `queries` over masks laid out on `window`"""
+        self.queries = queries
+        self.window = window
+        self.stride = window.days + 1
+    
+    def match(self, sites: List[SiteAvailability]) -> Dict[tuple, int]:
+        """Return {(campground_id, site_id): nights covered by a qualifying stay}"""
+        matches = {}
+        
+        for query in self.queries:
+            candidates = [site for site in sites if site.mask & query.nights_mask and query.accepts(site)]
+            if not candidates:
+                continue
+            
+            packed = 0
+            for index, site in enumerate(candidates):
+                packed |= (site.mask & query.nights_mask) << (index * self.stride)
+            
+            covered = self._covered_by_runs(packed, query.min_nights)
+            if not covered:
+                continue
+            
+            for index, site in enumerate(candidates):
+                nights = (covered >> (index * self.stride)) & self.window.full_mask
+                if nights:
+                    key = (site.campground_id, site.site_id)
+                    matches[key] = matches.get(key, 0) | nights
+        
+        return matches
+    
+    @staticmethod
+    def _covered_by_runs(mask: int, nights: int) -> int:
+        """Bits of `mask` that belong to a run of at least `nights` set bits"""
+        # Bit i of `starts` is set when bits i .. i+span-1 are all set
+        starts, span = mask, 1
+        while span * 2 <= nights:
+            starts &= starts >> span
+            span *= 2
+        if span < nights:
+            starts &= starts >> (nights - span)
+        
+        # Smear each run start forward over the nights it covers
+        covered, span = starts, 1
+        while span * 2 <= nights:
+            covered |= covered << span
+            span *= 2
+        if span < nights:
+            covered |= covered << (nights - span)
+        
+        return covered & mask
+
+
+class HistoryColumns:
+    """One campground's availability transitions as parallel columns, oldest first.
+    
+    Sites are dictionary-encoded, dates are day ordinals and times are
+    epoch milliseconds. Stored segments delta-encode the day and time
+    columns and zlib each column separately, so a season of transitions
+    compresses to a few bytes per row and decodes at C speed via array.
+    """
+    
+    __slots__ = ('site_ids', 'sites', 'days', 'times', 'opened', '_site_index')
+    
+    def __init__(self):
+        """Start with no rows"""
+        self.site_ids = []
+        self.sites = array('I')
+        self.days = array('i')
+        self.times = array('q')
+        self.opened = bytearray()
+        self._site_index = {}
+    
+    def __len__(self) -> int:
+        return len(self.times)
+    
+    def append(self, site_id: str, day: int, time_ms: int, opened: bool):
+        """Add one transition, newer than every row already held"""
+        index = self._site_index.get(site_id)
+        if index is None:
+            index = self._site_index[site_id] = len(self.site_ids)
+            self.site_ids.append(site_id)
+        self.sites.append(index)
+        self.days.append(day)
+        self.times.append(time_ms)
+        self.opened.append(1 if opened else 0)
+    
+    def extend(self, other: 'HistoryColumns'):
+        """Append every row of a newer `other`, remapping its site dictionary"""
+        if not self.site_ids:
+            remap = None
+            self.site_ids = list(other.site_ids)
+            self._site_index = {site_id: i for i, site_id in enumerate(self.site_ids)}
+        else:
+            remap = []
+            for site_id in other.site_ids:
+                index = self._site_index.get(site_id)
+                if index is None:
+                    index = self._site_index[site_id] = len(self.site_ids)
+                    self.site_ids.append(site_id)
+                remap.append(index)
+        
+        self.sites.extend(other.sites if remap is None else array('I', map(remap.__getitem__, other.sites)))
+        self.days.extend(other.days)
+        self.times.extend(other.times)
+        self.opened.extend(other.opened)
+    
+    def encode(self) -> tuple:
+        """Compress into (site_ids, sites, days, times, opened) blobs"""
+        return (
+            zlib.compress('\n'.join(self.site_ids).encode()),
+            zlib.compress(self._pack(self.sites)),
+            zlib.compress(self._pack(array('i', self._deltas(self.days)))),
+            zlib.compress(self._pack(array('q', self._deltas(self.times)))),
+            zlib.compress(bytes(self.opened))
+        )
+    
+    @classmethod
+    def decode(cls, site_ids: bytes, sites: bytes, days: bytes, times: bytes,
+               opened: bytes) -> 'HistoryColumns':
+        """Rebuild columns from blobs written by encode()"""
+        columns = cls()
+        names = zlib.decompress(site_ids).decode()
+        columns.site_ids = names.split('\n') if names else []
+        columns._site_index = {site_id: i for i, site_id in enumerate(columns.site_ids)}
+        columns.sites = cls._unpack('I', zlib.decompress(sites))
+        columns.days = array('i', itertools.accumulate(cls._unpack('i', zlib.decompress(days))))
+        columns.times = array('q', itertools.accumulate(cls._unpack('q', zlib.decompress(times))))
+        columns.opened = bytearray(zlib.decompress(opened))
+        return columns
+    
+    def since(self, since_ms: int) -> 'HistoryColumns':
+        """Rows at or after `since_ms`, sharing this segment's site dictionary"""
+        start = bisect.bisect_left(self.times, since_ms)
+        if start == 0:
+            return self
+        
+        columns = HistoryColumns()
+        columns.site_ids = self.site_ids
+        columns._site_index = self._site_index
+        columns.sites = self.sites[start:]
+        columns.days = self.days[start:]
+        columns.times = self.times[start:]
+        columns.opened = self.opened[start:]
+        return columns
+    
+    @staticmethod
+    def _deltas(values: array) -> list:
+        """Each value minus the one before it (the first is kept as is)"""
+        return [current - previous for previous, current in zip(itertools.chain((0,), values), values)]
+    
+    @staticmethod
+    def _pack(values: array) -> bytes:
+        """Serialize an array little-endian"""
+        if sys.byteorder == 'big':
+            values = array(values.typecode, values)
+            values.byteswap()
+        return values.tobytes()
+    
+    @staticmethod
+    def _unpack(typecode: str, data: bytes) -> array:
+        """Inverse of _pack"""
+        values = array(typecode)
+        values.frombytes(data)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+
+class AvailabilityStore:
+    """SQLite index of (campground_id, site_id, date) -> status with a change log.
+    
+    The change log is append-only. compact() periodically moves it into
+    per-campground columnar segments (see HistoryColumns), which the
+    analytics queries decode without going through SQL row by row.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS availability (
+            campground_id TEXT NOT NULL,
+            site_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (campground_id, site_id, date)
+        ) WITHOUT ROWID;
+        
+        CREATE TABLE IF NOT EXISTS changes (
+            id INTEGER PRIMARY KEY,
+            campground_id TEXT NOT NULL,
+            site_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            changed_at REAL NOT NULL
+        );
+        
+        CREATE INDEX IF NOT EXISTS idx_changes_changed_at ON changes (changed_at);
+        
+        CREATE TABLE IF NOT EXISTS history_segments (
+            id INTEGER PRIMARY KEY,
+            campground_id TEXT NOT NULL,
+            first_at REAL NOT NULL,
+            last_at REAL NOT NULL,
+            row_count INTEGER NOT NULL,
+            site_ids BLOB NOT NULL,
+            sites BLOB NOT NULL,
+            days BLOB NOT NULL,
+            times BLOB NOT NULL,
+            opened BLOB NOT NULL
+        );
+        
+        CREATE INDEX IF NOT EXISTS idx_history_segments ON history_segments (campground_id, last_at);
+    """
+    
+    AVAILABLE = 'Available'
+    UNAVAILABLE = 'Unavailable'
+    
+    def __init__(self, path: str):
+        """Open (or create) the database at `path`"""
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+        self.uncompacted = self.conn.execute('SELECT COUNT(*) FROM changes').fetchone()[0]
+    
+    def load_open(self) -> List[tuple]:
+        """Return every (campground_id, site_id, date) currently marked available"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT campground_id, site_id, date FROM availability WHERE status = ?',
+                (self.AVAILABLE,)
+            ).fetchall()
+    
+    def record_changes(self, changes: List[tuple]):
+        """Apply one cycle's (campground_id, site_id, date, status) changes in a single transaction"""
+        if not changes:
+            return
+        
+        now = time.time()
+        rows = [change + (now,) for change in changes]
+        
+        with self.lock, self.conn:
+            self.conn.executemany("""
+                INSERT INTO availability (campground_id, site_id, date, status, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (campground_id, site_id, date)
+                DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at
+            """, rows)
+            self.conn.executemany("""
+                INSERT INTO changes (campground_id, site_id, date, status, changed_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
+            self.uncompacted += len(rows)
+    
+    def changes_since(self, since: float) -> List[Dict]:
+        """Return every status change recorded after the `since` timestamp, oldest first.
+        
+        Times are kept to the millisecond, so passing the last change's
+        `changed_at` back as `since` returns each change exactly once.
+        """
+        since_ms = round(since * 1000)
+        changes = [
+            {
+                'campground_id': campground_id,
+                'site_id': columns.site_ids[site],
+                'date': date.fromordinal(day).isoformat(),
+                'status': self.AVAILABLE if opened else self.UNAVAILABLE,
+                'changed_at': time_ms / 1000
+            }
+            for campground_id, columns in self.history(since=since).items()
+            for site, day, time_ms, opened in zip(columns.sites, columns.days, columns.times, columns.opened)
+            if time_ms > since_ms
+        ]
+        changes.sort(key=lambda change: change['changed_at'])
+        return changes
+    
+    def compact(self, max_segments: int = 8) -> int:
+        """Move the change log into columnar segments, returning the rows moved.
+        
+        Each call writes one segment per campground in the log. A campground
+        with more than `max_segments` segments has them merged into one, so
+        a long season stays a handful of blobs per campground.
+        """
+        with self.lock, self.conn:
+            rows = self.conn.execute("""
+                SELECT id, campground_id, site_id, date, status, changed_at FROM changes ORDER BY id
+            """).fetchall()
+            if not rows:
+                return 0
+            
+            segments = {}
+            for _, campground_id, site_id, date_str, status, changed_at in rows:
+                if not date_str:
+                    # Permits were once tracked without dates; there is nothing to analyze
+                    continue
+                columns = segments.get(campground_id)
+                if columns is None:
+                    columns = segments[campground_id] = HistoryColumns()
+                columns.append(site_id, date.fromisoformat(date_str).toordinal(),
+                               round(changed_at * 1000), status == self.AVAILABLE)
+            
+            for campground_id, columns in segments.items():
+                self._insert_segment(campground_id, columns)
+            self.conn.execute('DELETE FROM changes WHERE id <= ?', (rows[-1][0],))
+            self.uncompacted = 0
+            
+            fragmented = self.conn.execute("""
+                SELECT campground_id FROM history_segments
+                GROUP BY campground_id HAVING COUNT(*) > ?
+            """, (max_segments,)).fetchall()
+            for (campground_id,) in fragmented:
+                merged, ids = HistoryColumns(), []
+                for segment_id, *blobs in self.conn.execute("""
+                    SELECT id, site_ids, sites, days, times, opened FROM history_segments
+                    WHERE campground_id = ? ORDER BY first_at, id
+                """, (campground_id,)):
+                    merged.extend(HistoryColumns.decode(*blobs))
+                    ids.append(segment_id)
+                self.conn.executemany('DELETE FROM history_segments WHERE id = ?', [(i,) for i in ids])
+                self._insert_segment(campground_id, merged)
+        
+        return len(rows)
+    
+    def history(self, campground_id: Optional[str] = None, since: float = 0) -> Dict[str, HistoryColumns]:
+        """Every transition at or after `since`, as columns per campground (or permit key)"""
+        segments_query = """
+            SELECT campground_id, site_ids, sites, days, times, opened
+            FROM history_segments WHERE last_at >= ?
+        """
+        changes_query = """
+            SELECT campground_id, site_id, date, status, changed_at
+            FROM changes WHERE changed_at >= ?
+        """
+        params = (since,)
+        if campground_id is not None:
+            segments_query += ' AND campground_id = ?'
+            changes_query += ' AND campground_id = ?'
+            params += (campground_id,)
+        
+        with self.lock:
+            segments = self.conn.execute(segments_query + ' ORDER BY first_at, id', params).fetchall()
+            rows = self.conn.execute(changes_query + ' ORDER BY id', params).fetchall()
+        
+        since_ms = round(since * 1000)
+        history = {}
+        for key, *blobs in segments:
+            self._merge_history(history, key, HistoryColumns.decode(*blobs).since(since_ms))
+        
+        # Rows not compacted yet are newer than every segment
+        recent = {}
+        for key, site_id, date_str, status, changed_at in rows:
+            if date_str:
+                recent.setdefault(key, HistoryColumns()).append(
+                    site_id, date.fromisoformat(date_str).toordinal(),
+                    round(changed_at * 1000), status == self.AVAILABLE
+                )
+        for key, columns in recent.items():
+            self._merge_history(history, key, columns)
+        
+        return history
+    
+    def openings_by_hour(self, campground_id: Optional[str] = None, since: float = 0) -> Dict[str, List[int]]:
+        """Count openings per campground by local hour of day (24 buckets)"""
+        result = {}
+        for key, columns in self.history(campground_id, since).items():
+            # Count per quarter hour, which every UTC offset is a multiple of, then localize
+            quarters = Counter(
+                time_ms // 900_000 for time_ms in itertools.compress(columns.times, columns.opened)
+            )
+            hours = [0] * 24
+            for quarter, count in quarters.items():
+                hours[time.localtime(quarter * 900).tm_hour] += count
+            result[key] = hours
+        return result
+    
+    def time_to_rebook(self, campground_id: Optional[str] = None,
+                       since: float = 0) -> Dict[str, Optional[float]]:
+        """Median milliseconds a night stayed open before it was booked again, per campground"""
+        import statistics
+        
+        result = {}
+        for key, columns in self.history(campground_id, since).items():
+            opened_at = {}
+            durations = []
+            for site, day, time_ms, opened in zip(columns.sites, columns.days, columns.times, columns.opened):
+                night = (site, day)
+                if opened:
+                    opened_at[night] = time_ms
+                elif night in opened_at:
+                    durations.append(time_ms - opened_at.pop(night))
+            result[key] = statistics.median(durations) if durations else None
+        return result
+    
+    @staticmethod
+    def _merge_history(history: Dict[str, HistoryColumns], key: str, columns: HistoryColumns):
+        """Append newer `columns` to `key`'s history"""
+        if key in history:
+            history[key].extend(columns)
+        else:
+            history[key] = columns
+    
+    def _insert_segment(self, campground_id: str, columns: HistoryColumns):
+        """Write one segment; the caller holds the lock and transaction"""
+        self.conn.execute("""
+            INSERT INTO history_segments
+                (campground_id, first_at, last_at, row_count, site_ids, sites, days, times, opened)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (campground_id, columns.times[0] / 1000, columns.times[-1] / 1000, len(columns))
+            + columns.encode())
+    
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            self.conn.close()
+
+
+class TransportConnection:
+    """Mixin for urllib3 connections that counts new connections and resolves through a DNS cache"""
+    
+    transport = None  # Set on the per-transport subclasses HttpTransport builds
+    
+    def _new_conn(self):
+        transport = self.transport
+        transport.metrics.inc('parkmonitor_http_connections_opened_total', host=self.host)
+        if not transport.dns_ttl:
+            return super()._new_conn()
+        
+        host = self._dns_host
+        try:
+            addresses = transport.resolve(host, self.port)
+        except OSError:
+            addresses = []
+        
+        try:
+            # Try each address in order, as socket.create_connection does
+            for address in addresses:
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except (OSError, ConnectTimeoutError):
+                    continue
+            # Every cached address failed and may be stale; resolve afresh once
+            transport.forget(host, self.port)
+            self._dns_host = host
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+
+
+class TransportAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools use an HttpTransport's counting, DNS-caching connections"""
+    
+    def __init__(self, transport: 'HttpTransport', **kwargs):
+        """Pool connections for `transport`; other arguments go to HTTPAdapter"""
+        self.transport = transport
+        super().__init__(**kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self.transport.pool_classes
+    
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        """Send a request, counting it towards connection reuse"""
+        self.transport.metrics.inc('parkmonitor_http_transport_requests_total')
+        return super().send(request, **kwargs)
+
+
+class Http2Adapter(BaseAdapter):
+    """Sends requests through an httpx client that multiplexes them over HTTP/2"""
+    
+    # Connection-specific headers are not allowed in HTTP/2
+    HOP_BY_HOP = ('Connection', 'Keep-Alive', 'Proxy-Connection', 'Transfer-Encoding', 'Upgrade')
+    
+    def __init__(self, transport: 'HttpTransport', max_connections: int):
+        """Prepare HTTP/2 clients; raises ImportError without httpx[http2]"""
+        import httpx
+        from importlib.util import find_spec
+        
+        # Clients are opened on first use, so check for HTTP/2 support now
+        if find_spec('h2') is None:
+            raise ImportError("HTTP/2 support needs the h2 package")
+        
+        super().__init__()
+        self.httpx = httpx
+        self.transport = transport
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections if transport.keep_alive else 0
+        )
+        self.clients = {}  # (verify, cert, proxy) -> httpx.Client
+        self.lock = threading.Lock()
+    
+    def send(self, request: requests.PreparedRequest, stream: bool = False, timeout=None,
+             verify=True, cert=None, proxies=None) -> requests.Response:
+        """Send a prepared request and wrap the reply as a requests.Response.
+        
+        `verify`, `cert` and `proxies` mean what they do for HTTPAdapter.
+        httpx fixes them per client, so one client is kept per combination.
+        """
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        headers = [(name, value) for name, value in request.headers.items() if name not in self.HOP_BY_HOP]
+        client = self._client(verify, cert, requests.utils.select_proxy(request.url, proxies))
+        try:
+            reply = client.request(
+                request.method, request.url, headers=headers, content=request.body,
+                timeout=self.httpx.Timeout(read, connect=connect)
+            )
+        except self.httpx.TimeoutException as e:
+            raise requests.Timeout(e, request=request) from e
+        except self.httpx.TransportError as e:
+            raise requests.ConnectionError(e, request=request) from e
+        
+        self.transport.metrics.inc('parkmonitor_httpx_requests_total', protocol=reply.http_version)
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.connection = self
+        response.status_code = reply.status_code
+        response.reason = reply.reason_phrase
+        response.elapsed = reply.elapsed
+        # httpx has already decoded gzip/brotli bodies
+        response.headers = CaseInsensitiveDict(
+            (name, value) for name, value in reply.headers.items() if name.lower() != 'content-encoding'
+        )
+        response._content = reply.content
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+    
+    def _client(self, verify, cert, proxy: Optional[str]):
+        """The client for one set of TLS and proxy settings, opened on first use"""
+        key = (verify, tuple(cert) if isinstance(cert, list) else cert, proxy)
+        with self.lock:
+            client = self.clients.get(key)
+            if client is None:
+                # Session settings and environment proxies were merged by requests already
+                client = self.clients[key] = self.httpx.Client(
+                    http2=True, limits=self.limits, verify=self._ssl_context(verify, key[1]),
+                    proxy=proxy, trust_env=False
+                )
+        return client
+    
+    @staticmethod
+    def _ssl_context(verify, cert):
+        """An SSL context for requests-style `verify` and `cert` arguments"""
+        import ssl
+        
+        if verify is False:
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        elif isinstance(verify, str) and os.path.isdir(verify):
+            context = ssl.create_default_context(capath=verify)
+        else:
+            # Same CA bundle as requests uses
+            context = ssl.create_default_context(
+                cafile=verify if isinstance(verify, str) else requests.certs.where()
+            )
+        
+        if isinstance(cert, tuple):
+            context.load_cert_chain(*cert)
+        elif cert:
+            context.load_cert_chain(cert)
+        return context
+    
+    def close(self):
+        """Close the HTTP/2 connections"""
+        with self.lock:
+            clients, self.clients = self.clients, {}
+        for client in clients.values():
+            client.close()
+
+
+class HttpTransport:
+    """Builds the requests sessions that every outbound HTTP call goes through.
+    
+    The connection pools are sized for the fetch concurrency and keep
+    connections alive. Responses are negotiated as gzip, or brotli when
+    the brotli package is installed. Resolved addresses are cached, and
+    new connections are counted so reuse shows up in the metrics. With
+    httpx[http2] installed and `http2` on, requests to the API host are
+    multiplexed over HTTP/2. The webhook and Twilio clients get sessions
+    from the same transport. mount() swaps in another adapter, such as
+    the record/replay adapters or a local stand-in in tests.
+    """
+    
+    def __init__(self, config: dict, logger: logging.Logger, metrics: Metrics,
+                 pool_connections: int = 10, pool_maxsize: int = 10):
+        """Configure pools from the `transport` section, defaulting to the given sizes"""
+        self.logger = logger
+        self.metrics = metrics
+        self.pool_connections = config.get('pool_connections', pool_connections)
+        self.pool_maxsize = config.get('pool_maxsize', pool_maxsize)
+        self.pool_block = config.get('pool_block', False)
+        self.keep_alive = config.get('keep_alive', True)
+        self.compression = config.get('compression', True)
+        self.http2 = config.get('http2', False)
+        self.dns_ttl = config.get('dns_cache_seconds', 300)
+        
+        self.dns = {}  # (host, port) -> ([addresses], expires at)
+        self.sessions = []
+        self.lock = threading.Lock()
+        
+        # Connection pools whose connections report back to this transport
+        self.pool_classes = {
+            'http': type('TransportHTTPConnectionPool', (HTTPConnectionPool,), {
+                'ConnectionCls': type('TransportHTTPConnection', (TransportConnection, HTTPConnection),
+                                      {'transport': self})
+            }),
+            'https': type('TransportHTTPSConnectionPool', (HTTPSConnectionPool,), {
+                'ConnectionCls': type('TransportHTTPSConnection', (TransportConnection, HTTPSConnection),
+                                      {'transport': self})
+            })
+        }
+    
+    def session(self, api_url: Optional[str] = None) -> requests.Session:
+        """A new pooled session; `api_url` is the host to try HTTP/2 with"""
+        session = requests.Session()
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        if not self.compression:
+            session.headers['Accept-Encoding'] = 'identity'
+        
+        self.mount(session, self.adapter())
+        if api_url and self.http2 and urlparse(api_url).scheme == 'https':
+            try:
+                prefix = '{0.scheme}://{0.netloc}'.format(urlparse(api_url))
+                session.mount(prefix, Http2Adapter(self, self.pool_maxsize))
+            except ImportError:
+                self.logger.warning("HTTP/2 needs httpx with HTTP/2 support: pip install 'httpx[http2]'")
+        
+        with self.lock:
+            self.sessions.append(session)
+        return session
+    
+    def adapter(self) -> TransportAdapter:
+        """A pooled HTTP/1.1 adapter"""
+        return TransportAdapter(self, pool_connections=self.pool_connections,
+                                pool_maxsize=self.pool_maxsize, pool_block=self.pool_block)
+    
+    @staticmethod
+    def mount(session: requests.Session, adapter: BaseAdapter):
+        """Route every request of `session` through `adapter`, replacing its current adapters"""
+        for previous in session.adapters.values():
+            if previous is not adapter:
+                previous.close()
+        session.adapters.clear()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+    
+    def resolve(self, host: str, port: int) -> List[str]:
+        """Addresses to try in order for `host`, from the cache while it is fresh"""
+        now = time.monotonic()
+        with self.lock:
+            cached = self.dns.get((host, port))
+        if cached and cached[1] > now:
+            self.metrics.inc('parkmonitor_dns_lookups_total', result='hit')
+            return cached[0]
+        
+        # Keep getaddrinfo's order, which puts the preferred address family first
+        addresses = list(dict.fromkeys(
+            info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        ))
+        self.metrics.inc('parkmonitor_dns_lookups_total', result='miss')
+        with self.lock:
+            self.dns[(host, port)] = (addresses, now + self.dns_ttl)
+        return addresses
+    
+    def forget(self, host: str, port: int):
+        """Drop a cached address that failed to connect"""
+        with self.lock:
+            self.dns.pop((host, port), None)
+    
+    def stats(self) -> Dict[str, float]:
+        """Pooled requests and connections, the share of requests on a reused connection and DNS cache hits.
+        
+        Requests sent through httpx are counted by protocol on their own,
+        since httpx does not report the connections it opens.
+        """
+        sent = sum(self.metrics.counter_values('parkmonitor_http_transport_requests_total').values())
+        opened = sum(self.metrics.counter_values('parkmonitor_http_connections_opened_total').values())
+        lookups = self.metrics.counter_values('parkmonitor_dns_lookups_total')
+        httpx = self.metrics.counter_values('parkmonitor_httpx_requests_total')
+        return {
+            'requests': sent,
+            'connections': opened,
+            'reuse_ratio': round(1 - opened / sent, 3) if sent else 0.0,
+            'http2_requests': httpx.get((('protocol', 'HTTP/2'),), 0),
+            'httpx_requests': sum(httpx.values()),
+            'dns_hits': lookups.get((('result', 'hit'),), 0),
+            'dns_misses': lookups.get((('result', 'miss'),), 0)
+        }
+    
+    def close(self):
+        """Close every session's pooled connections"""
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        for session in sessions:
+            session.close()
+
+
+class HttpArchive:
+    """Compressed SQLite archive of API responses for record/replay runs.
+    
+    Responses are keyed by method, path and sorted query string (not host,
+    so an archive replays against any base_url) plus a per-key sequence
+    number. Replaying hands out each key's responses in recorded order and
+    then keeps repeating the last one.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            reason TEXT,
+            headers TEXT NOT NULL,
+            body BLOB NOT NULL,
+            recorded_at REAL NOT NULL,
+            PRIMARY KEY (key, seq)
+        ) WITHOUT ROWID;
+    """
+    
+    # Bodies are stored decoded, so these no longer describe them
+    DROP_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+    
+    def __init__(self, path: str):
+        """Open (or create) the archive at `path`"""
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+        self.next_seq = dict(self.conn.execute('SELECT key, MAX(seq) + 1 FROM responses GROUP BY key'))
+        self.cursors = {}  # key -> next sequence number to replay
+    
+    @staticmethod
+    def key(request: requests.PreparedRequest) -> str:
+        """Identify a request by method, path and sorted query parameters"""
+        url = urlparse(request.url)
+        query = urlencode(sorted(parse_qsl(url.query, keep_blank_values=True)))
+        return f"{request.method} {url.path}?{query}"
+    
+    def record(self, request: requests.PreparedRequest, response: requests.Response):
+        """Append a response to the archive"""
+        key = self.key(request)
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower() not in self.DROP_HEADERS}
+        body = zlib.compress(response.content)
+        
+        with self.lock, self.conn:
+            seq = self.next_seq.get(key, 0)
+            self.next_seq[key] = seq + 1
+            self.conn.execute(
+                'INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, seq, request.url, response.status_code, response.reason,
+                 json.dumps(headers), body, time.time())
+            )
+    
+    def replay(self, request: requests.PreparedRequest) -> Optional[tuple]:
+        """Return the next (status, reason, headers, body) recorded for a request"""
+        key = self.key(request)
+        
+        with self.lock:
+            seq = self.cursors.get(key, 0)
+            row = self.conn.execute(
+                'SELECT seq, status, reason, headers, body FROM responses '
+                'WHERE key = ? AND seq <= ? ORDER BY seq DESC LIMIT 1',
+                (key, seq)
+            ).fetchone()
+            if row is None:
+                return None
+            self.cursors[key] = row[0] + 1
+        
+        _, status, reason, headers, body = row
+        return status, reason, json.loads(headers), zlib.decompress(body)
+    
+    def close(self):
+        """Close the archive"""
+        with self.lock:
+            self.conn.close()
+
+
+class RecordingAdapter(HTTPAdapter):
+    """HTTP adapter that saves every response it receives to an HttpArchive"""
+    
+    CONDITIONAL_HEADERS = ('If-None-Match', 'If-Modified-Since')
+    
+    def __init__(self, archive: HttpArchive, **kwargs):
+        """Record into `archive`; other arguments go to HTTPAdapter"""
+        self.archive = archive
+        super().__init__(**kwargs)
+    
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        """Send a request and archive the full response"""
+        # Always fetch full bodies so the archive can answer any replay on its own
+        for name in self.CONDITIONAL_HEADERS:
+            request.headers.pop(name, None)
+        
+        response = super().send(request, **kwargs)
+        self.archive.record(request, response)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """HTTP adapter that answers requests from an HttpArchive with no network I/O"""
+    
+    def __init__(self, archive: HttpArchive):
+        """Replay from `archive`"""
+        super().__init__()
+        self.archive = archive
+    
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        """Build the next recorded response for a request"""
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.connection = self
+        response.elapsed = timedelta(0)
+        
+        recorded = self.archive.replay(request)
+        if recorded is None:
+            response.status_code, response.reason, headers, body = 404, 'Not Recorded', {}, b''
+        else:
+            response.status_code, response.reason, headers, body = recorded
+        response.headers = CaseInsensitiveDict(headers)
+        
+        # Answer conditional requests like the live API would
+        etag = response.headers.get('ETag')
+        if response.status_code == 200 and etag and request.headers.get('If-None-Match') == etag:
+            response.status_code, response.reason, body = 304, 'Not Modified', b''
+        
+        response._content = body
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+    
+    def close(self):
+        """Nothing to release; the archive is closed by its owner"""
+
+
+class FetchUnitCache:
+    """Validators, content hashes and parsed results for each fetch unit.
+    
+    A fetch unit is one (campground_id, month) slice of the target window.
+    Unchanged units are answered from here, either because the server sent
+    304 Not Modified or because the body hashes to the same digest as last
+    time, so their payload is never parsed again.
+    """
+    
+    def __init__(self):
+        """Start with no cached units"""
+        self.units = {}
+        self.lock = threading.Lock()
+    
+    def conditional_headers(self, key: tuple) -> dict:
+        """Build If-None-Match/If-Modified-Since headers for a unit"""
+        with self.lock:
+            unit = self.units.get(key)
+        
+        headers = {}
+        if unit:
+            if unit['etag']:
+                headers['If-None-Match'] = unit['etag']
+            if unit['last_modified']:
+                headers['If-Modified-Since'] = unit['last_modified']
+        return headers
+    
+    def resolve(self, key: tuple, response: requests.Response, parse) -> Optional[tuple]:
+        """Turn a unit's response into (results, changed), or None on failure.
+        
+        `parse` is only called when the payload differs from the cached one.
+        """
+        with self.lock:
+            unit = self.units.get(key)
+        
+        if response.status_code == 304 and unit:
+            return unit['results'], False
+        
+        if response.status_code != 200:
+            return None
+        
+        digest = hashlib.blake2b(response.content, digest_size=16).digest()
+        changed = not unit or unit['hash'] != digest
+        results = parse(response) if changed else unit['results']
+        
+        with self.lock:
+            self.units[key] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'hash': digest,
+                'results': results
+            }
+        
+        return results, changed
+    
+    def invalidate(self, unit_id: str):
+        """Forget every month of a campground (or permit key).
+        
+        Called when only some of its months could be fetched: the cycle
+        cannot apply closings for it, so the months that did arrive must
+        not be reported as unchanged next time either.
+        """
+        with self.lock:
+            for key in [key for key in self.units if key[0] == unit_id]:
+                del self.units[key]
+    
+    def rebase(self, window: DateWindow, keep) -> int:
+        """Drop the units `keep(key)` rejects and lay the rest out on `window`.
+        
+        Returns how many units were dropped. Kept units must cover the same
+        nights in both windows, or their cached results would be clipped.
+        """
+        dropped = 0
+        with self.lock:
+            for key in list(self.units):
+                unit = self.units[key]
+                if not keep(key):
+                    del self.units[key]
+                    dropped += 1
+                    continue
+                unit['results'] = [record.on_window(window) for record in unit['results']]
+        return dropped
+
+
+class AdaptiveScheduler:
+    """Priority queue of per-unit next-check times that adapts to observed churn.
+    
+    Units are opaque keys (one per campground, one per park's permits). A
+    unit that changed since its last check is polled twice as often, a
+    quiet one backs off towards `check_interval_minutes`. Priority
+    campgrounds and configured hot windows (e.g. the daily 7am release)
+    are held at their fast interval. Units are handed out in due order
+    only while the per-minute request budget allows it.
+    """
+    
+    SPEEDUP = 0.5
+    BACKOFF = 1.25
+    
+    def __init__(self, monitoring: dict):
+        """Configure intervals, priorities and budget from the `monitoring` section"""
+        self.max_interval = monitoring.get('check_interval_minutes', 60) * 60
+        self.min_interval = min(monitoring.get('min_interval_minutes', 1) * 60, self.max_interval)
+        self.priority_interval = monitoring.get('priority_interval_minutes', 1) * 60
+        self.priority = {str(c) for c in monitoring.get('priority_campgrounds', [])}
+        self.hot_windows = [self._parse_window(w) for w in monitoring.get('hot_windows', [])]
+        self.budget = monitoring.get(
+            'request_budget_per_minute', monitoring.get('requests_per_second', 5) * 60
+        )
+        
+        self.heap = []  # (due, seq, key); entries whose seq is stale are skipped
+        self.seqs = {}
+        self.intervals = {}
+        self.costs = {}
+        self.spent = deque()  # (monotonic time, cost) of checks in the last minute
+        self.spent_total = 0
+        self.counter = itertools.count()
+        self.hot_active = False
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+    
+    def sync(self, costs: Dict[tuple, int]):
+        """Track exactly the units in `costs` (key -> requests per check)"""
+        now = time.monotonic()
+        
+        with self.lock:
+            for key in list(self.intervals):
+                if key not in costs:
+                    self.intervals.pop(key)
+                    self.seqs.pop(key, None)
+                    self.costs.pop(key, None)
+            
+            for key, cost in costs.items():
+                self.costs[key] = cost
+                if key not in self.intervals:
+                    interval = self._clamp(key, self.max_interval)
+                    self.intervals[key] = interval
+                    self._push(key, now + interval)
+        
+        self.wake.set()
+    
+    def pop_due(self) -> List[tuple]:
+        """Remove and return every due unit that fits in the request budget"""
+        now = time.monotonic()
+        batch = []
+        
+        with self.lock:
+            self._update_hot_window(now)
+            left = self._budget_left(now)
+            
+            while self.heap and self.heap[0][0] <= now:
+                due, seq, key = self.heap[0]
+                if self.seqs.get(key) != seq:
+                    heapq.heappop(self.heap)
+                    continue
+                
+                cost = self.costs.get(key, 1)
+                # Always let one unit through so an oversized unit cannot starve
+                if cost > left and left < self.budget:
+                    break
+                
+                heapq.heappop(self.heap)
+                del self.seqs[key]
+                left -= cost
+                self.spent.append((now, cost))
+                self.spent_total += cost
+                batch.append(key)
+        
+        return batch
+    
+    def record(self, key: tuple, changed: Optional[bool]):
+        """Reschedule a checked unit, adapting its interval to whether it changed.
+        
+        `changed` is None for a unit that could not be checked (skipped or
+        failed), which keeps its interval as it was.
+        """
+        with self.lock:
+            if key not in self.intervals:
+                return
+            
+            interval = self.intervals[key]
+            if changed is not None:
+                interval *= self.SPEEDUP if changed else self.BACKOFF
+            interval = self._clamp(key, interval)
+            self.intervals[key] = interval
+            self._push(key, time.monotonic() + interval)
+    
+    def expedite(self, keys):
+        """Make tracked units due now, e.g. ones a config reload just added"""
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                if key in self.intervals:
+                    self._push(key, now)
+        
+        self.wake.set()
+    
+    def wait(self, max_seconds: Optional[float] = None):
+        """Sleep until a unit is due, the budget frees up, wake is set or `max_seconds` pass"""
+        with self.lock:
+            timeout = self._next_wake(time.monotonic())
+        if max_seconds is not None:
+            timeout = min(timeout, max_seconds)
+        
+        self.wake.wait(timeout)
+        self.wake.clear()
+    
+    def _push(self, key: tuple, due: float):
+        """Queue `key` at `due`, superseding any earlier entry for it"""
+        seq = next(self.counter)
+        self.seqs[key] = seq
+        heapq.heappush(self.heap, (due, seq, key))
+    
+    def _clamp(self, key: tuple, interval: float) -> float:
+        """Bound an interval by the configured limits, priorities and hot windows"""
+        interval = max(self.min_interval, min(self.max_interval, interval))
+        if key[-1] in self.priority:
+            interval = min(interval, self.priority_interval)
+        if self.hot_active:
+            interval = self.min_interval
+        return interval
+    
+    def _budget_left(self, now: float) -> int:
+        """Requests still available in the rolling one-minute budget"""
+        while self.spent and self.spent[0][0] <= now - 60:
+            self.spent_total -= self.spent.popleft()[1]
+        return self.budget - self.spent_total
+    
+    def _next_wake(self, now: float) -> float:
+        """Seconds until something can be handed out"""
+        while self.heap and self.seqs.get(self.heap[0][2]) != self.heap[0][1]:
+            heapq.heappop(self.heap)
+        
+        wake = self.max_interval
+        if self.heap:
+            due = self.heap[0][0]
+            if due <= now and self.spent:
+                # Due but over budget: wait for the oldest spend to age out
+                due = self.spent[0][0] + 60
+            wake = due - now
+        
+        hot_start = self._seconds_until_hot_window()
+        if hot_start is not None:
+            wake = min(wake, hot_start)
+        
+        return max(0.0, wake)
+    
+    def _update_hot_window(self, now: float):
+        """Pull every unit forward when a hot window opens"""
+        in_window = self._seconds_until_hot_window() == 0
+        if in_window and not self.hot_active:
+            self.hot_active = True
+            for key in self.seqs:
+                self.intervals[key] = self.min_interval
+            self.heap = [(min(due, now), seq, key) for due, seq, key in self.heap]
+            heapq.heapify(self.heap)
+        elif not in_window:
+            self.hot_active = False
+    
+    def _seconds_until_hot_window(self) -> Optional[float]:
+        """Seconds until the next hot window opens (0 inside one), or None if none are set"""
+        if not self.hot_windows:
+            return None
+        
+        now = datetime.now()
+        waits = []
+        for start, end in self.hot_windows:
+            if start <= now.time() < end or (end < start and (now.time() >= start or now.time() < end)):
+                return 0.0
+            start_at = datetime.combine(now.date(), start)
+            if start_at <= now:
+                start_at += timedelta(days=1)
+            waits.append((start_at - now).total_seconds())
+        return min(waits)
+    
+    @staticmethod
+    def _parse_window(window: str) -> tuple:
+        """Parse an "HH:MM-HH:MM" local time window"""
+        start, end = window.split('-')
+        return dt_time.fromisoformat(start.strip()), dt_time.fromisoformat(end.strip())
+
+
+class NotificationRenderer:
+    """Renders availability notifications from templates compiled once.
+    
+    Fragments are collected in a list and joined once. The "digest" layout
+    groups sites by campground and collapses consecutive nights into
+    ranges; every section is capped, so a release-day burst of hundreds
+    of sites still renders quickly into a bounded message. The SMS text
+    summarizes the busiest campgrounds within one SMS-sized budget.
+    """
+    
+    PAGE = Template("""<html>
+<head>
+<style>
+body { font-family: Arial, sans-serif; }
+h2 { color: #2c5f2d; }
+.site { background-color: #f0f8f0; padding: 10px; margin: 10px 0; border-radius: 5px; }
+.permit { background-color: #f0f0f8; padding: 10px; margin: 10px 0; border-radius: 5px; }
+.dates { color: #666; font-size: 0.9em; }
+</style>
+</head>
+<body>
+$alerts$footer</body>
+</html>
+""")
+    FOOTER = ("<p><em>This is an automated notification from your "
+              "California National Parks Availability Monitor.</em></p>\n")
+    ALERT = Template("""<h2>🏕️ New Availability Found for $park!</h2>
+<p><strong>Target Period:</strong> $period</p>
+$sections""")
+    CAMPGROUND = Template("""<div class="site">
+<strong>$name</strong> - $count<br>
+$rows<a href="https://www.recreation.gov/camping/campgrounds/$id">Book Now</a>
+</div>
+""")
+    SITE_ROW = Template("""$site: <span class="dates">$dates</span><br>
+""")
+    SITE = Template("""<div class="site">
+<strong>$campground</strong> - $site<br>
+<span class="dates">Available dates: $dates</span><br>
+<a href="https://www.recreation.gov/camping/campgrounds/$id">Book Now</a>
+</div>
+""")
+    PERMIT = Template("""<div class="permit">
+<strong>$name</strong> - $division<br>
+<span class="dates">Available dates: $dates</span><br>
+<a href="https://www.recreation.gov/permits/$id">Book Now</a>
+</div>
+""")
+    MORE = Template("""<p><em>... and $more</em></p>
+""")
+    
+    SMS_LENGTH = 300
+    
+    def __init__(self, config: dict, window: DateWindow, target_dates: dict):
+        """Configure layout and caps from the `notifications` config section"""
+        self.layout = config.get('format', 'digest')
+        self.max_campgrounds = config.get('max_campgrounds', 10)
+        self.max_sites_per_campground = config.get('max_sites_per_campground', 10)
+        self.max_sites = config.get('max_sites', 50)
+        self.max_permits = config.get('max_permits', 10)
+        self.max_date_ranges = config.get('max_date_ranges', 6)
+        self.window = window
+        self.period = self._period(str(target_dates['start_date']), str(target_dates['end_date']))
+    
+    def render(self, park_name: str, sites: List[SiteAvailability],
+               permits: List[PermitAvailability]) -> tuple:
+        """Return the (HTML, text) bodies for a park's new availability"""
+        sections = []
+        if sites:
+            sections.append("<h3>Available Campsites:</h3>\n")
+            if self.layout == 'list':
+                self._render_site_list(sections, sites)
+            else:
+                self._render_site_digest(sections, self._by_campground(sites))
+        if permits:
+            sections.append("<h3>Available Permits:</h3>\n")
+            self._render_permits(sections, permits)
+        
+        alert = self.ALERT.substitute(park=escape(park_name), period=self.period, sections=''.join(sections))
+        html_body = self.PAGE.substitute(alerts=alert, footer=self.FOOTER)
+        return html_body, self._render_text(park_name, sites, permits)
+    
+    @classmethod
+    def merge(cls, pages: List[str]) -> str:
+        """Combine rendered HTML pages into one document with a section per page"""
+        alerts = []
+        for page in pages:
+            start, end = page.find('<body>'), page.rfind('</body>')
+            if start >= 0 and end > start:
+                page = page[start + len('<body>'):end].lstrip('\n')
+                if page.endswith(cls.FOOTER):
+                    page = page[:-len(cls.FOOTER)]
+            alerts.append(page if page.endswith('\n') else page + '\n')
+        return cls.PAGE.substitute(alerts='<hr>\n'.join(alerts), footer=cls.FOOTER)
+    
+    def _render_site_digest(self, out: list, campgrounds: List[tuple]):
+        """One block per campground, one row per site with its nights as ranges"""
+        for campground_id, name, sites in campgrounds[:self.max_campgrounds]:
+            shown = sites[:self.max_sites_per_campground]
+            rows = [
+                self.SITE_ROW.substitute(site=escape(str(site.site_name)), dates=self._ranges(site.mask))
+                for site in shown
+            ]
+            if len(sites) > len(shown):
+                rows.append(f"<em>... and {self._plural(len(sites) - len(shown), 'more site')}</em><br>\n")
+            out.append(self.CAMPGROUND.substitute(
+                name=escape(str(name)), count=self._plural(len(sites), 'site'),
+                rows=''.join(rows), id=escape(str(campground_id))
+            ))
+        if len(campgrounds) > self.max_campgrounds:
+            out.append(self.MORE.substitute(more=self._plural(len(campgrounds) - self.max_campgrounds,
+                                                              'more campground')))
+    
+    def _render_site_list(self, out: list, sites: List[SiteAvailability]):
+        """One block per site"""
+        for site in sites[:self.max_sites]:
+            out.append(self.SITE.substitute(
+                campground=escape(str(site.campground_name)), site=escape(str(site.site_name)),
+                dates=self._ranges(site.mask), id=escape(str(site.campground_id))
+            ))
+        if len(sites) > self.max_sites:
+            out.append(self.MORE.substitute(more=self._plural(len(sites) - self.max_sites, 'more site')))
+    
+    def _render_permits(self, out: list, permits: List[PermitAvailability]):
+        """One block per division, with the quota left on each run of nights"""
+        for permit in permits[:self.max_permits]:
+            out.append(self.PERMIT.substitute(
+                name=escape(str(permit.permit_name)), division=escape(str(permit.division_name)),
+                dates=self._quota_ranges(permit), id=escape(str(permit.permit_id))
+            ))
+        if len(permits) > self.max_permits:
+            out.append(self.MORE.substitute(more=self._plural(len(permits) - self.max_permits,
+                                                              'more permit entry point')))
+    
+    def _render_text(self, park_name: str, sites: List[SiteAvailability],
+                     permits: List[PermitAvailability]) -> str:
+        """Short SMS summary naming the campgrounds with the most new sites"""
+        head = f"New availability in {park_name} ({self.period}): "
+        tail = ". Check your email for details."
+        # Keep room for the "+N more campgrounds" note and the permit count
+        budget = self.SMS_LENGTH - len(head) - len(tail) - 50
+        
+        parts = []
+        campgrounds = self._by_campground(sites) if sites else []
+        for index, (_, name, campground_sites) in enumerate(campgrounds):
+            nights = 0
+            for site in campground_sites:
+                nights |= site.mask
+            part = f"{name} {self._plural(len(campground_sites), 'site')} ({self._ranges(nights, 2, '-')})"
+            if parts and len('; '.join(parts)) + len(part) + 2 > budget:
+                parts.append(f"+{self._plural(len(campgrounds) - index, 'more campground')}")
+                break
+            parts.append(part)
+        if permits:
+            parts.append(f"{self._plural(len(permits), 'permit entry point')} open")
+        
+        return head + '; '.join(parts) + tail
+    
+    @staticmethod
+    def _by_campground(sites: List[SiteAvailability]) -> List[tuple]:
+        """[(campground_id, name, sites)] with the most sites first"""
+        groups = {}
+        for site in sites:
+            group = groups.get(site.campground_id)
+            if group is None:
+                group = groups[site.campground_id] = (site.campground_id, site.campground_name, [])
+            group[2].append(site)
+        return sorted(groups.values(), key=lambda group: -len(group[2]))
+    
+    def _ranges(self, mask: int, limit: Optional[int] = None, dash: str = '&ndash;') -> str:
+        """Nights of `mask` as collapsed date ranges, capped at `limit` ranges"""
+        limit = limit or self.max_date_ranges
+        runs = self.window.runs(mask)
+        text = ', '.join(self._span(first, last, dash) for first, last in runs[:limit])
+        if len(runs) > limit:
+            text += f" (+{len(runs) - limit} more)"
+        return text
+    
+    def _quota_ranges(self, permit: PermitAvailability) -> str:
+        """Permit nights as ranges, split wherever the quota left changes"""
+        spans = []
+        for first, last in self.window.runs(permit.mask):
+            start = first
+            for offset in range(first, last + 1):
+                left = permit.remaining.get(offset, 0)
+                if offset == last or permit.remaining.get(offset + 1, 0) != left:
+                    spans.append(f"{self._span(start, offset)} ({left} left)")
+                    start = offset + 1
+            if len(spans) > self.max_date_ranges:
+                return ', '.join(spans[:self.max_date_ranges]) + " ..."
+        return ', '.join(spans)
+    
+    def _span(self, first: int, last: int, dash: str = '&ndash;') -> str:
+        """One run of nights: 'Jun 3', 'Jun 3-5' or 'Jun 30-Jul 2'"""
+        start = self.window.start + timedelta(days=first)
+        if first == last:
+            return f"{start:%b} {start.day}"
+        end = self.window.start + timedelta(days=last)
+        end_text = str(end.day) if end.month == start.month else f"{end:%b} {end.day}"
+        return f"{start:%b} {start.day}{dash}{end_text}"
+    
+    @staticmethod
+    def _period(start_date: str, end_date: str) -> str:
+        """Human-readable target period, e.g. 'Jun 1 - Jun 30, 2026'"""
+        start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+        if start.year != end.year:
+            return f"{start:%b} {start.day}, {start.year} - {end:%b} {end.day}, {end.year}"
+        return f"{start:%b} {start.day} - {end:%b} {end.day}, {end.year}"
+    
+    @staticmethod
+    def _plural(count: int, noun: str) -> str:
+        return f"{count} {noun}{'' if count == 1 else 's'}"
+
+
+class NotificationDispatcher:
+    """Delivers notifications from a background worker over long-lived clients.
+    
+    Messages submitted to a channel within `digest_window_seconds` of the
+    first one are coalesced into a single digest, without repeats. Failed deliveries are
+    retried with backoff on the worker, so a slow SMTP server or webhook
+    never holds up the availability checks.
+    """
+    
+    CHANNELS = ('email', 'webhook', 'sms')
+    REQUIRED = {
+        'email': ('smtp_server', 'smtp_port', 'sender_email', 'sender_password', 'recipient_emails'),
+        'webhook': ('url',),
+        'sms': ('twilio_account_sid', 'twilio_auth_token', 'twilio_phone_number', 'recipient_phone_numbers')
+    }
+    _STOP = object()
+    
+    def __init__(self, config: dict, logger: logging.Logger, metrics: Optional[Metrics] = None,
+                 transport: Optional[HttpTransport] = None):
+        """Configure channels from the `notifications` config section"""
+        self.config = config
+        self.logger = logger
+        self.metrics = metrics or Metrics()
+        self.transport = transport
+        self.digest_window = config.get('digest_window_seconds', 10)
+        self.max_retries = config.get('max_retries', 3)
+        self.retry_delay = config.get('retry_delay_seconds', 5)
+        
+        self.queue = queue.Queue()
+        self.worker = None
+        self.locks = {channel: threading.Lock() for channel in self.CHANNELS}
+        self.outbox = None  # List that collects (channel, messages) instead of delivering, e.g. in replay
+        
+        # Long-lived clients, created on first use
+        self.smtp = None
+        self.http = None
+        self.twilio = None
+    
+    def enabled(self, channel: str) -> bool:
+        """Whether a channel is turned on in the config"""
+        return bool(self.config.get(channel, {}).get('enabled'))
+    
+    def submit(self, channel: str, message, detected_at: Optional[float] = None):
+        """Queue a message for background delivery on an enabled channel.
+        
+        `detected_at` is the time.monotonic() at which the change was seen,
+        used to measure detection-to-notification latency.
+        """
+        if not self.enabled(channel):
+            return
+        
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._run, name='NotificationDispatcher', daemon=True)
+            self.worker.start()
+        
+        self.queue.put((channel, message, detected_at or time.monotonic()))
+    
+    def send(self, channel: str, messages: list):
+        """Deliver messages on a channel now, as one digest; raises on failure"""
+        if self.outbox is not None:
+            self.outbox.append((channel, list(messages)))
+            self.logger.info(f"Held {channel} notification: delivery is off")
+            return
+        
+        started = time.perf_counter()
+        try:
+            with self.metrics.phase('send'):
+                self._send(channel, messages)
+        except Exception:
+            self.metrics.inc('parkmonitor_notifications_total', channel=channel, result='failed')
+            raise
+        finally:
+            self.metrics.observe('parkmonitor_notification_send_seconds', time.perf_counter() - started,
+                                 channel=channel)
+        self.metrics.inc('parkmonitor_notifications_total', channel=channel, result='sent')
+    
+    def _send(self, channel: str, messages: list):
+        """Build a channel's digest and deliver it"""
+        with self.locks[channel]:
+            if channel == 'email':
+                if len(messages) == 1:
+                    subject, body = messages[0]
+                else:
+                    subject = f"🏕️ Availability Digest: {len(messages)} updates"
+                    body = NotificationRenderer.merge([body for _, body in messages])
+                self._send_email(subject, body)
+            elif channel == 'webhook':
+                self._send_webhook(messages[0] if len(messages) == 1 else {'digest': messages})
+            elif channel == 'sms':
+                self._send_sms(' | '.join(messages))
+    
+    def close(self, timeout: float = 30):
+        """Flush everything queued, then stop the worker and close connections"""
+        if self.worker is not None:
+            self.queue.put(self._STOP)
+            self.worker.join(timeout)
+            self.worker = None
+        
+        with self.locks['email']:
+            if self.smtp is not None:
+                import smtplib
+                try:
+                    self.smtp.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self.smtp = None
+    
+    def _run(self):
+        """Worker loop: batch messages per channel, deliver and retry"""
+        pending = {}  # channel -> (flush_at, [(message, detected_at)])
+        retries = []  # heap of (retry_at, seq, channel, entries, attempt)
+        seq = itertools.count()
+        stopping = False
+        
+        while True:
+            deadlines = [flush_at for flush_at, _ in pending.values()] + [r[0] for r in retries[:1]]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            
+            if item is self._STOP:
+                stopping = True
+            elif item is not None:
+                channel, message, detected_at = item
+                flush_at, entries = pending.setdefault(
+                    channel, (time.monotonic() + self.digest_window, [])
+                )
+                # The same alert queued twice in one window is only delivered once
+                if all(queued != message for queued, _ in entries):
+                    entries.append((message, detected_at))
+            
+            now = time.monotonic()
+            for channel in [c for c, (flush_at, _) in pending.items() if stopping or flush_at <= now]:
+                self._deliver(channel, pending.pop(channel)[1], 0, retries, seq)
+            
+            while retries and (stopping or retries[0][0] <= now):
+                _, _, channel, entries, attempt = heapq.heappop(retries)
+                # Once stopping, make one last attempt without requeueing
+                self._deliver(channel, entries, attempt, None if stopping else retries, seq)
+            
+            if stopping:
+                return
+    
+    def _deliver(self, channel: str, entries: list, attempt: int,
+                 retries: Optional[list], seq):
+        """Send a batch, scheduling a retry with backoff if it fails"""
+        try:
+            self.send(channel, [message for message, _ in entries])
+            now = time.monotonic()
+            for _, detected_at in entries:
+                self.metrics.observe('parkmonitor_detection_to_notification_seconds',
+                                     now - detected_at, channel=channel)
+        except ImportError:
+            self.logger.error("Twilio library not installed. Run: pip install twilio")
+        except Exception as e:
+            if retries is not None and attempt < self.max_retries:
+                delay = self.retry_delay * (2 ** attempt)
+                self.logger.warning(f"Failed to send {channel} notification ({e}), retrying in {delay}s")
+                heapq.heappush(retries, (time.monotonic() + delay, next(seq), channel, entries, attempt + 1))
+            else:
+                self.logger.error(f"Failed to send {channel} notification, giving up: {e}")
+    
+    def _send_email(self, subject: str, body: str):
+        """Send one HTML email, reusing the SMTP connection when it is still alive"""
+        # Only runs with email enabled, so the email modules stay off the startup path
+        import smtplib
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+        
+        email_config = self.config['email']
+        
+        msg = MIMEMultipart()
+        msg['From'] = email_config['sender_email']
+        msg['To'] = ', '.join(email_config['recipient_emails'])
+        msg['Subject'] = subject
+        
+        msg.attach(MIMEText(body, 'html'))
+        
+        try:
+            self._smtp_connection().send_message(msg)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # The server dropped an idle connection; reconnect once
+            self.smtp = None
+            self._smtp_connection().send_message(msg)
+        
+        self.logger.info(f"Email notification sent: {subject}")
+    
+    def _smtp_connection(self) -> 'smtplib.SMTP':
+        """Return a logged-in SMTP connection, opening one if needed"""
+        import smtplib
+        
+        if self.smtp is not None:
+            try:
+                if self.smtp.noop()[0] == 250:
+                    return self.smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+        
+        email_config = self.config['email']
+        server = smtplib.SMTP(email_config['smtp_server'], email_config['smtp_port'], timeout=30)
+        server.starttls()
+        server.login(email_config['sender_email'], email_config['sender_password'])
+        self.smtp = server
+        return server
+    
+    def _send_webhook(self, data: dict):
+        """Post to the webhook on a pooled keep-alive session"""
+        # Format for Slack/Discord
+        payload = {
+            'text': f"🏕️ New Availability Found!\n\n{json.dumps(data, indent=2)}"
+        }
+        
+        if self.http is None:
+            self.http = self.transport.session() if self.transport else requests.Session()
+        response = self.http.post(self.config['webhook']['url'], json=payload, timeout=10)
+        response.raise_for_status()
+        
+        self.logger.info("Webhook notification sent successfully")
+    
+    def _send_sms(self, message: str):
+        """Text every recipient through a cached Twilio client"""
+        sms_config = self.config['sms']
+        
+        if self.twilio is None:
+            from twilio.rest import Client
+            self.twilio = Client(sms_config['twilio_account_sid'], sms_config['twilio_auth_token'])
+            if self.transport is not None:
+                # Twilio's HTTP client sends through a requests session; use a pooled, counted one
+                self.twilio.http_client.session = self.transport.session()
+        
+        for recipient in sms_config['recipient_phone_numbers']:
+            self.twilio.messages.create(
+                body=message,
+                from_=sms_config['twilio_phone_number'],
+                to=recipient
+            )
+        
+        self.logger.info("SMS notification sent successfully")
+
+
+class Subscription:
+    """One subscriber's parks, dates, stay filters and notification targets"""
+    
+    def __init__(self, config: dict, window: DateWindow, logger: logging.Logger,
+                 metrics: Optional[Metrics] = None, notifier: Optional[NotificationDispatcher] = None,
+                 transport: Optional[HttpTransport] = None):
+        """Build from a `subscriptions` entry; masks are laid out on the shared `window`.
+        
+        `notifier` reuses a running dispatcher, e.g. across a config reload.
+        """
+        self.name = config.get('name', 'subscriber')
+        self.parks = set(config.get('parks', []))
+        campgrounds = config.get('campgrounds')
+        self.campgrounds = {str(c) for c in campgrounds} if campgrounds else None
+        self.check_permits = config.get('check_permits', True)
+        
+        dates = config.get('target_dates', {})
+        self.nights_mask = window.range_mask(dates.get('start_date'), dates.get('end_date'))
+        
+        # Stay queries default to the subscriber's own dates
+        queries = [
+            StayQuery({'start_date': dates.get('start_date'), 'end_date': dates.get('end_date'), **query}, window)
+            for query in config.get('stay_queries', [])
+        ]
+        self.engine = StayQueryEngine(queries, window) if queries else None
+        self.notifications = config.get('notifications', {})
+        self.notifier = notifier or NotificationDispatcher(self.notifications, logger, metrics, transport)
+    
+    def watches(self, park_name: str, campground_id: Optional[str] = None) -> bool:
+        """Whether this subscription covers a park (and campground)"""
+        if park_name not in self.parks:
+            return False
+        return campground_id is None or self.campgrounds is None or campground_id in self.campgrounds
+
+
+class SubscriptionIndex:
+    """Inverted index from (campground_id, night offset) to the subscriptions watching it.
+    
+    Campgrounds are registered as discovery finds them, so a change only
+    costs one lookup per opened night, however many subscriptions exist.
+    """
+    
+    def __init__(self, subscriptions: List[Subscription]):
+        """Index `subscriptions`, all laid out on the same DateWindow"""
+        self.subscriptions = subscriptions
+        self.index = {}  # (campground_id, offset) -> tuple of subscriptions
+        self.registered = set()  # (park_name, campground_id) pairs already indexed
+        self.lock = threading.Lock()
+    
+    def register(self, park_name: str, campground_id: str):
+        """Index every subscription watching a campground listed under a park"""
+        if (park_name, campground_id) in self.registered:
+            return
+        
+        with self.lock:
+            if (park_name, campground_id) in self.registered:
+                return
+            for subscription in self.subscriptions:
+                if not subscription.watches(park_name, campground_id):
+                    continue
+                mask = subscription.nights_mask
+                while mask:
+                    low = mask & -mask
+                    key = (campground_id, low.bit_length() - 1)
+                    subscribers = self.index.get(key, ())
+                    if subscription not in subscribers:
+                        self.index[key] = subscribers + (subscription,)
+                    mask ^= low
+            self.registered.add((park_name, campground_id))
+    
+    def match(self, campground_id: str, mask: int) -> Dict[Subscription, int]:
+        """Split a campground's changed nights by the subscriptions watching them"""
+        matched = {}
+        index = self.index
+        while mask:
+            low = mask & -mask
+            for subscription in index.get((campground_id, low.bit_length() - 1), ()):
+                matched[subscription] = matched.get(subscription, 0) | low
+            mask ^= low
+        return matched
+    
+    def for_park(self, park_name: str) -> List[Subscription]:
+        """Subscriptions watching a park at all"""
+        return [subscription for subscription in self.subscriptions if subscription.watches(park_name)]
+
+
+class AvailabilityIndex:
+    """The latest availability of every watched campground and permit, kept in memory.
+    
+    Entries are keyed by campground id (or permit key) and grouped by
+    park; each site's nights are its availability mask, so date filters
+    are a single AND. Every site whose availability changes is appended to
+    a bounded change log that long-poll and SSE readers follow by sequence
+    number. Published entries are never mutated, so readers only hold the
+    lock long enough to take a snapshot.
+    """
+    
+    def __init__(self, max_events: int = 10000):
+        """Start empty, keeping the last `max_events` changes"""
+        self.entries = {}  # key -> {'park', 'name', 'kind', 'updated', 'mask', 'sites': {site_id: record}}
+        self.parks = {}  # park_name -> set of keys
+        self.events = deque(maxlen=max_events)  # (seq, event) in seq order
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+    
+    def update(self, fresh: Dict[str, tuple], checked: set):
+        """Publish a cycle's records and log what changed.
+        
+        `fresh` maps each key to (park_name, name, kind, {site_id: record}).
+        Keys in `checked` were fetched completely and replace their entry;
+        other keys were only partly fetched and can add nights but not
+        remove them.
+        """
+        now = time.time()
+        events = []
+        
+        with self.lock:
+            for key in checked | fresh.keys():
+                previous = self.entries.get(key)
+                if key in fresh:
+                    park_name, name, kind, sites = fresh[key]
+                elif previous:
+                    park_name, name, kind, sites = previous['park'], previous['name'], previous['kind'], {}
+                else:
+                    continue
+                
+                old_sites = previous['sites'] if previous else {}
+                if key not in checked:
+                    sites = {**old_sites, **{
+                        site_id: self._merge(old_sites[site_id], record) if site_id in old_sites else record
+                        for site_id, record in sites.items()
+                    }}
+                
+                for site_id in old_sites.keys() | sites.keys():
+                    old, new = old_sites.get(site_id), sites.get(site_id)
+                    old_mask, new_mask = old.mask if old else 0, new.mask if new else 0
+                    if old_mask != new_mask:
+                        record = new or old
+                        events.append({
+                            'park': park_name, 'kind': kind, 'id': key, 'name': name,
+                            'site_id': site_id, 'site_name': self._site_name(record),
+                            'opened': record.window.dates(new_mask & ~old_mask),
+                            'closed': record.window.dates(old_mask & ~new_mask)
+                        })
+                
+                mask = 0
+                for record in sites.values():
+                    mask |= record.mask
+                self.entries[key] = {'park': park_name, 'name': name, 'kind': kind,
+                                     'updated': now, 'mask': mask, 'sites': sites}
+                self.parks.setdefault(park_name, set()).add(key)
+            
+            self._append(events, now)
+    
+    def retain(self, park_names: set, window: DateWindow):
+        """Drop parks no longer watched and lay the rest out on `window` (after a config reload)"""
+        with self.lock:
+            for park_name in list(self.parks):
+                if park_name in park_names:
+                    continue
+                for key in self.parks.pop(park_name):
+                    if self.entries.get(key, {}).get('park') == park_name:
+                        del self.entries[key]
+            
+            for key, entry in self.entries.items():
+                sites = {site_id: record.on_window(window) for site_id, record in entry['sites'].items()}
+                mask = 0
+                for record in sites.values():
+                    mask |= record.mask
+                self.entries[key] = {**entry, 'mask': mask, 'sites': sites}
+    
+    def query(self, park: Optional[str] = None, campground: Optional[str] = None,
+              site: Optional[str] = None, kind: Optional[str] = None,
+              site_type: Optional[str] = None, loop: Optional[str] = None,
+              start_date: Optional[str] = None, end_date: Optional[str] = None,
+              min_nights: int = 1, limit: int = 1000) -> List[Dict]:
+        """Sites with availability matching every given filter, as plain dicts.
+        
+        `site_type` and `loop` match the whole value ignoring case, like the
+        filters of a StayQuery.
+        """
+        site_type = site_type.upper() if site_type is not None else None
+        loop = loop.upper() if loop is not None else None
+        
+        with self.lock:
+            if campground is not None:
+                keys = [campground] if campground in self.entries else []
+            elif park is not None:
+                keys = sorted(self.parks.get(park, ()))
+            else:
+                keys = sorted(self.entries)
+            entries = [(key, self.entries[key]) for key in keys]
+        
+        results = []
+        ranges = {}  # DateWindow -> mask of the requested dates
+        for key, entry in entries:
+            if (park is not None and entry['park'] != park) or (kind is not None and entry['kind'] != kind):
+                continue
+            if not entry['mask']:
+                continue
+            
+            for site_id, record in entry['sites'].items():
+                if site is not None and site_id != site:
+                    continue
+                if entry['kind'] == 'campground' and (
+                        (site_type is not None and site_type != (record.site_type or '').upper())
+                        or (loop is not None and loop != (record.loop or '').upper())):
+                    continue
+                
+                window = record.window
+                if window not in ranges:
+                    ranges[window] = window.range_mask(start_date, end_date)
+                mask = record.mask & ranges[window]
+                if min_nights > 1:
+                    mask = StayQueryEngine._covered_by_runs(mask, min_nights)
+                if not mask:
+                    continue
+                
+                result = record.with_mask(mask).to_dict()
+                result['park'] = entry['park']
+                results.append(result)
+                if len(results) >= limit:
+                    return results
+        
+        return results
+    
+    def summary(self) -> List[Dict]:
+        """One row per campground or permit: open sites and when it was last updated"""
+        with self.lock:
+            entries = sorted(self.entries.items())
+        
+        return [
+            {'park': entry['park'], 'kind': entry['kind'], 'id': key, 'name': entry['name'],
+             'open_sites': sum(1 for record in entry['sites'].values() if record.mask),
+             'updated': entry['updated']}
+            for key, entry in entries
+        ]
+    
+    def changes(self, since: int, timeout: float = 0) -> tuple:
+        """Return (seq, events after `since`, reset), waiting up to `timeout` for one.
+        
+        `reset` is True when events after `since` have already been
+        dropped from the log, so the reader should re-query instead.
+        """
+        with self.changed:
+            if timeout > 0:
+                self.changed.wait_for(lambda: self.seq != since, timeout)
+            seq = self.seq
+            first = self.events[0][0] if self.events else seq + 1
+            if since > seq or since + 1 < first:
+                # Gone from the log, or from before a restart
+                return seq, [], True
+            events = [event for _, event in itertools.islice(self.events, since + 1 - first, None)]
+        return seq, events, False
+    
+    def wake(self):
+        """Release every waiting reader, e.g. when the server shuts down"""
+        with self.changed:
+            self.changed.notify_all()
+    
+    def _append(self, events: List[Dict], now: float):
+        """Number and log events; caller holds the lock"""
+        for event in events:
+            self.seq += 1
+            event['seq'] = self.seq
+            event['time'] = now
+            self.events.append((self.seq, event))
+        if events:
+            self.changed.notify_all()
+    
+    @staticmethod
+    def _merge(old, new):
+        """Union of two records for the same site"""
+        if isinstance(new, PermitAvailability):
+            return new.with_mask(old.mask | new.mask, {**old.remaining, **new.remaining})
+        return new.with_mask(old.mask | new.mask)
+    
+    @staticmethod
+    def _site_name(record) -> Optional[str]:
+        """Display name of a campsite or permit division"""
+        return record.division_name if isinstance(record, PermitAvailability) else record.site_name
+
+
+class QueryServer:
+    """Serves an AvailabilityIndex over a small local HTTP API from background threads.
+    
+    GET /availability   sites open now; filters: park, campground, site, kind,
+                        site_type, loop, start_date, end_date, min_nights, limit
+    GET /campgrounds    open site counts per campground and permit
+    GET /changes        changes after ?since=SEQ, long-polling up to ?timeout= seconds
+    GET /stream         the same changes as Server-Sent Events (resumes from Last-Event-ID)
+    
+    Every answer comes from memory; no request ever reaches Recreation.gov.
+    """
+    
+    def __init__(self, index: AvailabilityIndex, host: str, port: int, max_wait: float = 30):
+        """Bind the HTTP server; call start() to begin serving"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        stopping = threading.Event()
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = dict(parse_qsl(url.query))
+                try:
+                    if url.path == '/availability':
+                        self._send_json({'results': index.query(
+                            park=params.get('park'), campground=params.get('campground'),
+                            site=params.get('site'), kind=params.get('kind'),
+                            site_type=params.get('site_type'), loop=params.get('loop'),
+                            start_date=self._date(params.get('start_date')),
+                            end_date=self._date(params.get('end_date')),
+                            min_nights=int(params.get('min_nights', 1)), limit=int(params.get('limit', 1000))
+                        )})
+                    elif url.path == '/campgrounds':
+                        self._send_json({'results': index.summary()})
+                    elif url.path == '/changes':
+                        seq, events, reset = index.changes(
+                            int(params.get('since', 0)),
+                            min(float(params.get('timeout', 0)), max_wait)
+                        )
+                        self._send_json({'seq': seq, 'reset': reset, 'events': events})
+                    elif url.path == '/stream':
+                        self._stream(int(self.headers.get('Last-Event-ID') or params.get('since', 0)))
+                    else:
+                        self.send_error(404)
+                except ValueError as e:
+                    self.send_error(400, str(e))
+            
+            def _stream(self, since: int):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                try:
+                    while not stopping.is_set():
+                        since, events, reset = index.changes(since, max_wait)
+                        if reset:
+                            self._event('reset', since, {'seq': since})
+                        for event in events:
+                            self._event('change', event['seq'], event)
+                        if not events and not reset:
+                            self.wfile.write(b": keep-alive\n\n")
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+            
+            def _event(self, name: str, seq: int, data: dict):
+                self.wfile.write(f"id: {seq}\nevent: {name}\ndata: {json.dumps(data)}\n\n".encode())
+            
+            def _send_json(self, data):
+                body = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            @staticmethod
+            def _date(value: Optional[str]) -> Optional[str]:
+                return date.fromisoformat(value).isoformat() if value else None
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.index = index
+        self.stopping = stopping
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+    
+    def start(self):
+        """Serve requests on a daemon thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever, name='QueryServer', daemon=True)
+        self.thread.start()
+    
+    def close(self):
+        """Stop serving, end open streams and release the port"""
+        self.stopping.set()
+        self.index.wake()
+        if self.thread is not None:
+            self.server.shutdown()
+            self.thread = None
+        self.server.server_close()
+
+
+class HashRing:
+    """Consistent-hash ring mapping keys to nodes, with virtual nodes for balance"""
+    
+    def __init__(self, nodes: List[str], replicas: int = 64):
+        """Place `replicas` points on the ring for every node"""
+        points = sorted((self._hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+    
+    @staticmethod
+    def _hash(value: str) -> int:
+        """Stable 64-bit hash, identical in every process and host"""
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+    
+    def node(self, key: str) -> Optional[str]:
+        """Return the node owning `key`, or None for an empty ring"""
+        if not self.hashes:
+            return None
+        return self.nodes[bisect.bisect(self.hashes, self._hash(key)) % len(self.hashes)]
+
+
+class ShardStore:
+    """SQLite rendezvous for a coordinator and its fetch workers.
+    
+    Workers heartbeat into `workers`; a worker whose lease has lapsed drops
+    off the hash ring and its campgrounds move to the others. The
+    coordinator publishes each cycle's campgrounds in `cycles` and workers
+    answer in `results`, first answer wins, so a unit fetched twice during
+    a handover still counts once.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS workers (
+            worker_id TEXT PRIMARY KEY,
+            heartbeat_at REAL NOT NULL
+        );
+        
+        CREATE TABLE IF NOT EXISTS cycles (
+            cycle_id INTEGER PRIMARY KEY,
+            units TEXT NOT NULL,
+            started_at REAL NOT NULL
+        );
+        
+        CREATE TABLE IF NOT EXISTS results (
+            cycle_id INTEGER NOT NULL,
+            campground_id TEXT NOT NULL,
+            worker_id TEXT NOT NULL,
+            ok INTEGER NOT NULL,
+            changed INTEGER NOT NULL,
+            sites BLOB NOT NULL,
+            PRIMARY KEY (cycle_id, campground_id)
+        ) WITHOUT ROWID;
+    """
+    
+    def __init__(self, path: str):
+        """Open (or create) the shared database at `path`"""
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+    
+    def heartbeat(self, worker_id: str):
+        """Renew a worker's lease"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT INTO workers VALUES (?, ?) '
+                'ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at',
+                (worker_id, time.time())
+            )
+    
+    def remove_worker(self, worker_id: str):
+        """Give up a worker's lease immediately"""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM workers WHERE worker_id = ?', (worker_id,))
+    
+    def live_workers(self, lease_seconds: float) -> List[str]:
+        """Workers whose lease has not lapsed"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT worker_id FROM workers WHERE heartbeat_at >= ? ORDER BY worker_id',
+                (time.time() - lease_seconds,)
+            ).fetchall()
+        return [worker_id for worker_id, in rows]
+    
+    def start_cycle(self, units: List[tuple]) -> int:
+        """Publish a cycle's (campground_id, name) units, dropping old cycles"""
+        with self.lock, self.conn:
+            cycle_id = self.conn.execute(
+                'INSERT INTO cycles (units, started_at) VALUES (?, ?)', (json.dumps(units), time.time())
+            ).lastrowid
+            self.conn.execute('DELETE FROM cycles WHERE cycle_id < ?', (cycle_id,))
+            self.conn.execute('DELETE FROM results WHERE cycle_id < ?', (cycle_id,))
+            self.conn.execute('DELETE FROM workers WHERE heartbeat_at < ?', (time.time() - 3600,))
+        return cycle_id
+    
+    def current_cycle(self) -> Optional[tuple]:
+        """Return the latest (cycle_id, units), or None before the first cycle"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT cycle_id, units FROM cycles ORDER BY cycle_id DESC LIMIT 1'
+            ).fetchone()
+        return (row[0], [tuple(unit) for unit in json.loads(row[1])]) if row else None
+    
+    def answered(self, cycle_id: int) -> set:
+        """Campgrounds that already have a result for a cycle"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT campground_id FROM results WHERE cycle_id = ?', (cycle_id,)
+            ).fetchall()
+        return {campground_id for campground_id, in rows}
+    
+    def submit(self, cycle_id: int, worker_id: str, campground_id: str, ok: bool, changed: bool,
+               sites: List[list]):
+        """Record a campground's sites as [site_id, name, type, loop, mask] lists"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                (cycle_id, campground_id, worker_id, int(ok), int(changed),
+                 zlib.compress(json.dumps(sites).encode()))
+            )
+    
+    def results(self, cycle_id: int) -> Dict[str, tuple]:
+        """Return {campground_id: (ok, changed, sites)} for a cycle"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT campground_id, ok, changed, sites FROM results WHERE cycle_id = ?', (cycle_id,)
+            ).fetchall()
+        return {
+            campground_id: (bool(ok), bool(changed), json.loads(zlib.decompress(sites)))
+            for campground_id, ok, changed, sites in rows
+        }
+    
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            self.conn.close()
+
+
+class ShardWorker:
+    """Fetches the campgrounds the hash ring assigns to this worker each cycle"""
+    
+    def __init__(self, monitor: 'ParkAvailabilityMonitor', worker_id: Optional[str] = None):
+        """Work for the coordinator sharing `monitor`'s sharding database"""
+        sharding = monitor.config.get('sharding', {})
+        self.monitor = monitor
+        self.store = ShardStore(sharding.get('database', 'shards.db'))
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease = sharding.get('lease_seconds', 15)
+        self.poll_interval = sharding.get('poll_interval_seconds', 0.2)
+        self.rate = monitor.scheduler.bucket.rate
+        self.stopping = threading.Event()
+    
+    def run(self):
+        """Heartbeat and fetch owned campgrounds until stopped"""
+        self.store.heartbeat(self.worker_id)
+        threading.Thread(target=self._heartbeat, name='ShardHeartbeat', daemon=True).start()
+        self.monitor.logger.info(f"Shard worker {self.worker_id} started")
+        
+        try:
+            while not self.stopping.is_set():
+                cycle = self.store.current_cycle()
+                owned = self._owned(*cycle) if cycle else []
+                if owned:
+                    self._fetch(cycle[0], owned)
+                else:
+                    self.stopping.wait(self.poll_interval)
+        finally:
+            self.store.remove_worker(self.worker_id)
+            self.store.close()
+    
+    def _heartbeat(self):
+        """Renew the lease well before it lapses, even during a long fetch"""
+        while not self.stopping.wait(self.lease / 3):
+            try:
+                self.store.heartbeat(self.worker_id)
+            except sqlite3.Error as e:
+                self.monitor.logger.warning(f"Shard heartbeat failed: {e}")
+    
+    def _owned(self, cycle_id: int, units: List[tuple]) -> List[tuple]:
+        """Unanswered units of a cycle that the current ring assigns to this worker"""
+        live = self.store.live_workers(self.lease)
+        if self.worker_id not in live:
+            live.append(self.worker_id)
+        ring = HashRing(live)
+        
+        # The configured rate limit is shared out between live workers
+        self.monitor.scheduler.bucket.rate = self.rate / len(live)
+        
+        answered = self.store.answered(cycle_id)
+        return [
+            unit for unit in units
+            if unit[0] not in answered and ring.node(unit[0]) == self.worker_id
+        ]
+    
+    def _fetch(self, cycle_id: int, units: List[tuple]):
+        """Fetch units concurrently and submit each result as it completes"""
+        monitor = self.monitor
+        # Lay masks out on the same window as the coordinator after a config edit
+        monitor.reload_config_if_changed()
+        monitor._checked, monitor._changed, monitor._fetched = set(), {}, {}
+        monitor.scheduler.start_cycle(monitor.cycle_budget)
+        
+        def fetch(unit):
+            campground_id, campground_name = unit
+            sites = monitor._check_specific_campground(
+                campground_id, campground_name, monitor.start_date, monitor.end_date
+            )
+            self.store.submit(
+                cycle_id, self.worker_id, campground_id,
+                campground_id in monitor._checked, monitor._changed.get(campground_id, True),
+                [[site.site_id, site.site_name, site.site_type, site.loop, site.mask] for site in sites]
+            )
+        
+        try:
+            with ThreadPoolExecutor(max_workers=monitor.max_concurrency) as pool:
+                list(pool.map(fetch, units))
+        finally:
+            skipped = monitor.scheduler.finish_cycle()
+        monitor._report_skipped(skipped)
+        monitor.logger.debug(f"Shard worker {self.worker_id} fetched {len(units)} campgrounds")
 
 
 class ParkAvailabilityMonitor:
     """Monitor national park availability and send notifications"""
     
-    def __init__(self, config_path: str = "config.yaml"):
-        """Initialize the monitor with configuration"""
+    SNAPSHOT_VERSION = 2  # Bump when _validate_config changes what it produces
+    # Config sections a running monitor applies on reload; the rest need a restart
+    RELOADABLE = ('parks', 'target_dates', 'subscriptions', 'notifications')
+    
+    def __init__(self, config_path: str = "config.yaml", transport: Optional[HttpTransport] = None):
+        """Initialize the monitor with configuration, sending HTTP through `transport` if given"""
+        self.config_path = config_path
+        # Stamped before loading, so an edit made while loading is picked up by the next poll
+        self.config_stamp = self._config_stamp()
         self.config = self._load_config(config_path)
         self._setup_logging()
-        self.base_url = "https://www.recreation.gov/api"
-        self.session = requests.Session()
+        self.base_url = self.config.get('api', {}).get('base_url', "https://www.recreation.gov/api")
+        
+        monitoring = self.config.get('monitoring', {})
+        self.fetch_mode = monitoring.get('fetch_mode', 'sync')
+        self.max_concurrency = monitoring.get('max_concurrency', 16)
+        self.max_connections_per_host = monitoring.get('max_connections_per_host', 8)
+        self._async_loop = None  # Event loop of the async cycle in progress, if any
+        self.config_poll_seconds = monitoring.get('config_poll_seconds', 5)
+        json_parser = monitoring.get('json_parser', 'auto')
+        self.stream_json = self._use_streaming_parser(json_parser)
+        # Streaming trades some CPU for flat memory, so "auto" only streams large bodies
+        self.stream_min_bytes = 0 if json_parser == 'stream' else monitoring.get('stream_min_bytes', 1_000_000)
+        
+        # Request, parse, cycle and notification timings for the /metrics endpoint
+        self.metrics = Metrics()
+        self.metrics_server = None
+        
+        # Every outbound HTTP call shares one transport, with pools sized so concurrent fetches
+        # reuse connections; tests can pass a stand-in
+        self.transport = transport or HttpTransport(
+            self.config.get('transport', {}), self.logger, self.metrics,
+            pool_connections=self.max_concurrency,
+            pool_maxsize=max(self.max_concurrency, self.max_connections_per_host)
+        )
+        self.session = self.transport.session(self.base_url)
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         })
-        self.found_availability = {}  # Track what we've already notified about
+        self.archive = None  # HttpArchive when recording or replaying
+        self.outbox = None  # Notifications held instead of delivered, during replay
+        # Latest results served to local consumers when the `query_api` section enables it
+        self.index = None
+        self.query_server = None
+        
+        # Shared rate limit and retry policy for every API request
+        self.scheduler = RequestScheduler(self.session, monitoring, self.logger, self.metrics)
+        # A cycle that runs out of time ends with partial results instead of delaying the next
+        self.cycle_budget = monitoring.get('cycle_budget_seconds', 300)
+        
+        # Campground/permit listings rarely change, so /search results are cached on disk
+        cache_config = self.config.get('cache', {})
+        self.discovery = DiscoveryCache(
+            cache_config.get('discovery_file', 'discovery_cache.json'),
+            cache_config.get('discovery_ttl_hours', 168),
+            self.logger
+        )
+        
+        # Each site's availability is a bitmask over the nights of the target window,
+        # widened to cover every subscription's dates
+        self.start_date, self.end_date = self._fetch_window()
+        self.window = DateWindow(self.start_date, self.end_date)
+        
+        # Track what we've already notified about, across restarts
+        storage_config = self.config.get('storage', {})
+        self.store = AvailabilityStore(storage_config.get('database', 'availability.db'))
+        # The transition log is folded into compact columnar history segments as it grows
+        self.compact_after_rows = storage_config.get('compact_after_rows', 20000)
+        self.max_history_segments = storage_config.get('max_segments_per_campground', 8)
+        self.known = {}  # campground_id (or permit key) -> {site_id (or division_id): mask} last seen open
+        self._load_known()
+        
+        # Notifications are delivered in the background over reused connections
+        self.notifier = NotificationDispatcher(
+            self.config['notifications'], self.logger, self.metrics, self.transport
+        )
+        self.renderer = NotificationRenderer(
+            self.config['notifications'], self.window, self.config['target_dates']
+        )
+        
+        # Each campground is re-checked on its own adaptive interval
+        self.check_scheduler = AdaptiveScheduler(monitoring)
+        self._unit_names = {}  # Scheduler unit key -> campground name
+        self._park_permits = {}  # Park name -> store keys of the permits its permits unit checks
+        self._plan_stamp = None  # (discovery cache, its generation) the units were planned from
+        self._planned_at = 0.0
+        self._plan_complete = False
+        
+        # Parks with stay_queries only notify about qualifying multi-night stays
+        self.stay_engines = self._build_stay_engines()
+        self._checked = set()  # Campgrounds/permits fetched successfully this cycle
+        self._changed = {}  # Checked campground -> whether any of its payloads changed
+        self._fetched = {}  # Campground -> sites (or async task) already fetched this cycle
+        
+        # Multi-subscription mode: one fetch per campground, fanned out to every subscriber
+        self.subscriptions = self._build_subscriptions()
+        
+        # Availability is fetched per (campground, month) with conditional requests
+        self.fetch_units = FetchUnitCache()
+        
+        # Coordinator mode hands campground fetches to worker processes
+        self.shards = None
+        self.shard_workers = 0
+        self.shard_processes = []
+        self.shard_digests = {}  # campground_id -> digest of the sites last applied from a worker
         
     def _load_config(self, config_path: str) -> dict:
-        """Load configuration from YAML file"""
+        """Load configuration, from its validated snapshot when the YAML is unchanged.
+        
+        The snapshot is JSON saved next to the config file and keyed by a
+        hash of the file's contents, so most runs never import yaml or parse
+        the config. Hashing a config-sized file costs far less than parsing
+        it, and unlike mtime and size it catches every edit.
+        """
+        snapshot_path = os.path.join(
+            os.path.dirname(config_path), f".{os.path.basename(config_path)}.snapshot.json"
+        )
         try:
-            with open(config_path, 'r') as f:
-                return yaml.safe_load(f)
+            with open(snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            if not isinstance(snapshot, dict) or snapshot.get('version') != self.SNAPSHOT_VERSION:
+                snapshot = {}
+        except (OSError, ValueError):
+            snapshot = {}
+        
+        try:
+            with open(config_path, 'rb') as f:
+                raw = f.read()
+            digest = hashlib.sha256(raw).hexdigest()
+            if snapshot.get('sha256') == digest and 'config' in snapshot:
+                return snapshot['config']
+            
+            import yaml
+            config = self._validate_config(yaml.safe_load(raw))
         except Exception as e:
             print(f"Error loading config: {e}")
             raise
+        
+        try:
+            stat = os.stat(config_path)
+            temp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'version': self.SNAPSHOT_VERSION, 'sha256': digest, 'config': config}, f)
+            # The snapshot holds the same credentials as the config, so it gets the same permissions
+            os.chmod(temp_path, stat.st_mode & 0o777)
+            os.replace(temp_path, snapshot_path)
+        except OSError:
+            pass  # A read-only config directory just means parsing the YAML every run
+        
+        return config
+    
+    @staticmethod
+    def _validate_config(config) -> dict:
+        """Check the settings every run relies on and return them in snapshot form.
+        
+        YAML dates become ISO strings, and notification channels missing from
+        the `notifications` section are filled in as disabled. Raises
+        ValueError naming the first problem found.
+        """
+        def fail(message: str):
+            raise ValueError(f"Invalid config: {message}")
+        
+        def check_dates(dates, where: str):
+            if not isinstance(dates, dict):
+                fail(f"{where} must be a mapping with start_date and end_date")
+            try:
+                start = date.fromisoformat(dates['start_date'])
+                end = date.fromisoformat(dates['end_date'])
+            except (KeyError, TypeError, ValueError):
+                fail(f"{where} needs start_date and end_date as YYYY-MM-DD")
+            if start > end:
+                fail(f"{where} start_date is after end_date")
+        
+        def check_notifications(notifications, where: str):
+            if not isinstance(notifications, dict):
+                fail(f"{where} must be a mapping")
+            for channel, required in NotificationDispatcher.REQUIRED.items():
+                channel_config = notifications.get(channel) or {}
+                missing = [key for key in required if key not in channel_config]
+                if channel_config.get('enabled') and missing:
+                    fail(f"{where}.{channel} is enabled but missing {', '.join(missing)}")
+        
+        def to_json(value):
+            if isinstance(value, date):
+                return value.isoformat()
+            raise TypeError(f"unsupported value {value!r}")
+        
+        if not isinstance(config, dict):
+            fail("expected a mapping at the top level")
+        try:
+            config = json.loads(json.dumps(config, default=to_json))
+        except (TypeError, ValueError) as e:
+            fail(str(e))
+        
+        parks = config.get('parks')
+        if not isinstance(parks, list):
+            fail("parks must be a list")
+        for index, park in enumerate(parks):
+            if not isinstance(park, dict) or 'name' not in park or 'park_id' not in park:
+                fail(f"parks[{index}] needs a name and a park_id")
+        
+        check_dates(config.get('target_dates'), 'target_dates')
+        
+        rate = config.get('monitoring', {}).get('requests_per_second', 5)
+        if isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate <= 0:
+            fail("monitoring.requests_per_second must be a positive number")
+        
+        notifications = config.setdefault('notifications', {})
+        check_notifications(notifications, 'notifications')
+        for channel in NotificationDispatcher.CHANNELS:
+            notifications.setdefault(channel, {'enabled': False})
+        
+        subscriptions = config.get('subscriptions', [])
+        if not isinstance(subscriptions, list):
+            fail("subscriptions must be a list")
+        for index, subscription in enumerate(subscriptions):
+            if not isinstance(subscription, dict):
+                fail(f"subscriptions[{index}] must be a mapping")
+            if 'target_dates' in subscription:
+                check_dates(subscription['target_dates'], f"subscriptions[{index}].target_dates")
+            check_notifications(subscription.get('notifications', {}), f"subscriptions[{index}].notifications")
+        
+        return config
+    
+    def _config_stamp(self) -> Optional[str]:
+        """Hash of the config file's contents, or None if it cannot be read"""
+        try:
+            with open(self.config_path, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            return None
+    
+    def reload_config_if_changed(self) -> bool:
+        """Reload the config file if it was edited since it was last loaded"""
+        if self._config_stamp() == self.config_stamp:
+            return False
+        return self.reload_config()
+    
+    def reload_config(self) -> bool:
+        """Apply an edited config file to the running monitor without a restart.
+        
+        Parks and target dates are diffed against the running config, so
+        only the affected scheduler units and cached fetch units are added
+        or retired; everything else keeps its schedule, validators, parsed
+        months and notified state. A file that fails to load or validate
+        leaves the running config in place. Returns whether anything changed.
+        """
+        self.config_stamp = self._config_stamp()
+        try:
+            config = self._load_config(self.config_path)
+        except Exception as e:
+            self.logger.error(f"Keeping the running config; {self.config_path} failed to load: {e}")
+            return False
+        
+        old = self.config
+        if config == old:
+            return False
+        
+        old_parks = {park['name']: park for park in old['parks']}
+        new_parks = {park['name']: park for park in config['parks']}
+        added = [name for name in new_parks if name not in old_parks]
+        removed = [name for name in old_parks if name not in new_parks]
+        changed = [name for name in new_parks if name in old_parks and new_parks[name] != old_parks[name]]
+        
+        old_dates = (self.start_date, self.end_date)
+        old_months = set(self._month_windows(*old_dates))
+        self.config = config
+        self.start_date, self.end_date = self._fetch_window()
+        
+        window_changed = (self.start_date, self.end_date) != old_dates
+        if window_changed:
+            self.window = DateWindow(self.start_date, self.end_date)
+            # The store remembers nights that left the window, so ones that come back
+            # keep their notified state instead of being reported as new openings
+            self.known = {}
+            self._load_known()
+        
+        if config['notifications'] != old['notifications']:
+            self.notifier.close()
+            self.notifier = NotificationDispatcher(config['notifications'], self.logger, self.metrics,
+                                                   self.transport)
+        self.renderer = NotificationRenderer(config['notifications'], self.window, config['target_dates'])
+        self.stay_engines = self._build_stay_engines()
+        if self.index is not None:
+            self.index.retain(set(new_parks), self.window)
+        if window_changed or config.get('subscriptions') != old.get('subscriptions'):
+            self.subscriptions = self._build_subscriptions(self.subscriptions)
+        self._hold_notifications()
+        
+        # Permit months are parsed with the park's group size, so settings edits invalidate them
+        stale_permits = set()
+        for name in removed + changed:
+            park, new_park = old_parks[name], new_parks.get(name, {})
+            if park.get('check_permits', False) and (
+                    not new_park.get('check_permits', False)
+                    or park.get('permit_group_size', 1) != new_park.get('permit_group_size', 1)):
+                try:
+                    stale_permits.update(self._permit_key(permit_id)
+                                         for permit_id, _ in self._discover_permits(park['park_id']))
+                except Exception as e:
+                    self.logger.debug(f"Error listing permits of {name}: {e}")
+        
+        before = set(self.check_scheduler.costs)
+        self._plan_units()
+        planned = set(self.check_scheduler.costs)
+        watched = {key[2] for key in planned if key[0] == 'campground'}
+        
+        # A cached month is only still valid if it covers the same nights in the new window
+        unchanged = old_months & set(self._month_windows(self.start_date, self.end_date))
+        months = {month_start for month_start, _ in unchanged}
+        dropped = self.fetch_units.rebase(self.window, lambda key: key[1] in months and (
+            key[0] not in stale_permits if key[0].startswith('permit:') else key[0] in watched
+        ))
+        
+        # New units are checked right away; nights the window gained need every unit fetched once
+        grew = self.start_date < old_dates[0] or self.end_date > old_dates[1]
+        self.check_scheduler.expedite(planned if grew else planned - before)
+        
+        self.logger.info(
+            f"Reloaded {self.config_path}: parks added {added or 'none'}, removed {removed or 'none'}, "
+            f"changed {changed or 'none'}; window {self.start_date} to {self.end_date}; "
+            f"{len(planned - before)} units added, {len(before - planned)} retired, "
+            f"{dropped} cached months dropped"
+        )
+        restart = sorted(
+            section for section in set(old) | set(config)
+            if section not in self.RELOADABLE and old.get(section) != config.get(section)
+        )
+        if restart:
+            self.logger.warning(f"Changes to {', '.join(restart)} take effect after a restart")
+        return True
+    
+    def _build_stay_engines(self) -> Dict[str, StayQueryEngine]:
+        """Stay query engines for the parks that configure stay_queries"""
+        return {
+            park['name']: StayQueryEngine(
+                [StayQuery(query, self.window) for query in park['stay_queries']], self.window
+            )
+            for park in self.config['parks'] if park.get('stay_queries')
+        }
+    
+    def _build_subscriptions(self, previous: Optional[SubscriptionIndex] = None) -> SubscriptionIndex:
+        """Index the configured subscriptions on the current window.
+        
+        When rebuilding, subscriptions whose notification settings did not
+        change keep their dispatcher (and anything queued in it), and the
+        campgrounds already registered are registered again.
+        """
+        notifiers = {}
+        for subscription in previous.subscriptions if previous else []:
+            key = (subscription.name, json.dumps(subscription.notifications, sort_keys=True))
+            notifiers.setdefault(key, []).append(subscription.notifier)
+        
+        subscriptions = []
+        for config in self.config.get('subscriptions', []):
+            reused = notifiers.get(
+                (config.get('name', 'subscriber'), json.dumps(config.get('notifications', {}), sort_keys=True))
+            )
+            subscriptions.append(Subscription(
+                config, self.window, self.logger, self.metrics, reused.pop() if reused else None, self.transport
+            ))
+        for unused in notifiers.values():
+            for notifier in unused:
+                notifier.close()
+        
+        index = SubscriptionIndex(subscriptions)
+        for park_name, campground_id in previous.registered if previous else ():
+            index.register(park_name, campground_id)
+        return index
+    
+    def _use_streaming_parser(self, json_parser: str) -> bool:
+        """Pick the availability parser from `monitoring.json_parser`"""
+        if json_parser == 'json':
+            return False
+        
+        if ijson is None:
+            if json_parser == 'stream':
+                self.logger.error("ijson library not installed. Run: pip install ijson")
+            return False
+        
+        # ijson's pure-Python backend is slower than json; only stream by default on the C one
+        return json_parser == 'stream' or 'yajl2_c' in ijson.backend
+    
+    def _fetch_window(self) -> tuple:
+        """Return the (start_date, end_date) covering target_dates and every subscription"""
+        windows = [self.config['target_dates']] + [
+            subscription['target_dates'] for subscription in self.config.get('subscriptions', [])
+            if subscription.get('target_dates')
+        ]
+        return (
+            min(str(window['start_date']) for window in windows),
+            max(str(window['end_date']) for window in windows)
+        )
     
     def _setup_logging(self):
-        """Setup logging configuration"""
+        """Setup logging configuration.
+        
+        With `logging.async` the fetch loop only enqueues records; a
+        listener thread formats and writes them, rotating and compressing
+        the log file as configured.
+        """
         log_config = self.config.get('logging', {})
         log_level = getattr(logging, log_config.get('level', 'INFO'))
+        json_lines = log_config.get('format', 'text') == 'json'
         
         # Create logger
         self.logger = logging.getLogger('ParkMonitor')
         self.logger.setLevel(log_level)
+        handlers = []
         
         # File handler
         if log_config.get('log_file'):
-            fh = logging.FileHandler(log_config['log_file'])
+            if log_config.get('max_bytes') or log_config.get('rotate_hours'):
+                fh = RotatingLogFile(
+                    log_config['log_file'],
+                    max_bytes=log_config.get('max_bytes', 0),
+                    rotate_hours=log_config.get('rotate_hours', 0),
+                    backup_count=log_config.get('backup_count', 7),
+                    compress=log_config.get('compress', False)
+                )
+            else:
+                fh = logging.FileHandler(log_config['log_file'])
             fh.setLevel(log_level)
-            fh.setFormatter(logging.Formatter(
+            fh.setFormatter(JsonLogFormatter() if json_lines else logging.Formatter(
                 '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
             ))
-            self.logger.addHandler(fh)
+            handlers.append(fh)
         
         # Console handler
         if log_config.get('console_output', True):
@@ -65,144 +3619,389 @@ class ParkAvailabilityMonitor:
             ch.setFormatter(logging.Formatter(
                 '%(asctime)s - %(levelname)s - %(message)s'
             ))
-            self.logger.addHandler(ch)
+            handlers.append(ch)
+        
+        self.log_listener = None
+        if log_config.get('async', False) and handlers:
+            import atexit
+            from logging.handlers import QueueListener
+            
+            log_queue = queue.SimpleQueue()
+            self.log_listener = QueueListener(
+                log_queue, *handlers, respect_handler_level=True
+            )
+            self.log_listener.start()
+            # Drain whatever is still queued when the process exits
+            atexit.register(self.close_logging)
+            handlers = [LogQueueHandler(log_queue)]
+        
+        for handler in handlers:
+            self.logger.addHandler(handler)
     
-    def check_campground_availability(self, park_id: str, park_name: str) -> List[Dict]:
-        """Check campground availability for a specific park"""
-        self.logger.info(f"Checking campground availability for {park_name}")
+    def check_campground_availability(self, park_id: str, park_name: str,
+                                      campgrounds: Optional[List[tuple]] = None) -> List[SiteAvailability]:
+        """Check campground availability for a specific park.
+        
+        `campgrounds` limits the check to those (campground_id, name) pairs;
+        by default every campground listed for the park is checked.
+        """
+        self.logger.info(f"Checking campground availability for {park_name}", extra={'park': park_name})
         
         available_sites = []
-        start_date = self.config['target_dates']['start_date']
-        end_date = self.config['target_dates']['end_date']
+        start_date, end_date = self.start_date, self.end_date
         
         try:
             # Get campgrounds for the park
-            campgrounds_url = f"{self.base_url}/search"
-            params = {
-                'fq': f'entity_id:{park_id}',
-                'start': 0,
-                'size': 100
-            }
+            if campgrounds is None:
+                campgrounds = self._discover_campgrounds(park_id)
             
-            response = self.session.get(campgrounds_url, params=params, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                results = data.get('results', [])
-                
-                for campground in results:
-                    if campground.get('entity_type') == 'campground':
-                        campground_id = campground.get('entity_id')
-                        campground_name = campground.get('name')
-                        
-                        # Check availability for this campground
-                        avail = self._check_specific_campground(
-                            campground_id, 
-                            campground_name,
-                            start_date,
-                            end_date
-                        )
-                        if avail:
-                            available_sites.extend(avail)
-            else:
-                self.logger.warning(f"Failed to fetch campgrounds for {park_name}: {response.status_code}")
+            for campground_id, campground_name in campgrounds:
+                # Check availability for this campground
+                avail = self._check_specific_campground(
+                    campground_id, 
+                    campground_name,
+                    start_date,
+                    end_date
+                )
+                if avail:
+                    available_sites.extend(avail)
                 
         except Exception as e:
             self.logger.error(f"Error checking {park_name}: {e}")
         
         return available_sites
     
+    def _discover_campgrounds(self, park_id: str) -> List[tuple]:
+        """List a park's (campground_id, campground_name) pairs via the discovery cache"""
+        return self.discovery.get(park_id, 'campground', lambda: [
+            (campground.get('entity_id'), campground.get('name'))
+            for campground in self._search_all([f'entity_id:{park_id}'])
+            if campground.get('entity_type') == 'campground'
+        ])
+    
+    def _discover_permits(self, park_id: str) -> List[tuple]:
+        """List a park's (permit_id, permit_name) pairs via the discovery cache"""
+        return self.discovery.get(park_id, 'permit', lambda: [
+            (permit.get('entity_id'), permit.get('name'))
+            for permit in self._search_all([f'entity_id:{park_id}', 'entity_type:permit'])
+            if permit.get('entity_type') == 'permit'
+        ])
+    
+    def _search_all(self, filters: List[str], page_size: int = 100) -> List[Dict]:
+        """Fetch every page of /search results, requesting later pages in parallel"""
+        def fetch_page(start: int) -> dict:
+            response = self._get(f"{self.base_url}/search", {'fq': filters, 'start': start, 'size': page_size})
+            response.raise_for_status()
+            return response.json()
+        
+        first_page = fetch_page(0)
+        results = first_page.get('results', [])
+        total = first_page.get('total', len(results))
+        
+        starts = range(page_size, total, page_size)
+        if starts:
+            with ThreadPoolExecutor(max_workers=min(len(starts), self.max_concurrency)) as pool:
+                for page in pool.map(fetch_page, starts):
+                    results.extend(page.get('results', []))
+        
+        return results
+    
+    def _get(self, url: str, params: Optional[dict] = None,
+             headers: Optional[dict] = None) -> requests.Response:
+        """GET a URL from a worker thread, within an async cycle's limits while one runs.
+        
+        Discovery and permit requests are made from threads in both fetch
+        modes. During an async cycle they are handed to its event loop, so
+        max_concurrency and max_connections_per_host bound them together
+        with the availability requests.
+        """
+        loop = self._async_loop
+        if loop is not None and loop.is_running():
+            import asyncio
+            
+            future = asyncio.run_coroutine_threadsafe(self._fetch_async(url, params, headers), loop)
+            try:
+                return future.result()
+            except CancelledError:
+                # The cycle ended first, e.g. under a background discovery refresh
+                pass
+        return self.scheduler.get(url, params=params, headers=headers, timeout=30)
+    
     def _check_specific_campground(self, campground_id: str, campground_name: str, 
-                                   start_date: str, end_date: str) -> List[Dict]:
-        """Check availability for a specific campground"""
-        available = []
+                                   start_date: str, end_date: str) -> List[SiteAvailability]:
+        """Check availability for a specific campground, one month at a time"""
+        # A campground listed under several parks is fetched once per cycle
+        if campground_id in self._fetched:
+            return self._fetched[campground_id]
         
+        months = [
+            self._check_campground_month(campground_id, campground_name, month_start, month_end)
+            for month_start, month_end in self._month_windows(start_date, end_date)
+        ]
+        sites = self._fetched[campground_id] = self._merge_campground_months(campground_id, months)
+        return sites
+    
+    def _check_campground_month(self, campground_id: str, campground_name: str,
+                                month_start: str, month_end: str) -> Optional[tuple]:
+        """Fetch one month of a campground, returning (sites, changed) or None"""
         try:
             # Recreation.gov availability API endpoint
-            avail_url = f"{self.base_url}/camps/availability/campground/{campground_id}"
-            params = {
-                'start_date': start_date,
-                'end_date': end_date
-            }
-            
-            response = self.session.get(avail_url, params=params, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                campsites = data.get('campsites', {})
-                
-                for site_id, site_data in campsites.items():
-                    site_name = site_data.get('site')
-                    availabilities = site_data.get('availabilities', {})
-                    
-                    # Check each date in June 2026
-                    available_dates = [
-                        date for date, status in availabilities.items()
-                        if status == 'Available'
-                    ]
-                    
-                    if available_dates:
-                        available.append({
-                            'campground_name': campground_name,
-                            'campground_id': campground_id,
-                            'site_name': site_name,
-                            'site_id': site_id,
-                            'available_dates': available_dates
-                        })
+            key = (campground_id, month_start)
+            response = self.scheduler.get(
+                f"{self.base_url}/camps/availability/campground/{campground_id}",
+                params={'start_date': month_start, 'end_date': month_end},
+                headers=self.fetch_units.conditional_headers(key),
+                timeout=30
+            )
+            return self._resolve_campground_month(key, response, campground_name)
                         
         except Exception as e:
-            self.logger.debug(f"Error checking campground {campground_id}: {e}")
+            self.logger.debug(f"Error checking campground {campground_id} for {month_start}: {e}",
+                              extra={'campground': campground_id, 'month': month_start})
+            return None
+    
+    def _resolve_campground_month(self, key: tuple, response: requests.Response,
+                                  campground_name: str) -> Optional[tuple]:
+        """Parse a month's response unless the fetch unit cache shows it unchanged"""
+        return self.fetch_units.resolve(
+            key, response, lambda r: self._decode_campground_month(r, key[0], campground_name)
+        )
+    
+    def _decode_campground_month(self, response: requests.Response, campground_id: str,
+                                 campground_name: str) -> List[SiteAvailability]:
+        """Decode and parse one month's availability payload"""
+        started = time.perf_counter()
+        try:
+            if self.stream_json and len(response.content) >= self.stream_min_bytes:
+                # Decode site by site straight into masks, never building the whole document
+                with self.metrics.phase('decode'):
+                    return self._stream_campground_availability(response.content, campground_id,
+                                                                campground_name)
+            with self.metrics.phase('decode'):
+                data = response.json()
+            with self.metrics.phase('parse'):
+                return self._parse_campground_availability(data, campground_id, campground_name)
+        finally:
+            self.metrics.observe('parkmonitor_parse_seconds', time.perf_counter() - started)
+    
+    def _merge_campground_months(self, campground_id: str,
+                                 months: List[Optional[tuple]]) -> List[SiteAvailability]:
+        """Combine per-month results into one record per site"""
+        if all(month is not None for month in months):
+            self._checked.add(campground_id)
+            # A campground listed under several parks is fetched once per park
+            changed = any(changed for _, changed in months)
+            self._changed[campground_id] = self._changed.get(campground_id, False) or changed
+        else:
+            self.fetch_units.invalidate(campground_id)
+        
+        merged = {}
+        for month in months:
+            if month is None:
+                continue
+            for site in month[0]:
+                previous = merged.get(site.site_id)
+                # Build a new record so the cached unit results are never mutated
+                merged[site.site_id] = site.with_mask(previous.mask | site.mask) if previous else site
+        
+        return list(merged.values())
+    
+    @staticmethod
+    def _month_windows(start_date: str, end_date: str) -> List[tuple]:
+        """Split a date range into (start, end) pairs clamped to calendar months"""
+        start = date.fromisoformat(start_date)
+        end = date.fromisoformat(end_date)
+        windows = []
+        
+        while start <= end:
+            next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+            month_end = min(end, next_month - timedelta(days=1))
+            windows.append((start.isoformat(), month_end.isoformat()))
+            start = next_month
+        
+        return windows
+    
+    def _parse_campground_availability(self, data: dict, campground_id: str,
+                                       campground_name: str) -> List[SiteAvailability]:
+        """Extract available sites from a campground availability response"""
+        available = []
+        
+        for site_id, site_data in data.get('campsites', {}).items():
+            site = self._parse_campsite(site_id, site_data, campground_id, campground_name)
+            if site is not None:
+                available.append(site)
+        
+        return available
+    
+    def _stream_campground_availability(self, body: bytes, campground_id: str,
+                                        campground_name: str) -> List[SiteAvailability]:
+        """Incrementally parse a response body, holding one campsite at a time"""
+        available = []
+        
+        for site_id, site_data in ijson.kvitems(io.BytesIO(body), 'campsites'):
+            site = self._parse_campsite(site_id, site_data, campground_id, campground_name)
+            if site is not None:
+                available.append(site)
         
         return available
     
-    def check_permit_availability(self, park_id: str, park_name: str) -> List[Dict]:
+    def _parse_campsite(self, site_id: str, site_data: dict, campground_id: str,
+                        campground_name: str) -> Optional[SiteAvailability]:
+        """Fold one campsite's availabilities into a mask; None if nothing is open"""
+        # Set one bit per available night inside the target window
+        offset = self.window.offset
+        mask = 0
+        for date_str, status in site_data.get('availabilities', {}).items():
+            if status == 'Available':
+                bit = offset(date_str)
+                if bit >= 0:
+                    mask |= 1 << bit
+        
+        if not mask:
+            return None
+        
+        return SiteAvailability(
+            campground_id, campground_name, site_id,
+            site_data.get('site'), mask, self.window,
+            site_data.get('campsite_type'), site_data.get('loop')
+        )
+    
+    def check_permit_availability(self, park_id: str, park_name: str) -> List[PermitAvailability]:
         """Check permit availability for a specific park"""
-        self.logger.info(f"Checking permit availability for {park_name}")
+        self.logger.info(f"Checking permit availability for {park_name}", extra={'park': park_name})
         
         available_permits = []
         
         try:
-            # Search for permits/tickets for this park
-            permits_url = f"{self.base_url}/search"
-            params = {
-                'fq': f'entity_id:{park_id}',
-                'fq': 'entity_type:ticket',
-                'start': 0,
-                'size': 100
-            }
-            
-            response = self.session.get(permits_url, params=params, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                results = data.get('results', [])
-                
-                for permit in results:
-                    permit_id = permit.get('entity_id')
-                    permit_name = permit.get('name')
-                    
-                    # Check if permits are available for June 2026
-                    if self._check_permit_dates(permit_id):
-                        available_permits.append({
-                            'permit_name': permit_name,
-                            'permit_id': permit_id,
-                            'park_name': park_name
-                        })
+            # Search for permits for this park
+            available_permits = self._check_permits(self._discover_permits(park_id), park_name)
                         
         except Exception as e:
             self.logger.error(f"Error checking permits for {park_name}: {e}")
         
-        return available_permits
+        return available_permits
+    
+    def _check_permits(self, permits: List[tuple], park_name: str) -> List[PermitAvailability]:
+        """Check (permit_id, permit_name) pairs concurrently, one request per permit and month.
+        
+        Each monthly request covers every division of the permit, so the
+        request count does not grow with the number of trailheads.
+        """
+        self._park_permits[park_name] = {self._permit_key(permit_id) for permit_id, _ in permits}
+        if not permits:
+            return []
+        
+        park = next((park for park in self.config['parks'] if park['name'] == park_name), {})
+        group_size = park.get('permit_group_size', 1)
+        months = [month_start for month_start, _ in self._month_windows(self.start_date, self.end_date)]
+        
+        with ThreadPoolExecutor(max_workers=min(len(permits) * len(months), self.max_concurrency)) as pool:
+            divisions = list(pool.map(lambda permit: self._permit_divisions(permit[0]), permits))
+            fetched = list(pool.map(
+                lambda unit: self._check_permit_month(*unit, group_size),
+                [(permit_id, permit_name, names, month_start)
+                 for (permit_id, permit_name), names in zip(permits, divisions)
+                 for month_start in months]
+            ))
+        
+        available_permits = []
+        for index, (permit_id, _) in enumerate(permits):
+            available_permits += self._merge_permit_months(
+                permit_id, fetched[index * len(months):(index + 1) * len(months)]
+            )
+        return available_permits
+    
+    def _permit_divisions(self, permit_id: str) -> Dict[str, str]:
+        """Map a permit's division ids to trailhead/entry point names via the discovery cache"""
+        def load() -> List[tuple]:
+            response = self._get(f"{self.base_url}/permitcontent/{permit_id}")
+            response.raise_for_status()
+            divisions = response.json().get('payload', {}).get('divisions', {})
+            return [(division_id, division.get('name')) for division_id, division in divisions.items()]
+        
+        try:
+            return dict(self.discovery.get(permit_id, 'division', load))
+        except Exception as e:
+            self.logger.debug(f"Error listing divisions of permit {permit_id}: {e}")
+            return {}
+    
+    def _check_permit_month(self, permit_id: str, permit_name: str, divisions: Dict[str, str],
+                            month_start: str, group_size: int) -> Optional[tuple]:
+        """Fetch one month of every division of a permit, returning (records, changed) or None"""
+        try:
+            key = (self._permit_key(permit_id), month_start)
+            response = self._get(
+                f"{self.base_url}/permits/{permit_id}/availability/month",
+                {'start_date': f"{month_start[:8]}01T00:00:00.000Z", 'commercial_acct': 'false'},
+                self.fetch_units.conditional_headers(key)
+            )
+            return self.fetch_units.resolve(key, response, lambda r: self._parse_permit_availability(
+                r.json(), permit_id, permit_name, divisions, group_size
+            ))
+        
+        except Exception as e:
+            self.logger.debug(f"Error checking permit {permit_id} for {month_start}: {e}",
+                              extra={'permit': permit_id, 'month': month_start})
+            return None
+    
+    def _parse_permit_availability(self, data: dict, permit_id: str, permit_name: str,
+                                   divisions: Dict[str, str], group_size: int) -> List[PermitAvailability]:
+        """Extract divisions with at least `group_size` quota left from a permit month response"""
+        available = []
+        offset = self.window.offset
+        
+        for division_id, division in data.get('payload', {}).get('availability', {}).items():
+            # Most permits report date_availability; some only have per-quota-type maps
+            quotas = division.get('date_availability') or next(
+                iter(division.get('quota_type_maps', {}).values()), {}
+            )
+            
+            mask = 0
+            remaining = {}
+            for date_str, quota in quotas.items():
+                left = quota.get('remaining', 0)
+                if left >= group_size and not quota.get('is_secret_quota'):
+                    bit = offset(date_str)
+                    if bit >= 0:
+                        mask |= 1 << bit
+                        remaining[bit] = left
+            
+            if mask:
+                available.append(PermitAvailability(
+                    permit_id, permit_name, division_id,
+                    divisions.get(division_id, division_id), mask, self.window, remaining
+                ))
+        
+        return available
     
-    def _check_permit_dates(self, permit_id: str) -> bool:
-        """Check if a specific permit has availability"""
-        try:
-            # This would need to be customized based on the specific permit API
-            # Recreation.gov has different endpoints for different permit types
-            return False  # Placeholder
-        except Exception as e:
-            self.logger.debug(f"Error checking permit {permit_id}: {e}")
-            return False
+    def _merge_permit_months(self, permit_id: str,
+                             months: List[Optional[tuple]]) -> List[PermitAvailability]:
+        """Combine per-month results into one record per division"""
+        permit_key = self._permit_key(permit_id)
+        if all(month is not None for month in months):
+            self._checked.add(permit_key)
+            changed = any(changed for _, changed in months)
+            self._changed[permit_key] = self._changed.get(permit_key, False) or changed
+        else:
+            self.fetch_units.invalidate(permit_key)
+        
+        merged = {}
+        for month in months:
+            if month is None:
+                continue
+            for record in month[0]:
+                previous = merged.get(record.division_id)
+                # Build a new record so the cached unit results are never mutated
+                merged[record.division_id] = previous.with_mask(
+                    previous.mask | record.mask, {**previous.remaining, **record.remaining}
+                ) if previous else record
+        
+        return list(merged.values())
+    
+    @staticmethod
+    def _permit_key(permit_id: str) -> str:
+        """Store key for a permit, kept apart from campground ids"""
+        return f"permit:{permit_id}"
     
     def send_email_notification(self, subject: str, body: str):
         """Send email notification"""
@@ -210,22 +4009,7 @@ class ParkAvailabilityMonitor:
             return
         
         try:
-            email_config = self.config['notifications']['email']
-            
-            msg = MIMEMultipart()
-            msg['From'] = email_config['sender_email']
-            msg['To'] = ', '.join(email_config['recipient_emails'])
-            msg['Subject'] = subject
-            
-            msg.attach(MIMEText(body, 'html'))
-            
-            with smtplib.SMTP(email_config['smtp_server'], email_config['smtp_port']) as server:
-                server.starttls()
-                server.login(email_config['sender_email'], email_config['sender_password'])
-                server.send_message(msg)
-            
-            self.logger.info(f"Email notification sent: {subject}")
-            
+            self.notifier.send('email', [(subject, body)])
         except Exception as e:
             self.logger.error(f"Failed to send email: {e}")
     
@@ -235,20 +4019,7 @@ class ParkAvailabilityMonitor:
             return
         
         try:
-            webhook_url = self.config['notifications']['webhook']['url']
-            
-            # Format for Slack/Discord
-            payload = {
-                'text': f"🏕️ New Availability Found!\n\n{json.dumps(data, indent=2)}"
-            }
-            
-            response = requests.post(webhook_url, json=payload, timeout=10)
-            
-            if response.status_code == 200:
-                self.logger.info("Webhook notification sent successfully")
-            else:
-                self.logger.warning(f"Webhook notification failed: {response.status_code}")
-                
+            self.notifier.send('webhook', [data])
         except Exception as e:
             self.logger.error(f"Failed to send webhook: {e}")
     
@@ -258,147 +4029,630 @@ class ParkAvailabilityMonitor:
             return
         
         try:
-            from twilio.rest import Client
-            
-            sms_config = self.config['notifications']['sms']
-            client = Client(sms_config['twilio_account_sid'], sms_config['twilio_auth_token'])
-            
-            for recipient in sms_config['recipient_phone_numbers']:
-                client.messages.create(
-                    body=message,
-                    from_=sms_config['twilio_phone_number'],
-                    to=recipient
-                )
-            
-            self.logger.info("SMS notification sent successfully")
-            
+            self.notifier.send('sms', [message])
         except ImportError:
             self.logger.error("Twilio library not installed. Run: pip install twilio")
         except Exception as e:
             self.logger.error(f"Failed to send SMS: {e}")
     
-    def format_notification_message(self, park_name: str, available_sites: List[Dict], 
-                                   available_permits: List[Dict]) -> tuple:
+    def format_notification_message(self, park_name: str, available_sites: List[SiteAvailability], 
+                                   available_permits: List[PermitAvailability]) -> tuple:
         """Format notification message for email and other channels"""
+        return self.renderer.render(park_name, available_sites, available_permits)
+    
+    def check_all_parks(self):
+        """Check availability for all configured parks"""
+        self.logger.info("=" * 60)
+        self.logger.info("Starting availability check for all parks")
+        self.logger.info("=" * 60)
         
-        # HTML email body
-        html_body = f"""
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; }}
-                h2 {{ color: #2c5f2d; }}
-                .site {{ background-color: #f0f8f0; padding: 10px; margin: 10px 0; border-radius: 5px; }}
-                .permit {{ background-color: #f0f0f8; padding: 10px; margin: 10px 0; border-radius: 5px; }}
-                .dates {{ color: #666; font-size: 0.9em; }}
-            </style>
-        </head>
-        <body>
-            <h2>🏕️ New Availability Found for {park_name}!</h2>
-            <p><strong>Target Period:</strong> June 2026</p>
-        """
-        
-        if available_sites:
-            html_body += "<h3>Available Campsites:</h3>"
+        self._check_parks([
+            (park, None if park.get('check_camping', True) else [], park.get('check_permits', False))
+            for park in self.config['parks']
+        ])
+        
+        self.logger.info("\n" + "=" * 60)
+        self.logger.info("Availability check completed")
+        self.logger.info("=" * 60 + "\n")
+    
+    def _check_parks(self, plan: List[tuple]) -> Dict[tuple, int]:
+        """Check a plan of (park, campgrounds, check_permits) entries and notify.
+        
+        `campgrounds` is a list of (campground_id, name) pairs, or None for
+        every campground the park lists. Returns the newly opened masks.
+        """
+        self._checked = set()
+        self._changed = {}
+        self._fetched = {}
+        started = time.perf_counter()
+        self.scheduler.start_cycle(self.cycle_budget)
+        
+        try:
+            if self.shards is not None:
+                results = self._check_parks_sharded(plan)
+            elif self.fetch_mode == 'async':
+                import asyncio
+                results = asyncio.run(self._check_parks_async(plan))
+            else:
+                results = []
+                for park, campgrounds, check_permits in plan:
+                    park_name = park['name']
+                    park_id = park['park_id']
+                    
+                    self.logger.info(f"\nChecking {park_name}...")
+                    
+                    available_sites = []
+                    available_permits = []
+                    
+                    # Check camping availability
+                    if campgrounds is None or campgrounds:
+                        available_sites = self.check_campground_availability(
+                            park_id, park_name, campgrounds
+                        )
+                    
+                    # Check permit availability
+                    if check_permits:
+                        available_permits = self.check_permit_availability(park_id, park_name)
+                    
+                    results.append((available_sites, available_permits))
+        finally:
+            skipped = self.scheduler.finish_cycle()
+        self._report_skipped(skipped)
+        
+        with self.metrics.phase('filter'):
+            newly_opened = self._apply_cycle(results)
+            detected_at = time.monotonic()
+            if self.index is not None:
+                self._publish_results(plan, results)
+            
+            if self.subscriptions.subscriptions:
+                self._notify_subscribers(plan, results, newly_opened, detected_at)
+            else:
+                seen = set()  # (campground_id, site_id) and (permit key, division_id) already sent
+                for (park, _, _), (available_sites, available_permits) in zip(plan, results):
+                    self._process_park_results(park['name'], available_sites, available_permits,
+                                               newly_opened, detected_at, seen)
+        
+        self.metrics.observe('parkmonitor_cycle_seconds', time.perf_counter() - started)
+        self.metrics.inc('parkmonitor_cycles_total')
+        self.metrics.inc('parkmonitor_openings_total', len(newly_opened))
+        self.metrics.set('parkmonitor_last_cycle_timestamp_seconds', time.time())
+        self.metrics.set('parkmonitor_http_connection_reuse_ratio', self.transport.stats()['reuse_ratio'])
+        return newly_opened
+    
+    def _report_skipped(self, skipped: Dict[str, str]):
+        """Log which campgrounds, permits and endpoints a cycle skipped, and why"""
+        if not skipped:
+            return
+        
+        by_reason = {}
+        for circuit, reason in sorted(skipped.items()):
+            by_reason.setdefault(reason, []).append(circuit)
+        
+        for reason, circuits in by_reason.items():
+            shown = ', '.join(circuits[:20])
+            if len(circuits) > 20:
+                shown += f" and {len(circuits) - 20} more"
+            if reason == 'deadline':
+                self.logger.warning(
+                    f"Cycle hit its {self.cycle_budget:g}s budget; partial results, skipped: {shown}"
+                )
+            else:
+                self.logger.warning(f"Skipped this cycle ({reason}): {shown}")
+    
+    def _publish_results(self, plan: List[tuple], results: List[tuple]):
+        """Hand a cycle's records to the in-memory index behind the query API"""
+        fresh = {}
+        for (park, _, _), (available_sites, available_permits) in zip(plan, results):
             for site in available_sites:
-                dates_str = ', '.join(site['available_dates'][:5])
-                if len(site['available_dates']) > 5:
-                    dates_str += f" ... (+{len(site['available_dates']) - 5} more)"
-                
-                html_body += f"""
-                <div class="site">
-                    <strong>{site['campground_name']}</strong> - {site['site_name']}<br>
-                    <span class="dates">Available dates: {dates_str}</span><br>
-                    <a href="https://www.recreation.gov/camping/campgrounds/{site['campground_id']}">Book Now</a>
-                </div>
-                """
-        
-        if available_permits:
-            html_body += "<h3>Available Permits:</h3>"
+                fresh.setdefault(
+                    site.campground_id, (park['name'], site.campground_name, 'campground', {})
+                )[3][site.site_id] = site
             for permit in available_permits:
-                html_body += f"""
-                <div class="permit">
-                    <strong>{permit['permit_name']}</strong><br>
-                    <a href="https://www.recreation.gov/ticket/{permit['permit_id']}">Check Availability</a>
-                </div>
-                """
+                fresh.setdefault(
+                    self._permit_key(permit.permit_id), (park['name'], permit.permit_name, 'permit', {})
+                )[3][permit.division_id] = permit
+        self.index.update(fresh, self._checked)
+    
+    def _load_known(self):
+        """Rebuild the last seen open masks from the store"""
+        for campground_id, site_id, date_str in self.store.load_open():
+            if not date_str:
+                # Permits were once tracked as a single open/closed flag
+                continue
+            
+            bit = self.window.offset(date_str)
+            if bit >= 0:
+                sites = self.known.setdefault(campground_id, {})
+                sites[site_id] = sites.get(site_id, 0) | (1 << bit)
+    
+    def _apply_cycle(self, results: List[tuple]) -> Dict[tuple, int]:
+        """Diff a cycle's results against the last seen state and persist the changes.
         
-        html_body += """
-            <p><em>This is an automated notification from your California National Parks Availability Monitor.</em></p>
-        </body>
-        </html>
+        Returns {(campground_id, site_id): mask of newly opened nights}, with
+        permit divisions keyed as (permit key, division_id). Campgrounds and
+        permits whose payloads did not change are skipped; ones that were
+        only partly fetched can open nights but never close them.
         """
+        unchanged = {campground_id for campground_id, changed in self._changed.items() if not changed}
+        
+        current = {}
+        for available_sites, available_permits in results:
+            for site in available_sites:
+                if site.campground_id not in unchanged:
+                    current.setdefault(site.campground_id, {})[site.site_id] = site.mask
+            for permit in available_permits:
+                permit_key = self._permit_key(permit.permit_id)
+                if permit_key not in unchanged:
+                    current.setdefault(permit_key, {})[permit.division_id] = permit.mask
         
-        # Plain text for SMS
-        text_body = f"New availability in {park_name} for June 2026! "
-        if available_sites:
-            text_body += f"{len(available_sites)} campsites available. "
-        if available_permits:
-            text_body += f"{len(available_permits)} permits available. "
-        text_body += "Check your email for details."
+        newly_opened = {}
+        changes = []
+        
+        for campground_id in (self._checked - unchanged) | current.keys():
+            fully_checked = campground_id in self._checked
+            old_sites = self.known.get(campground_id, {})
+            new_sites = current.get(campground_id, {})
+            
+            for site_id in old_sites.keys() | new_sites.keys():
+                old = old_sites.get(site_id, 0)
+                new = new_sites.get(site_id, 0)
+                opened = new & ~old
+                closed = old & ~new if fully_checked else 0
+                
+                if opened:
+                    newly_opened[(campground_id, site_id)] = opened
+                    changes += [
+                        (campground_id, site_id, date_str, AvailabilityStore.AVAILABLE)
+                        for date_str in self.window.dates(opened)
+                    ]
+                if closed:
+                    changes += [
+                        (campground_id, site_id, date_str, AvailabilityStore.UNAVAILABLE)
+                        for date_str in self.window.dates(closed)
+                    ]
+            
+            if fully_checked:
+                self.known[campground_id] = new_sites
+            else:
+                self.known[campground_id] = {
+                    site_id: old_sites.get(site_id, 0) | new_sites.get(site_id, 0)
+                    for site_id in old_sites.keys() | new_sites.keys()
+                }
         
-        return html_body, text_body
+        self.store.record_changes(changes)
+        if self.store.uncompacted >= self.compact_after_rows:
+            moved = self.store.compact(self.max_history_segments)
+            self.logger.debug(f"Compacted {moved} availability changes into history segments")
+        return newly_opened
     
-    def check_all_parks(self):
-        """Check availability for all configured parks"""
-        self.logger.info("=" * 60)
-        self.logger.info("Starting availability check for all parks")
-        self.logger.info("=" * 60)
+    def _process_park_results(self, park_name: str, available_sites: List[SiteAvailability],
+                              available_permits: List[PermitAvailability], newly_opened: Dict[tuple, int],
+                              detected_at: Optional[float] = None, seen: Optional[set] = None):
+        """Send notifications for a park's newly opened sites and permits.
         
-        for park in self.config['parks']:
-            park_name = park['name']
-            park_id = park['park_id']
+        Sites and permit divisions whose newly_opened key is in `seen` were
+        already sent under another park this cycle and are left out; the
+        ones sent here are added.
+        """
+        if available_sites or available_permits:
+            # Only notify about nights that were not already open last cycle
+            available_sites = self._select_new_sites(
+                available_sites, newly_opened, self.stay_engines.get(park_name)
+            )
+            available_permits = self._select_new_permits(available_permits, newly_opened)
             
-            self.logger.info(f"\nChecking {park_name}...")
+            if seen is not None:
+                # A campground listed under several parks is only reported once
+                available_sites = [
+                    site for site in available_sites if (site.campground_id, site.site_id) not in seen
+                ]
+                seen.update((site.campground_id, site.site_id) for site in available_sites)
+                available_permits = [
+                    permit for permit in available_permits
+                    if (self._permit_key(permit.permit_id), permit.division_id) not in seen
+                ]
+                seen.update((self._permit_key(permit.permit_id), permit.division_id)
+                            for permit in available_permits)
             
-            available_sites = []
-            available_permits = []
+            if available_sites or available_permits:
+                self.logger.info(f"✓ Found availability in {park_name}!", extra={
+                    'park': park_name, 'sites': len(available_sites), 'permits': len(available_permits)
+                })
+                self._submit_notifications(
+                    self.notifier, park_name, available_sites, available_permits, detected_at
+                )
+            else:
+                self.logger.info(f"No new availability in {park_name} since the last check")
+        else:
+            self.logger.info(f"✗ No availability found in {park_name}")
+    
+    def _notify_subscribers(self, plan: List[tuple], results: List[tuple],
+                            newly_opened: Dict[tuple, int], detected_at: Optional[float] = None):
+        """Fan a cycle's newly opened nights and permits out to the subscriptions watching them"""
+        index = self.subscriptions
+        seen = set()  # (subscription, campground_id, site_id) already sent this cycle
+        
+        for (park, _, _), (available_sites, available_permits) in zip(plan, results):
+            park_name = park['name']
+            matched = {}  # Subscription -> {(campground_id, site_id): newly opened nights it watches}
             
-            # Check camping availability
-            if park.get('check_camping', True):
-                available_sites = self.check_campground_availability(park_id, park_name)
+            for site in available_sites:
+                index.register(park_name, site.campground_id)
+                key = (site.campground_id, site.site_id)
+                opened = site.mask & newly_opened.get(key, 0)
+                if not opened:
+                    continue
+                # The index is per campground; a campground listed under several parks
+                # is only reported under the parks a subscription watches, and only once
+                for subscription, mask in index.match(site.campground_id, opened).items():
+                    if subscription.watches(park_name) and (subscription,) + key not in seen:
+                        seen.add((subscription,) + key)
+                        matched.setdefault(subscription, {})[key] = mask
             
-            # Check permit availability
-            if park.get('check_permits', False):
-                available_permits = self.check_permit_availability(park_id, park_name)
+            new_permits = self._select_new_permits(available_permits, newly_opened)
+            permits_for = {}  # Subscription -> new permit nights inside its dates
+            for subscription in index.for_park(park_name) if new_permits else []:
+                if subscription.check_permits:
+                    permits_for[subscription] = [
+                        permit.with_mask(permit.mask & subscription.nights_mask) for permit in new_permits
+                        if permit.mask & subscription.nights_mask
+                    ]
+                    matched.setdefault(subscription, {})
             
-            # Send notifications if new availability found
-            if available_sites or available_permits:
-                notification_key = f"{park_name}_{len(available_sites)}_{len(available_permits)}"
+            for subscription, opened in matched.items():
+                sites = self._select_new_sites(available_sites, opened, subscription.engine)
+                permits = permits_for.get(subscription, [])
                 
-                # Only notify if this is new availability
-                if notification_key not in self.found_availability:
-                    self.logger.info(f"✓ Found availability in {park_name}!")
-                    
-                    html_msg, text_msg = self.format_notification_message(
-                        park_name, available_sites, available_permits
-                    )
-                    
-                    # Send notifications
-                    self.send_email_notification(
-                        f"🏕️ Availability Found: {park_name} - June 2026",
-                        html_msg
-                    )
-                    
-                    self.send_webhook_notification({
-                        'park': park_name,
-                        'campsites': len(available_sites),
-                        'permits': len(available_permits)
-                    })
-                    
-                    self.send_sms_notification(text_msg)
-                    
-                    # Mark as notified
-                    self.found_availability[notification_key] = datetime.now()
-            else:
-                self.logger.info(f"✗ No availability found in {park_name}")
+                if sites or permits:
+                    self.logger.info(f"✓ Found availability in {park_name} for {subscription.name}")
+                    self._submit_notifications(subscription.notifier, park_name, sites, permits, detected_at)
+    
+    def _select_new_sites(self, available_sites: List[SiteAvailability], newly_opened: Dict[tuple, int],
+                          engine: Optional[StayQueryEngine] = None) -> List[SiteAvailability]:
+        """Narrow sites to their newly opened nights, or to stays those nights complete"""
+        new_sites = []
+        stays = engine.match(available_sites) if engine else None
+        
+        for site in available_sites:
+            key = (site.campground_id, site.site_id)
+            new_mask = site.mask & newly_opened.get(key, 0)
             
-            # Be respectful with API calls
-            time.sleep(2)
+            if stays is None:
+                if new_mask:
+                    new_sites.append(site.with_mask(new_mask))
+            elif stays.get(key, 0) & new_mask:
+                # A newly opened night completes or extends a wanted stay
+                new_sites.append(site.with_mask(stays[key]))
         
-        self.logger.info("\n" + "=" * 60)
-        self.logger.info("Availability check completed")
-        self.logger.info("=" * 60 + "\n")
+        return new_sites
+    
+    def _select_new_permits(self, available_permits: List[PermitAvailability],
+                            newly_opened: Dict[tuple, int]) -> List[PermitAvailability]:
+        """Narrow permit divisions to the nights that opened this cycle"""
+        new_permits = []
+        for permit in available_permits:
+            new_mask = permit.mask & newly_opened.get((self._permit_key(permit.permit_id), permit.division_id), 0)
+            if new_mask:
+                new_permits.append(permit.with_mask(new_mask))
+        return new_permits
+    
+    def _submit_notifications(self, notifier: NotificationDispatcher, park_name: str,
+                              available_sites: List[SiteAvailability], available_permits: List[PermitAvailability],
+                              detected_at: Optional[float] = None):
+        """Format a park's new availability and queue it on every channel"""
+        with self.metrics.phase('format'):
+            html_msg, text_msg = self.format_notification_message(
+                park_name, available_sites, available_permits
+            )
+        
+        # Queue notifications; the dispatcher delivers them off this thread
+        notifier.submit('email', (
+            f"🏕️ Availability Found: {park_name} - {self.renderer.period}",
+            html_msg
+        ), detected_at)
+        
+        notifier.submit('webhook', {
+            'park': park_name,
+            'campsites': len(available_sites),
+            'permits': len(available_permits)
+        }, detected_at)
+        
+        notifier.submit('sms', text_msg, detected_at)
+    
+    async def _check_parks_async(self, plan: List[tuple]) -> List[tuple]:
+        """Fetch a plan's parks concurrently, returning (sites, permits) per park"""
+        import asyncio
+        
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        loop.set_default_executor(executor)
+        # Requests get threads of their own: discovery and permit checks wait on
+        # them from default executor threads, and must not starve them of one
+        self._fetch_executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        
+        self._global_limit = asyncio.Semaphore(self.max_concurrency)
+        self._host_limits = {}
+        self._async_loop = loop
+        
+        try:
+            return await asyncio.gather(*[
+                self._check_park_async(park, campgrounds, check_permits)
+                for park, campgrounds, check_permits in plan
+            ])
+        finally:
+            self._async_loop = None
+            executor.shutdown(wait=False)
+            self._fetch_executor.shutdown(wait=False)
+    
+    async def _check_park_async(self, park: dict, campgrounds: Optional[List[tuple]],
+                                check_permits: bool) -> tuple:
+        """Check camping and permit availability for one park concurrently"""
+        import asyncio
+        
+        park_name = park['name']
+        park_id = park['park_id']
+        
+        self.logger.info(f"Checking {park_name}...")
+        
+        available_sites, available_permits = await asyncio.gather(
+            self._check_campground_availability_async(park_id, park_name, campgrounds)
+            if campgrounds is None or campgrounds else self._no_results(),
+            self._check_permit_availability_async(park_id, park_name)
+            if check_permits else self._no_results()
+        )
+        
+        return available_sites, available_permits
+    
+    @staticmethod
+    async def _no_results() -> List[Dict]:
+        """Placeholder coroutine for checks a park has disabled"""
+        return []
+    
+    async def _fetch_async(self, url: str, params: Optional[dict],
+                           headers: Optional[dict] = None) -> requests.Response:
+        """GET a URL on the shared session within the global and per-host limits"""
+        import asyncio
+        
+        host = urlparse(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.max_connections_per_host)
+        
+        async with self._global_limit, self._host_limits[host]:
+            return await asyncio.get_running_loop().run_in_executor(self._fetch_executor, functools.partial(
+                self.scheduler.get, url, params=params, headers=headers, timeout=30
+            ))
+    
+    async def _check_campground_availability_async(
+            self, park_id: str, park_name: str,
+            campgrounds: Optional[List[tuple]] = None) -> List[SiteAvailability]:
+        """Async counterpart of check_campground_availability"""
+        import asyncio
+        
+        self.logger.info(f"Checking campground availability for {park_name}", extra={'park': park_name})
+        
+        available_sites = []
+        start_date, end_date = self.start_date, self.end_date
+        
+        try:
+            if campgrounds is None:
+                campgrounds = await asyncio.to_thread(self._discover_campgrounds, park_id)
+            results = await asyncio.gather(*[
+                self._check_specific_campground_async(
+                    campground_id, campground_name, start_date, end_date
+                )
+                for campground_id, campground_name in campgrounds
+            ])
+            for avail in results:
+                available_sites.extend(avail)
+                
+        except Exception as e:
+            self.logger.error(f"Error checking {park_name}: {e}")
+        
+        return available_sites
+    
+    async def _check_specific_campground_async(self, campground_id: str, campground_name: str,
+                                               start_date: str, end_date: str) -> List[SiteAvailability]:
+        """Async counterpart of _check_specific_campground"""
+        import asyncio
+        
+        # Parks sharing a campground await the same fetch
+        task = self._fetched.get(campground_id)
+        if task is None:
+            task = self._fetched[campground_id] = asyncio.ensure_future(
+                self._fetch_campground_months_async(campground_id, campground_name, start_date, end_date)
+            )
+        return await task
+    
+    async def _fetch_campground_months_async(self, campground_id: str, campground_name: str,
+                                             start_date: str, end_date: str) -> List[SiteAvailability]:
+        """Fetch every month of a campground concurrently and merge them"""
+        import asyncio
+        
+        months = await asyncio.gather(*[
+            self._check_campground_month_async(campground_id, campground_name, month_start, month_end)
+            for month_start, month_end in self._month_windows(start_date, end_date)
+        ])
+        return self._merge_campground_months(campground_id, months)
+    
+    async def _check_campground_month_async(self, campground_id: str, campground_name: str,
+                                            month_start: str, month_end: str) -> Optional[tuple]:
+        """Async counterpart of _check_campground_month"""
+        try:
+            key = (campground_id, month_start)
+            response = await self._fetch_async(
+                f"{self.base_url}/camps/availability/campground/{campground_id}",
+                {'start_date': month_start, 'end_date': month_end},
+                self.fetch_units.conditional_headers(key)
+            )
+            return self._resolve_campground_month(key, response, campground_name)
+                
+        except Exception as e:
+            self.logger.debug(f"Error checking campground {campground_id} for {month_start}: {e}",
+                              extra={'campground': campground_id, 'month': month_start})
+            return None
+    
+    async def _check_permit_availability_async(self, park_id: str, park_name: str) -> List[PermitAvailability]:
+        """Async counterpart of check_permit_availability"""
+        import asyncio
+        
+        self.logger.info(f"Checking permit availability for {park_name}", extra={'park': park_name})
+        
+        try:
+            permits = await asyncio.to_thread(self._discover_permits, park_id)
+            return await asyncio.to_thread(self._check_permits, permits, park_name)
+                
+        except Exception as e:
+            self.logger.error(f"Error checking permits for {park_name}: {e}")
+        
+        return []
+    
+    def enable_recording(self, path: str):
+        """Save every API response to an HttpArchive at `path` while running live"""
+        self.archive = HttpArchive(path)
+        self.transport.mount(self.session, RecordingAdapter(
+            self.archive,
+            pool_connections=self.transport.pool_connections,
+            pool_maxsize=self.transport.pool_maxsize
+        ))
+        
+        # Hit /search every cycle so the archive does not depend on the discovery cache
+        self.discovery = DiscoveryCache(None, self.discovery.ttl / 3600, self.logger)
+        self.logger.info(f"Recording API responses to {path}")
+    
+    def enable_replay(self, path: str, deliver_notifications: bool = False):
+        """Serve every API request from an HttpArchive at `path`, at full speed.
+        
+        Replayed openings are real openings from the past, so notifications
+        are collected in `outbox` rather than sent, unless
+        `deliver_notifications` is set.
+        """
+        self.archive = HttpArchive(path)
+        self.transport.mount(self.session, ReplayAdapter(self.archive))
+        
+        self.scheduler.throttle = False
+        self.discovery = DiscoveryCache(None, self.discovery.ttl / 3600, self.logger)
+        
+        # Replayed cycles must not touch the real availability history
+        self.store.close()
+        self.store = AvailabilityStore(':memory:')
+        self.known = {}
+        if not deliver_notifications:
+            self.outbox = []
+            self._hold_notifications()
+        self.logger.info(f"Replaying API responses from {path}")
+    
+    def _hold_notifications(self):
+        """Point every dispatcher at `outbox`, including ones a reload just created"""
+        if self.outbox is None:
+            return
+        self.notifier.outbox = self.outbox
+        for subscription in self.subscriptions.subscriptions:
+            subscription.notifier.outbox = self.outbox
+    
+    def enable_sharding(self, workers: int = 0):
+        """Coordinate shard workers, starting `workers` of them locally.
+        
+        Workers on other hosts can join with `--worker` as long as they
+        share the `sharding.database` file. Only the coordinator diffs
+        results and sends notifications.
+        """
+        sharding = self.config.get('sharding', {})
+        self.shards = ShardStore(sharding.get('database', 'shards.db'))
+        self.shard_workers = workers
+        self._start_workers()
+        self.logger.info(f"Coordinating shard workers ({workers} local)")
+    
+    def _start_workers(self):
+        """Start local workers, replacing any that have exited"""
+        import multiprocessing
+        
+        # Spawn rather than fork: this process holds SQLite connections and threads
+        context = multiprocessing.get_context('spawn')
+        
+        alive = [process for process in self.shard_processes if process.is_alive()]
+        if len(alive) < len(self.shard_processes):
+            self.logger.warning(f"{len(self.shard_processes) - len(alive)} shard worker(s) exited, restarting")
+        
+        while len(alive) < self.shard_workers:
+            process = context.Process(target=run_shard_worker, args=(self.config_path,), daemon=True)
+            process.start()
+            alive.append(process)
+        self.shard_processes = alive
+    
+    def stop_workers(self):
+        """Stop local shard workers"""
+        for process in self.shard_processes:
+            process.terminate()
+        for process in self.shard_processes:
+            process.join(5)
+        self.shard_processes = []
+    
+    def _check_parks_sharded(self, plan: List[tuple]) -> List[tuple]:
+        """Have the workers fetch a plan's campgrounds, returning (sites, permits) per park"""
+        sharding = self.config.get('sharding', {})
+        timeout = sharding.get('cycle_timeout_seconds', 300)
+        poll_interval = sharding.get('poll_interval_seconds', 0.2)
+        
+        park_campgrounds = []
+        for park, campgrounds, _ in plan:
+            if campgrounds is None:
+                try:
+                    campgrounds = self._discover_campgrounds(park['park_id'])
+                except Exception as e:
+                    self.logger.error(f"Error checking {park['name']}: {e}")
+                    campgrounds = []
+            park_campgrounds.append(campgrounds)
+        
+        units = list({campground_id: campground_name
+                      for campgrounds in park_campgrounds
+                      for campground_id, campground_name in campgrounds}.items())
+        
+        self._start_workers()
+        cycle_id = self.shards.start_cycle(units)
+        
+        # Workers that die mid-cycle lose their lease and the others pick up their units
+        deadline = time.monotonic() + timeout
+        if self.scheduler.deadline is not None:
+            deadline = min(deadline, self.scheduler.deadline)
+        while len(self.shards.answered(cycle_id)) < len(units) and time.monotonic() < deadline:
+            time.sleep(poll_interval)
+        
+        answers = self.shards.results(cycle_id)
+        if len(answers) < len(units):
+            self.logger.warning(f"{len(units) - len(answers)} campgrounds went unanswered this cycle")
+        
+        names = dict(units)
+        sites_by_campground = {}
+        for campground_id, (ok, _, sites) in answers.items():
+            # Whether a campground changed is judged against what this process last
+            # applied: a worker's own cache misses fetches other workers made meanwhile
+            if ok:
+                digest = hashlib.blake2b(json.dumps(sorted(sites)).encode(), digest_size=16).digest()
+                self._checked.add(campground_id)
+                self._changed[campground_id] = self.shard_digests.get(campground_id) != digest
+                self.shard_digests[campground_id] = digest
+            else:
+                self.shard_digests.pop(campground_id, None)
+            sites_by_campground[campground_id] = [
+                SiteAvailability(campground_id, names.get(campground_id), site_id, site_name,
+                                 mask, self.window, site_type, loop)
+                for site_id, site_name, site_type, loop, mask in sites
+            ]
+        
+        results = []
+        for (park, _, check_permits), campgrounds in zip(plan, park_campgrounds):
+            available_sites = [
+                site for campground_id, _ in campgrounds
+                for site in sites_by_campground.get(campground_id, [])
+            ]
+            # Permits are a handful of requests, so the coordinator checks them itself
+            available_permits = (
+                self.check_permit_availability(park['park_id'], park['name']) if check_permits else []
+            )
+            results.append((available_sites, available_permits))
+        
+        return results
     
     def run_once(self):
         """Run a single check cycle"""
@@ -407,25 +4661,277 @@ class ParkAvailabilityMonitor:
         except Exception as e:
             self.logger.error(f"Error during check cycle: {e}")
     
+    def profile_once(self, report_path: str, limit: int = 25):
+        """Run one cycle under cProfile and tracemalloc and write a report.
+        
+        Every thread the cycle starts (fetch pool, discovery refreshes,
+        notification worker) gets its own profiler, and the results are
+        merged. Phase times come from Metrics.phase and are summed across
+        threads, so in async mode they can add up to more than the wall time.
+        """
+        import cProfile
+        import pstats
+        import tracemalloc
+        
+        profilers = []
+        lock = threading.Lock()
+        
+        def profile_thread(frame, event, arg):
+            # Called once on each new thread's first event; cProfile takes over from here
+            profiler = cProfile.Profile()
+            with lock:
+                profilers.append(profiler)
+            profiler.enable()
+        
+        phases_before = self.metrics.counter_values('parkmonitor_phase_seconds_total')
+        main_profiler = cProfile.Profile()
+        
+        tracemalloc.start(10)
+        threading.setprofile(profile_thread)
+        started = time.perf_counter()
+        main_profiler.enable()
+        try:
+            self.run_once()
+            # Include background discovery refreshes and notification delivery
+            self.discovery.wait_for_refreshes(timeout=60)
+            self.close_notifiers()
+        finally:
+            main_profiler.disable()
+            wall = time.perf_counter() - started
+            threading.setprofile(None)
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        
+        stats = pstats.Stats(main_profiler, stream=io.StringIO())
+        for profiler in profilers:
+            stats.add(profiler)
+        stats.dump_stats(os.path.splitext(report_path)[0] + '.prof')
+        
+        phases_after = self.metrics.counter_values('parkmonitor_phase_seconds_total')
+        phases = {
+            dict(labels)['phase']: seconds - phases_before.get(labels, 0.0)
+            for labels, seconds in phases_after.items()
+        }
+        phase_total = sum(phases.values()) or 1.0
+        
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ])
+        
+        lines = [
+            f"Profile of one check cycle (fetch_mode={self.fetch_mode})",
+            f"Wall time: {wall:.3f}s   Threads profiled: {len(profilers) + 1}   "
+            f"Peak traced memory: {peak / 1e6:.1f} MB",
+            "",
+            "Phases (thread-seconds, excluding nested phases)",
+            f"{'phase':<10} {'seconds':>10} {'share':>7}",
+        ]
+        for name, seconds in sorted(phases.items(), key=lambda item: -item[1]):
+            lines.append(f"{name:<10} {seconds:>10.3f} {100 * seconds / phase_total:>6.1f}%")
+        
+        for sort_key, title in (('cumulative', 'cumulative time'), ('tottime', 'own time')):
+            stream = io.StringIO()
+            stats.stream = stream
+            stats.sort_stats(sort_key).print_stats(limit)
+            lines += ["", f"Hot functions by {title}", stream.getvalue().strip()]
+        
+        lines += ["", "Top allocation sites (live at end of cycle)"]
+        for stat in snapshot.statistics('lineno')[:limit]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 1024:>10.1f} KiB {stat.count:>8} blocks  {frame.filename}:{frame.lineno}")
+        
+        with open(report_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        
+        self.logger.info(f"Profile written to {report_path} (raw stats in {os.path.splitext(report_path)[0]}.prof)")
+    
     def run_scheduled(self):
-        """Run the monitor on a schedule"""
-        interval = self.config['monitoring']['check_interval_minutes']
+        """Run the monitor, checking each campground on its own adaptive schedule"""
+        scheduler = self.check_scheduler
         
-        self.logger.info(f"Starting scheduled monitoring (checking every {interval} minutes)")
+        self.logger.info(
+            f"Starting scheduled monitoring (checking every {scheduler.min_interval / 60:g}-"
+            f"{scheduler.max_interval / 60:g} minutes per campground)"
+        )
         self.logger.info("Press Ctrl+C to stop\n")
         
+        self.start_metrics_server()
+        self.start_query_server()
+        
         # Run immediately on start
         self.run_once()
         
-        # Schedule regular checks
-        schedule.every(interval).minutes.do(self.run_once)
-        
         try:
             while True:
-                schedule.run_pending()
-                time.sleep(60)
+                # Reloading plans again itself; otherwise only listings can change the units
+                reloaded = self.config_poll_seconds and self.reload_config_if_changed()
+                if not reloaded and self._plan_outdated():
+                    self._plan_units()
+                due = scheduler.pop_due()
+                if due:
+                    self._run_units(due)
+                scheduler.wait(self.config_poll_seconds or None)
         except KeyboardInterrupt:
             self.logger.info("\nMonitoring stopped by user")
+        finally:
+            self.close_notifiers()
+            self.stop_workers()
+            self.transport.close()
+            if self.metrics_server is not None:
+                self.metrics_server.close()
+            if self.query_server is not None:
+                self.query_server.close()
+    
+    def close_logging(self):
+        """Write out queued log records and stop the background log writer"""
+        listener, self.log_listener = self.log_listener, None
+        if listener is not None:
+            listener.stop()
+    
+    def close_notifiers(self, timeout: float = 30):
+        """Flush and stop the main and per-subscription notification workers"""
+        self.notifier.close(timeout)
+        for subscription in self.subscriptions.subscriptions:
+            subscription.notifier.close(timeout)
+    
+    def history_report(self, campground_id: Optional[str] = None, days: Optional[float] = None) -> str:
+        """Summarize when openings appear and how fast they are rebooked, per campground"""
+        since = time.time() - days * 86400 if days else 0
+        by_hour = self.store.openings_by_hour(campground_id, since)
+        rebook = self.store.time_to_rebook(campground_id, since)
+        
+        lines = []
+        for key in sorted(by_hour, key=lambda key: -sum(by_hour[key])):
+            hours = by_hour[key]
+            median = rebook.get(key)
+            rebooked = "n/a" if median is None else f"{median:.0f} ms ({timedelta(milliseconds=round(median))})"
+            lines.append(f"{key}: {sum(hours)} openings, median time to rebook {rebooked}")
+            
+            peak = max(hours) or 1
+            for hour, count in enumerate(hours):
+                if count:
+                    lines.append(f"  {hour:02d}:00 {count:6d} {'#' * max(1, round(40 * count / peak))}")
+        
+        return '\n'.join(lines) if lines else "No availability history recorded yet"
+    
+    def start_metrics_server(self):
+        """Serve Prometheus metrics if the `metrics` config section enables it"""
+        metrics_config = self.config.get('metrics', {})
+        if not metrics_config.get('enabled', False):
+            return
+        
+        host = metrics_config.get('host', '127.0.0.1')
+        port = metrics_config.get('port', 9108)
+        try:
+            self.metrics_server = MetricsServer(self.metrics, host, port)
+        except OSError as e:
+            self.logger.error(f"Could not start metrics server on {host}:{port}: {e}")
+            return
+        
+        self.metrics_server.start()
+        self.logger.info(f"Serving metrics at http://{host}:{port}/metrics")
+    
+    def start_query_server(self):
+        """Serve the latest availability locally if the `query_api` config section enables it"""
+        query_config = self.config.get('query_api', {})
+        if not query_config.get('enabled', False):
+            return
+        
+        host = query_config.get('host', '127.0.0.1')
+        port = query_config.get('port', 9109)
+        index = AvailabilityIndex(query_config.get('max_events', 10000))
+        try:
+            self.query_server = QueryServer(index, host, port, query_config.get('max_wait_seconds', 30))
+        except OSError as e:
+            self.logger.error(f"Could not start query API on {host}:{port}: {e}")
+            return
+        
+        self.index = index
+        self.query_server.start()
+        self.logger.info(f"Serving availability at http://{host}:{port}/availability")
+    
+    def _plan_units(self):
+        """Sync the scheduler with every campground and permit check to run"""
+        costs = {}
+        months = len(self._month_windows(self.start_date, self.end_date))
+        self._plan_stamp = (self.discovery, self.discovery.generation)
+        self._planned_at = time.time()
+        self._plan_complete = True
+        
+        for park in self.config['parks']:
+            try:
+                if park.get('check_camping', True):
+                    for campground_id, campground_name in self._discover_campgrounds(park['park_id']):
+                        key = ('campground', park['name'], campground_id)
+                        self._unit_names[key] = campground_name
+                        costs[key] = months
+                if park.get('check_permits', False):
+                    permits = self._discover_permits(park['park_id'])
+                    # One request per permit and month, plus a divisions lookup per permit
+                    costs[('permits', park['name'], park['park_id'])] = len(permits) * months + len(permits)
+            except Exception as e:
+                self._plan_complete = False
+                self.logger.error(f"Error listing campgrounds for {park['name']}: {e}")
+        
+        self.check_scheduler.sync(costs)
+    
+    def _plan_outdated(self) -> bool:
+        """Whether the planned units may no longer match the parks' listings.
+        
+        That is when the discovery cache was refreshed since, when its
+        entries have expired (planning again starts their refresh), or when
+        a park could not be listed and min_interval has passed.
+        """
+        if self._plan_stamp != (self.discovery, self.discovery.generation):
+            return True
+        age = time.time() - self._planned_at
+        return age >= self.discovery.ttl or (
+            not self._plan_complete and age >= self.check_scheduler.min_interval
+        )
+    
+    def _run_units(self, keys: List[tuple]):
+        """Check a batch of due units and feed the outcome back to the scheduler"""
+        parks = {park['name']: park for park in self.config['parks']}
+        plan = {}
+        
+        for kind, park_name, ident in keys:
+            campgrounds, check_permits = plan.get(park_name, ([], False))
+            if kind == 'campground':
+                campgrounds.append((ident, self._unit_names.get((kind, park_name, ident))))
+            else:
+                check_permits = True
+            plan[park_name] = (campgrounds, check_permits)
+        
+        newly_opened = {}
+        try:
+            newly_opened = self._check_parks([
+                (parks[park_name], campgrounds, check_permits)
+                for park_name, (campgrounds, check_permits) in plan.items()
+                if park_name in parks
+            ])
+        except Exception as e:
+            self.logger.error(f"Error during check cycle: {e}")
+        finally:
+            for key in keys:
+                if key[0] != 'campground':
+                    # Only the permits of this unit's own park count towards its churn
+                    permit_keys = self._park_permits.get(key[1], set())
+                    if permit_keys and not permit_keys & self._checked:
+                        changed = None
+                    else:
+                        changed = any(opened[0] in permit_keys for opened in newly_opened)
+                elif key[2] in self._checked:
+                    changed = self._changed.get(key[2], False)
+                else:
+                    changed = None  # Skipped or failed; nothing learned about its churn
+                self.check_scheduler.record(key, changed)
+
+
+def run_shard_worker(config_path: str, worker_id: Optional[str] = None):
+    """Entry point for a worker process, local or on another host"""
+    ShardWorker(ParkAvailabilityMonitor(config_path), worker_id).run()
 
 
 def main():
@@ -445,15 +4951,101 @@ def main():
         action='store_true',
         help='Run once and exit (default: run continuously)'
     )
+    parser.add_argument(
+        '--fetch-mode',
+        choices=['sync', 'async'],
+        help='Fetch parks one at a time or concurrently (default: monitoring.fetch_mode)'
+    )
+    
+    parser.add_argument(
+        '--record',
+        metavar='ARCHIVE',
+        help='Save every API response to a replayable archive'
+    )
+    parser.add_argument(
+        '--replay',
+        metavar='ARCHIVE',
+        help='Serve API requests from a recorded archive instead of the network'
+    )
+    parser.add_argument(
+        '--replay-notify',
+        action='store_true',
+        help='Deliver notifications during --replay (by default they are only logged)'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        metavar='N',
+        help='Coordinate N local worker processes that share the campground fetches'
+    )
+    parser.add_argument(
+        '--worker',
+        action='store_true',
+        help='Run only as a shard worker for a coordinator sharing sharding.database'
+    )
+    parser.add_argument(
+        '--history',
+        nargs='?',
+        const='',
+        metavar='CAMPGROUND_ID',
+        help='Print openings by hour and median time to rebook from the stored history, then exit'
+    )
+    parser.add_argument(
+        '--history-days',
+        type=float,
+        metavar='DAYS',
+        help='Limit --history to the last DAYS days'
+    )
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='profile_report.txt',
+        metavar='REPORT',
+        help='Profile one check cycle and write a report (default: profile_report.txt)'
+    )
     
     args = parser.parse_args()
     
+    if args.record and args.replay:
+        parser.error('--record and --replay cannot be combined')
+    
+    if args.worker:
+        run_shard_worker(args.config)
+        return
+    if args.replay and not os.path.exists(args.replay):
+        parser.error(f'replay archive not found: {args.replay}')
+    
     monitor = ParkAvailabilityMonitor(args.config)
     
-    if args.once:
+    if args.history is not None:
+        print(monitor.history_report(args.history or None, args.history_days))
+        monitor.close_notifiers()
+        return
+    
+    if args.record:
+        monitor.enable_recording(args.record)
+    elif args.replay:
+        monitor.enable_replay(args.replay, args.replay_notify)
+    
+    if args.fetch_mode:
+        monitor.fetch_mode = args.fetch_mode
+    
+    if args.workers is not None:
+        monitor.enable_sharding(args.workers)
+    
+    if args.profile:
+        monitor.profile_once(args.profile)
+    elif args.once:
         monitor.run_once()
+        # Let stale discovery entries finish refreshing and queued notifications go out
+        monitor.discovery.wait_for_refreshes(timeout=60)
+        monitor.close_notifiers()
+        monitor.stop_workers()
     else:
         monitor.run_scheduled()
+    
+    if monitor.archive is not None:
+        monitor.archive.close()
 
 
 if __name__ == '__main__':
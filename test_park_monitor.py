@@ -0,0 +1,1421 @@
+"""
+Tests for the park availability monitor
+Drive check cycles through a stub Recreation.gov adapter, no network needed
+"""
+
+import gzip
+import json
+import logging
+import os
+import pstats
+import socket
+import ssl
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+import yaml
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+import park_monitor
+from park_monitor import (
+    AdaptiveScheduler,
+    AvailabilityIndex,
+    AvailabilityStore,
+    CircuitBreaker,
+    DateWindow,
+    DiscoveryCache,
+    FetchUnitCache,
+    HistoryColumns,
+    Http2Adapter,
+    HttpTransport,
+    JsonLogFormatter,
+    LogQueueHandler,
+    Metrics,
+    NotificationDispatcher,
+    NotificationRenderer,
+    ParkAvailabilityMonitor,
+    RequestScheduler,
+    RotatingLogFile,
+    ShardWorker,
+    SiteAvailability,
+    StayQuery,
+    StayQueryEngine,
+    TokenBucket,
+)
+
+
+START_DATE = '2026-07-30'
+END_DATE = '2026-08-02'
+
+
+class StubRecreationAdapter(BaseAdapter):
+    """Answers the monitor's Recreation.gov requests from in-memory data"""
+    
+    def __init__(self):
+        super().__init__()
+        self.campgrounds = {}  # park_id -> [(campground_id, name)]
+        self.permits = {}  # park_id -> [(permit_id, name)]
+        self.open = {}  # campground_id -> {site_id: set of open ISO nights}
+        self.quota = {}  # permit_id -> {division_id: {ISO night: remaining}}
+        self.failing = set()  # (campground or permit id, month start) answered with a 500
+        self.paths = []  # Every path requested, in order
+        self.latency = 0  # Seconds each request takes
+        self.active = 0
+        self.peak = 0  # Most requests ever in flight at once
+        self.lock = threading.Lock()
+    
+    def send(self, request, **kwargs):
+        """Count a request in flight while it is answered"""
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.latency)
+            return self._route(request)
+        finally:
+            with self.lock:
+                self.active -= 1
+    
+    def _route(self, request) -> requests.Response:
+        """Route a prepared request to the matching endpoint"""
+        url = urlparse(request.url)
+        params = parse_qs(url.query)
+        with self.lock:
+            self.paths.append(url.path)
+        
+        if url.path.endswith('/search'):
+            return self._respond(request, 200, self._search(params))
+        if '/camps/availability/campground/' in url.path:
+            campground_id = url.path.rsplit('/', 1)[1]
+            start = params['start_date'][0][:10]
+            if (campground_id, start) in self.failing:
+                return self._respond(request, 500)
+            return self._respond(request, 200, self._availability(campground_id, start,
+                                                                   params['end_date'][0][:10]))
+        if '/permitcontent/' in url.path:
+            permit_id = url.path.rsplit('/', 1)[1]
+            return self._respond(request, 200, {'payload': {'divisions': {
+                division_id: {'name': f"Trailhead {division_id}"} for division_id in self.quota.get(permit_id, {})
+            }}})
+        if url.path.endswith('/availability/month'):
+            permit_id = url.path.split('/')[-3]
+            start = params['start_date'][0][:10]
+            if (permit_id, start) in self.failing:
+                return self._respond(request, 500)
+            return self._respond(request, 200, self._permit_month(permit_id, start))
+        return self._respond(request, 404)
+    
+    def close(self):
+        """Nothing to release"""
+    
+    def _search(self, params: dict) -> dict:
+        """One page of a park's campgrounds or permits"""
+        filters = params.get('fq', [])
+        park_id = next(f.split(':', 1)[1] for f in filters if f.startswith('entity_id:'))
+        if 'entity_type:permit' in filters:
+            entities = [(permit_id, name, 'permit') for permit_id, name in self.permits.get(park_id, [])]
+        else:
+            entities = [(campground_id, name, 'campground')
+                        for campground_id, name in self.campgrounds.get(park_id, [])]
+        start, size = int(params.get('start', [0])[0]), int(params.get('size', [100])[0])
+        results = [{'entity_id': ident, 'name': name, 'entity_type': kind}
+                   for ident, name, kind in entities[start:start + size]]
+        return {'results': results, 'total': len(entities)}
+    
+    def _availability(self, campground_id: str, start: str, end: str) -> dict:
+        """One campground's nights from `start` through `end`"""
+        nights = self._nights(start, end)
+        return {'campsites': {
+            site_id: {
+                'site': site_id[-3:],
+                'loop': 'Loop A',
+                'campsite_type': 'STANDARD NONELECTRIC',
+                'availabilities': {
+                    f"{night}T00:00:00Z": 'Available' if night in open_nights else 'Reserved'
+                    for night in nights
+                }
+            }
+            for site_id, open_nights in sorted(self.open.get(campground_id, {}).items())
+        }}
+    
+    def _permit_month(self, permit_id: str, start: str) -> dict:
+        """One calendar month of a permit's quota"""
+        month = date.fromisoformat(start)
+        last = (month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        nights = self._nights(start, last.isoformat())
+        return {'payload': {'permit_id': permit_id, 'availability': {
+            division_id: {'date_availability': {
+                f"{night}T00:00:00Z": {'total': 10, 'remaining': quota.get(night, 0)} for night in nights
+            }}
+            for division_id, quota in self.quota.get(permit_id, {}).items()
+        }}}
+    
+    @staticmethod
+    def _nights(start: str, end: str) -> list:
+        """ISO dates from `start` through `end`"""
+        first = date.fromisoformat(start)
+        days = (date.fromisoformat(end) - first).days + 1
+        return [(first + timedelta(days=i)).isoformat() for i in range(days)]
+    
+    @staticmethod
+    def _respond(request, status: int, data: dict = None) -> requests.Response:
+        """Build a response the way HTTPAdapter would"""
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(data).encode() if data is not None else b''
+        response.headers['Content-Type'] = 'application/json'
+        response.url = request.url
+        response.request = request
+        response.encoding = 'utf-8'
+        return response
+
+
+@pytest.fixture
+def stub():
+    """A stub API with one park holding one campground of one site"""
+    adapter = StubRecreationAdapter()
+    adapter.campgrounds['1000'] = [('200', 'Upper Pines')]
+    adapter.open['200'] = {'200001': {'2026-07-30', '2026-08-01'}}
+    return adapter
+
+
+@pytest.fixture
+def make_monitor(tmp_path, stub):
+    """Build monitors wired to the stub, with config sections overridable per test"""
+    monitors = []
+    
+    def make(parks=None, capture=True, **sections):
+        config = {
+            'api': {'base_url': 'https://stub.test/api'},
+            'parks': parks or [{'name': 'Yosemite', 'park_id': '1000', 'check_camping': True}],
+            'target_dates': {'start_date': START_DATE, 'end_date': END_DATE},
+            'notifications': {
+                'email': {'enabled': False},
+                'webhook': {'enabled': False},
+                'sms': {'enabled': False}
+            },
+            'monitoring': {
+                'max_retries': 0,
+                'requests_per_second': 1000,
+                'burst': 1000,
+                'circuit_failure_threshold': 100
+            },
+            'cache': {'discovery_file': str(tmp_path / f"discovery_{len(monitors)}.json")},
+            'storage': {'database': str(tmp_path / f"availability_{len(monitors)}.db")},
+            'logging': {'level': 'ERROR', 'console_output': False}
+        }
+        for section, values in sections.items():
+            config[section] = {**config.get(section, {}), **values}
+        
+        path = tmp_path / f"config_{len(monitors)}.yaml"
+        path.write_text(yaml.safe_dump(config))
+        
+        monitor = ParkAvailabilityMonitor(str(path))
+        monitor.transport.mount(monitor.session, stub)
+        monitor.sent = []  # (park name, sites, permits) per notification
+        if capture:
+            monitor._submit_notifications = lambda notifier, park_name, sites, permits, detected_at=None: (
+                monitor.sent.append((park_name, sites, permits))
+            )
+        monitors.append(monitor)
+        return monitor
+    
+    yield make
+    
+    for monitor in monitors:
+        monitor.close_notifiers(timeout=1)
+        monitor.transport.close()
+
+
+def open_nights(monitor, campground_id: str, site_id: str) -> list:
+    """Nights the monitor last saw open at a site"""
+    return monitor.window.dates(monitor.known.get(campground_id, {}).get(site_id, 0))
+
+
+def test_unchanged_units_are_skipped(make_monitor):
+    """A second cycle over identical payloads reports the campground unchanged"""
+    monitor = make_monitor()
+    
+    monitor.check_all_parks()
+    assert monitor._changed == {'200': True}
+    assert open_nights(monitor, '200', '200001') == ['2026-07-30', '2026-08-01']
+    assert len(monitor.sent) == 1
+    
+    decoded = []
+    decode = monitor._decode_campground_month
+    monitor._decode_campground_month = lambda *args: decoded.append(args) or decode(*args)
+    monitor.check_all_parks()
+    
+    assert monitor._changed == {'200': False}
+    assert decoded == []
+    assert len(monitor.sent) == 1
+
+
+def test_changed_unit_is_parsed_again(make_monitor, stub):
+    """Only the month whose payload changed is decoded again"""
+    monitor = make_monitor()
+    monitor.check_all_parks()
+    
+    stub.open['200']['200001'].add('2026-08-02')
+    decoded = []
+    decode = monitor._decode_campground_month
+    monitor._decode_campground_month = lambda *args: decoded.append(args) or decode(*args)
+    monitor.check_all_parks()
+    
+    assert len(decoded) == 1
+    assert monitor._changed == {'200': True}
+    assert [site.available_dates for site in monitor.sent[-1][1]] == [['2026-08-02']]
+
+
+def test_fetch_unit_cache_invalidate():
+    """Invalidating a campground forgets all of its months and nothing else"""
+    cache = FetchUnitCache()
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b'{}'
+    response.headers['ETag'] = '"v1"'
+    
+    for key in [('200', '2026-07-30'), ('200', '2026-08-01'), ('300', '2026-07-30')]:
+        assert cache.resolve(key, response, lambda r: []) == ([], True)
+    assert cache.resolve(('200', '2026-07-30'), response, lambda r: []) == ([], False)
+    assert cache.conditional_headers(('200', '2026-08-01')) == {'If-None-Match': '"v1"'}
+    
+    cache.invalidate('200')
+    
+    assert cache.conditional_headers(('200', '2026-08-01')) == {}
+    assert cache.resolve(('200', '2026-07-30'), response, lambda r: []) == ([], True)
+    assert cache.resolve(('300', '2026-07-30'), response, lambda r: []) == ([], False)
+
+
+def test_partial_fetch_opens_but_never_closes(make_monitor, stub):
+    """A cycle missing one month can report openings but keeps nights it could not see"""
+    monitor = make_monitor()
+    monitor.check_all_parks()
+    
+    stub.open['200']['200001'] = {'2026-07-31', '2026-08-01'}
+    stub.failing.add(('200', '2026-08-01'))
+    monitor.check_all_parks()
+    
+    assert '200' not in monitor._checked
+    assert open_nights(monitor, '200', '200001') == ['2026-07-30', '2026-07-31', '2026-08-01']
+    assert [site.available_dates for site in monitor.sent[-1][1]] == [['2026-07-31']]
+
+
+def test_closing_applies_after_partial_fetch(make_monitor, stub):
+    """Months that arrived in a partial cycle are not treated as unchanged in the next full one"""
+    monitor = make_monitor()
+    monitor.check_all_parks()
+    
+    stub.open['200']['200001'] = {'2026-08-01'}
+    stub.failing.add(('200', '2026-08-01'))
+    monitor.check_all_parks()
+    assert open_nights(monitor, '200', '200001') == ['2026-07-30', '2026-08-01']
+    
+    stub.failing.clear()
+    monitor.check_all_parks()
+    
+    assert monitor._changed == {'200': True}
+    assert open_nights(monitor, '200', '200001') == ['2026-08-01']
+
+
+def test_partial_permit_fetch_is_retried_in_full(make_monitor, stub):
+    """A permit whose months only partly arrived is re-parsed in full next cycle"""
+    stub.permits['1000'] = [('445', 'Half Dome')]
+    stub.quota['445'] = {'44501': {'2026-07-30': 2, '2026-08-01': 2}}
+    monitor = make_monitor(parks=[{'name': 'Yosemite', 'park_id': '1000',
+                                   'check_camping': False, 'check_permits': True}])
+    monitor.check_all_parks()
+    assert open_nights(monitor, 'permit:445', '44501') == ['2026-07-30', '2026-08-01']
+    
+    stub.quota['445']['44501'] = {'2026-08-01': 2}
+    stub.failing.add(('445', '2026-08-01'))
+    monitor.check_all_parks()
+    stub.failing.clear()
+    monitor.check_all_parks()
+    
+    assert open_nights(monitor, 'permit:445', '44501') == ['2026-08-01']
+
+
+def test_permit_churn_is_tracked_per_park(make_monitor, stub):
+    """A permit opening in one park speeds up only that park's permits unit"""
+    stub.permits['1000'] = [('445', 'Half Dome')]
+    stub.permits['2000'] = [('545', 'Mineral King')]
+    stub.quota['445'] = {'44501': {'2026-07-30': 2}}
+    stub.quota['545'] = {'54501': {}}
+    monitor = make_monitor(parks=[
+        {'name': 'Yosemite', 'park_id': '1000', 'check_camping': False, 'check_permits': True},
+        {'name': 'Sequoia', 'park_id': '2000', 'check_camping': False, 'check_permits': True}
+    ])
+    monitor._plan_units()
+    yosemite, sequoia = ('permits', 'Yosemite', '1000'), ('permits', 'Sequoia', '2000')
+    
+    monitor._run_units([yosemite, sequoia])
+    
+    intervals = monitor.check_scheduler.intervals
+    assert intervals[yosemite] < intervals[sequoia] == monitor.check_scheduler.max_interval
+
+
+def test_shard_owner_change_is_not_stale(make_monitor, stub, tmp_path):
+    """A campground moving a -> b -> a between workers still reports what changed meanwhile"""
+    sharding = {'database': str(tmp_path / 'shards.db'), 'poll_interval_seconds': 0.01}
+    coordinator = make_monitor(sharding=sharding)
+    coordinator.enable_sharding(0)
+    workers = {name: ShardWorker(make_monitor(sharding=sharding), name) for name in 'ab'}
+    start_cycle = coordinator.shards.start_cycle
+    
+    def check_on(name: str):
+        """Run a coordinator cycle whose units all go to worker `name`"""
+        def start(units):
+            cycle_id = start_cycle(units)
+            workers[name]._fetch(cycle_id, units)
+            return cycle_id
+        coordinator.shards.start_cycle = start
+        coordinator.check_all_parks()
+    
+    try:
+        check_on('a')
+        stub.open['200']['200001'] = {'2026-08-01'}
+        check_on('b')
+        assert open_nights(coordinator, '200', '200001') == ['2026-08-01']
+        
+        # Worker a's cache still holds the payload it saw before b's cycle
+        stub.open['200']['200001'] = {'2026-07-30', '2026-08-01'}
+        check_on('a')
+        
+        assert coordinator._changed == {'200': True}
+        assert open_nights(coordinator, '200', '200001') == ['2026-07-30', '2026-08-01']
+        assert [site.available_dates for site in coordinator.sent[-1][1]] == [['2026-07-30']]
+        
+        check_on('a')
+        assert coordinator._changed == {'200': False}
+    finally:
+        for worker in workers.values():
+            worker.store.close()
+        coordinator.shards.close()
+
+
+def test_campground_in_two_parks_is_notified_once(make_monitor, stub):
+    """Without subscriptions a campground listed under two parks is reported under the first"""
+    stub.campgrounds['1001'] = [('200', 'Upper Pines'), ('300', 'Wawona')]
+    stub.open['300'] = {'300001': {'2026-07-31'}}
+    monitor = make_monitor(parks=[{'name': 'Yosemite', 'park_id': '1000'},
+                                  {'name': 'Yosemite Valley', 'park_id': '1001'}])
+    monitor.check_all_parks()
+    
+    assert [(park_name, [site.site_id for site in sites]) for park_name, sites, _ in monitor.sent] == [
+        ('Yosemite', ['200001']), ('Yosemite Valley', ['300001'])
+    ]
+
+
+def test_async_mode_bounds_every_request(make_monitor, stub):
+    """Discovery and permit requests count against max_concurrency in async mode too"""
+    for park in range(3):
+        park_id = str(1000 + park)
+        stub.campgrounds[park_id] = [(f"{park_id}{i}", f"Campground {i}") for i in range(3)]
+        stub.permits[park_id] = [(f"{park_id}9{i}", f"Permit {i}") for i in range(3)]
+        for i in range(3):
+            stub.open[f"{park_id}{i}"] = {f"{park_id}{i}001": {'2026-07-31'}}
+            stub.quota[f"{park_id}9{i}"] = {f"{park_id}9{i}01": {'2026-07-31': 2}}
+    stub.latency = 0.01
+    monitor = make_monitor(
+        parks=[{'name': f"Park {park}", 'park_id': str(1000 + park), 'check_permits': True} for park in range(3)],
+        monitoring={'fetch_mode': 'async', 'max_concurrency': 2, 'max_connections_per_host': 2}
+    )
+    monitor.check_all_parks()
+    
+    assert len(monitor._checked) == 18
+    assert 1 < stub.peak <= 2
+
+
+def decode_stub_month(monitor, stub) -> list:
+    """Decode the stub's July payload for campground 200 as plain dicts"""
+    session = requests.Session()
+    session.mount('https://', stub)
+    response = session.get('https://stub.test/api/camps/availability/campground/200',
+                           params={'start_date': '2026-07-01T00:00:00.000Z',
+                                   'end_date': '2026-07-31T00:00:00.000Z'})
+    return [site.to_dict() for site in monitor._decode_campground_month(response, '200', 'Upper Pines')]
+
+
+def test_streaming_parser_matches_json(make_monitor, stub):
+    """ijson's incremental parse yields the same sites as json.loads"""
+    pytest.importorskip('ijson')
+    stub.open['200'].update({
+        '200002': {'2026-07-31'},
+        '200003': set(),
+        'Ünïcode "site"': {'2026-07-30', '2026-07-31'}
+    })
+    streaming = make_monitor(monitoring={'json_parser': 'stream'})
+    loading = make_monitor(monitoring={'json_parser': 'json'})
+    assert streaming.stream_json and not loading.stream_json
+    
+    sites = decode_stub_month(streaming, stub)
+    
+    assert [site['site_id'] for site in sites] == ['200001', '200002', 'Ünïcode "site"']
+    assert sites == decode_stub_month(loading, stub)
+
+
+def test_streaming_parser_falls_back_without_ijson(make_monitor, stub, monkeypatch, caplog):
+    """Without ijson, asking to stream logs an error and parses with json.loads"""
+    monkeypatch.setattr(park_monitor, 'ijson', None)
+    loading = make_monitor(monitoring={'json_parser': 'json'})
+    
+    with caplog.at_level(logging.ERROR):
+        streaming = make_monitor(monitoring={'json_parser': 'stream'})
+    
+    assert not streaming.stream_json
+    assert 'ijson library not installed' in caplog.text
+    assert not make_monitor().stream_json
+    assert decode_stub_month(streaming, stub) == decode_stub_month(loading, stub)
+    streaming.check_all_parks()
+    assert open_nights(streaming, '200', '200001') == ['2026-07-30', '2026-08-01']
+
+
+def test_stay_query_engine_finds_runs():
+    """Only runs of at least min_nights count, and runs never span two sites"""
+    window = DateWindow('2026-07-01', '2026-07-10')
+    engine = StayQueryEngine([StayQuery({'min_nights': 3}, window)], window)
+    sites = [
+        SiteAvailability('200', 'Upper Pines', 'a', '001', 0b1100100111, window),
+        SiteAvailability('200', 'Upper Pines', 'b', '002', 0b0000000011, window),
+        SiteAvailability('200', 'Upper Pines', 'c', '003', 0b0000011000, window)
+    ]
+    
+    assert engine.match(sites) == {('200', 'a'): 0b0000000111}
+
+
+def test_stay_query_filters_and_dates():
+    """Site type and loop filters are case-insensitive and the stay is clamped to its dates"""
+    window = DateWindow('2026-07-01', '2026-07-10')
+    query = StayQuery({'min_nights': 2, 'site_types': ['tent only'], 'loops': ['loop b'],
+                       'start_date': '2026-07-03', 'end_date': '2026-07-06'}, window)
+    engine = StayQueryEngine([query], window)
+    sites = [
+        SiteAvailability('200', 'Upper Pines', 'a', '001', window.full_mask, window, 'TENT ONLY', 'Loop B'),
+        SiteAvailability('200', 'Upper Pines', 'b', '002', window.full_mask, window, 'STANDARD', 'Loop B'),
+        SiteAvailability('200', 'Upper Pines', 'c', '003', window.full_mask, window, 'TENT ONLY', 'Loop C')
+    ]
+    
+    assert engine.match(sites) == {('200', 'a'): window.range_mask('2026-07-03', '2026-07-06')}
+
+
+def test_stay_queries_narrow_notifications(make_monitor, stub):
+    """With stay_queries a park only notifies about nights that complete a wanted stay"""
+    stub.open['200'] = {'200001': {'2026-07-30'}, '200002': {'2026-07-30', '2026-07-31', '2026-08-01'}}
+    monitor = make_monitor(parks=[{'name': 'Yosemite', 'park_id': '1000',
+                                   'stay_queries': [{'min_nights': 2}]}])
+    monitor.check_all_parks()
+    
+    (_, sites, _), = monitor.sent
+    assert [(site.site_id, site.available_dates) for site in sites] == [
+        ('200002', ['2026-07-30', '2026-07-31', '2026-08-01'])
+    ]
+
+
+class ScriptedAdapter(BaseAdapter):
+    """Answers each request with the next (status, headers) in its script"""
+    
+    def __init__(self, script: list):
+        super().__init__()
+        self.script = list(script)
+        self.times = []  # time.monotonic() of every request
+    
+    def send(self, request, **kwargs):
+        self.times.append(time.monotonic())
+        status, headers = self.script.pop(0)
+        response = StubRecreationAdapter._respond(request, status, {})
+        response.headers.update(headers)
+        return response
+    
+    def close(self):
+        """Nothing to release"""
+
+
+def make_scheduler(script: list, **monitoring) -> RequestScheduler:
+    """A request scheduler whose session is answered by a ScriptedAdapter"""
+    session = requests.Session()
+    session.mount('https://', ScriptedAdapter(script))
+    return RequestScheduler(session, {'circuit_failure_threshold': 100, **monitoring}, logging.getLogger('test'))
+
+
+def test_token_bucket_limits_rate():
+    """Past the burst, tokens come at `rate` per second and a deadline gives up early"""
+    bucket = TokenBucket(20, 1)
+    started = time.monotonic()
+    for _ in range(5):
+        assert bucket.acquire()
+    assert time.monotonic() - started >= 4 / 20
+    assert not bucket.acquire(time.monotonic() + 0.01)
+    
+    for rate in (0, -1):
+        with pytest.raises(ValueError):
+            TokenBucket(rate, 1)
+        with pytest.raises(ValueError, match='requests_per_second must be a positive number'):
+            ParkAvailabilityMonitor._validate_config({
+                'parks': [], 'target_dates': {'start_date': START_DATE, 'end_date': END_DATE},
+                'monitoring': {'requests_per_second': rate}
+            })
+
+
+def test_token_bucket_pause():
+    """Retry-After pauses every caller, but a zero delay leaves the tokens alone"""
+    bucket = TokenBucket(1, 5)
+    bucket.pause(0)
+    assert bucket.tokens == 5 and bucket.paused_until == 0.0
+    
+    bucket = TokenBucket(1000, 1)
+    bucket.pause(0.1)
+    started = time.monotonic()
+    assert bucket.acquire()
+    assert time.monotonic() - started >= 0.09
+
+
+def test_scheduler_backs_off_exponentially(monkeypatch):
+    """Failed requests wait retry_delay * 2**attempt, jittered into its upper half and capped"""
+    scheduler = make_scheduler([(503, {}), (503, {}), (503, {}), (200, {})],
+                               retry_delay_seconds=1, max_backoff_seconds=3, max_retries=3)
+    delays = []
+    monkeypatch.setattr(time, 'sleep', delays.append)
+    
+    assert scheduler.get('https://stub.test/api/search').status_code == 200
+    assert len(delays) == 3
+    for delay, (low, high) in zip(delays, [(0.5, 1), (1, 2), (1.5, 3)]):
+        assert low <= delay <= high
+
+
+def test_scheduler_honours_retry_after():
+    """A 429's Retry-After delays the retry by that long, and a zero delay retries at once"""
+    scheduler = make_scheduler([(429, {'Retry-After': '0.2'}), (200, {})],
+                               retry_delay_seconds=30, requests_per_second=1000, max_retries=1)
+    assert scheduler.get('https://stub.test/api/search').status_code == 200
+    first, second = scheduler.session.get_adapter('https://stub.test').times
+    assert 0.19 <= second - first < 5
+    
+    scheduler = make_scheduler([(503, {'Retry-After': '0'}), (200, {})],
+                               retry_delay_seconds=30, requests_per_second=1, burst=2, max_retries=1)
+    assert scheduler.get('https://stub.test/api/search').status_code == 200
+    first, second = scheduler.session.get_adapter('https://stub.test').times
+    assert second - first < 0.5
+
+
+def test_circuit_breaker_transitions():
+    """closed -> open -> half-open probe -> re-open with a doubled cooldown -> closed"""
+    breaker = CircuitBreaker(threshold=2, cooldown=0.05, max_cooldown=1)
+    
+    assert breaker.record('200', False) is None
+    assert breaker.allow('200')
+    assert breaker.record('200', False) == CircuitBreaker.OPEN
+    assert not breaker.allow('200')
+    
+    time.sleep(0.06)
+    assert breaker.state('200') == CircuitBreaker.HALF_OPEN
+    assert breaker.allow('200')
+    assert not breaker.allow('200')  # Only one probe at a time
+    assert breaker.record('200', False) == CircuitBreaker.OPEN
+    assert breaker.cooldowns['200'] == pytest.approx(0.1)
+    
+    time.sleep(0.11)
+    assert breaker.allow('200')
+    assert breaker.record('200', True) == CircuitBreaker.CLOSED
+    assert breaker.open_count() == 0
+
+
+def test_circuit_breaker_skips_failing_campground(make_monitor, stub):
+    """Once a campground's circuit opens its requests are skipped, not sent"""
+    stub.failing.update({('200', '2026-07-30'), ('200', '2026-08-01')})
+    monitor = make_monitor(monitoring={'circuit_failure_threshold': 2, 'circuit_cooldown_seconds': 60})
+    
+    monitor.check_all_parks()
+    requested = len(stub.paths)
+    monitor.check_all_parks()
+    
+    assert monitor.scheduler.breaker.state('200') == CircuitBreaker.OPEN
+    assert [path for path in stub.paths[requested:] if '/availability/' in path] == []
+
+
+def test_adaptive_scheduler_budget():
+    """Due units are handed out only while the per-minute budget lasts"""
+    scheduler = AdaptiveScheduler({'request_budget_per_minute': 10})
+    scheduler.sync({('campground', 'Yosemite', str(i)): 4 for i in range(4)})
+    scheduler.expedite(list(scheduler.costs))
+    
+    assert len(scheduler.pop_due()) == 2
+    assert scheduler.pop_due() == []
+    
+    # A minute later the spent requests drop out of the window
+    for _ in range(len(scheduler.spent)):
+        spent_at, cost = scheduler.spent.popleft()
+        scheduler.spent.append((spent_at - 60, cost))
+    assert len(scheduler.pop_due()) == 2
+
+
+def test_adaptive_scheduler_lets_oversized_unit_through():
+    """A unit costing more than the whole budget still runs when nothing else has"""
+    scheduler = AdaptiveScheduler({'request_budget_per_minute': 10})
+    scheduler.sync({('permits', 'Yosemite', '1000'): 25, ('campground', 'Yosemite', '200'): 2})
+    scheduler.expedite(list(scheduler.costs))
+    
+    batch = scheduler.pop_due()
+    assert len(batch) == 1
+    assert scheduler.pop_due() == []
+
+
+def test_adaptive_scheduler_intervals():
+    """Changed units are polled sooner, quiet ones back off, both within the limits"""
+    scheduler = AdaptiveScheduler({'check_interval_minutes': 10, 'min_interval_minutes': 2})
+    busy, quiet = ('campground', 'Yosemite', '200'), ('campground', 'Yosemite', '300')
+    scheduler.sync({busy: 2, quiet: 2})
+    
+    for _ in range(5):
+        scheduler.record(busy, True)
+        scheduler.record(quiet, False)
+    
+    assert scheduler.intervals[busy] == 120
+    assert scheduler.intervals[quiet] == 600
+
+
+def test_search_collects_every_page(make_monitor, stub):
+    """A park listing longer than one page is fetched page by page and kept in order"""
+    stub.campgrounds['1000'] = [(str(200 + i), f"Campground {i}") for i in range(250)]
+    monitor = make_monitor()
+    
+    campgrounds = monitor._discover_campgrounds('1000')
+    
+    assert campgrounds == stub.campgrounds['1000']
+    assert stub.paths.count('/api/search') == 3
+    
+    # Cached until the TTL runs out, then listed again in the background
+    assert monitor._discover_campgrounds('1000') == campgrounds
+    assert stub.paths.count('/api/search') == 3
+    monitor.discovery.entries['1000:campground']['fetched_at'] -= monitor.discovery.ttl + 1
+    assert monitor._discover_campgrounds('1000') == campgrounds
+    monitor.discovery.wait_for_refreshes(5)
+    assert stub.paths.count('/api/search') == 6
+
+
+def test_discovery_cache_ttl(tmp_path):
+    """A fresh entry skips the loader, even after a restart; an expired one is refreshed behind the caller"""
+    path = str(tmp_path / 'discovery.json')
+    listings = [[('200', 'Upper Pines')]]
+    calls = []
+    
+    def loader():
+        calls.append(time.time())
+        return listings[-1]
+    
+    cache = DiscoveryCache(path, 1, logging.getLogger('test'))
+    assert cache.get('1000', 'campground', loader) == [('200', 'Upper Pines')]
+    assert cache.get('1000', 'campground', loader) == [('200', 'Upper Pines')]
+    assert DiscoveryCache(path, 1, logging.getLogger('test')).get('1000', 'campground', loader) == [
+        ('200', 'Upper Pines')
+    ]
+    assert len(calls) == 1
+    
+    listings.append([('200', 'Upper Pines'), ('300', 'Wawona')])
+    cache.entries['1000:campground']['fetched_at'] -= 3601
+    # The stale listing is served while the refresh runs
+    assert cache.get('1000', 'campground', loader) == [('200', 'Upper Pines')]
+    cache.wait_for_refreshes(5)
+    
+    assert len(calls) == 2
+    assert cache.generation == 1
+    assert cache.get('1000', 'campground', loader) == [('200', 'Upper Pines'), ('300', 'Wawona')]
+    assert len(calls) == 2
+
+
+def test_plan_units_costs_requests(make_monitor, stub):
+    """A unit costs the requests one check of it sends"""
+    stub.permits['1000'] = [('445', 'Half Dome'), ('446', 'Yosemite Wilderness')]
+    monitor = make_monitor(parks=[{'name': 'Yosemite', 'park_id': '1000', 'check_permits': True}])
+    monitor._plan_units()
+    
+    # Two months of target dates
+    assert monitor.check_scheduler.costs == {
+        ('campground', 'Yosemite', '200'): 2,
+        ('permits', 'Yosemite', '1000'): 2 * 2 + 2
+    }
+
+
+def test_units_are_planned_again_only_when_listings_change(make_monitor, stub):
+    """The scheduler loop re-plans after a discovery refresh or expiry, not on every pass"""
+    monitor = make_monitor()
+    assert monitor._plan_outdated()
+    monitor._plan_units()
+    searches = stub.paths.count('/api/search')
+    
+    assert not monitor._plan_outdated()
+    assert stub.paths.count('/api/search') == searches
+    
+    stub.campgrounds['1000'].append(('300', 'Wawona'))
+    monitor.discovery._refresh('1000:campground', lambda: stub.campgrounds['1000'])
+    assert monitor._plan_outdated()
+    monitor._plan_units()
+    assert ('campground', 'Yosemite', '300') in monitor.check_scheduler.costs
+    assert not monitor._plan_outdated()
+    
+    monitor._planned_at -= monitor.discovery.ttl
+    assert monitor._plan_outdated()
+
+
+def test_history_columns_round_trip():
+    """encode() and decode() give back every column, across a widening site dictionary"""
+    columns = HistoryColumns()
+    for site_id, day, time_ms, opened in [('a', 740000, 1_700_000_000_000, True),
+                                          ('b', 739990, 1_700_000_000_500, True),
+                                          ('a', 740000, 1_700_000_360_000, False)]:
+        columns.append(site_id, day, time_ms, opened)
+    newer = HistoryColumns()
+    newer.append('c', 740010, 1_700_000_400_000, True)
+    newer.append('b', 739990, 1_700_000_400_001, False)
+    columns.extend(newer)
+    
+    decoded = HistoryColumns.decode(*columns.encode())
+    
+    assert decoded.site_ids == ['a', 'b', 'c']
+    assert list(decoded.sites) == [0, 1, 0, 2, 1]
+    assert list(decoded.days) == [740000, 739990, 740000, 740010, 739990]
+    assert list(decoded.times) == list(columns.times)
+    assert decoded.opened == bytearray([1, 1, 0, 1, 0])
+    assert len(HistoryColumns.decode(*HistoryColumns().encode())) == 0
+
+
+@pytest.fixture
+def utc(monkeypatch):
+    """Run in UTC, so local hours are the hand-computed ones"""
+    monkeypatch.setenv('TZ', 'UTC')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_history_analytics_across_compaction(tmp_path, monkeypatch, utc):
+    """Openings by hour and time to rebook match by hand, before and after compaction"""
+    store = AvailabilityStore(str(tmp_path / 'history.db'))
+    seven_am = datetime(2026, 7, 1, 7, tzinfo=timezone.utc).timestamp()
+    
+    def record(offset: float, *changes):
+        with monkeypatch.context() as patch:
+            patch.setattr(time, 'time', lambda: seven_am + offset)
+            store.record_changes([('200', site_id, night, status) for site_id, night, status in changes])
+    
+    # Site a rebooks after 1 minute and then 5 minutes, site b after 4000 seconds
+    record(0, ('a', '2026-07-30', 'Available'), ('b', '2026-07-30', 'Available'))
+    record(60, ('a', '2026-07-30', 'Unavailable'))
+    assert store.compact() == 3
+    assert store.compact() == 0
+    record(3600, ('a', '2026-07-31', 'Available'))
+    record(3900, ('a', '2026-07-31', 'Unavailable'))
+    record(4000, ('b', '2026-07-30', 'Unavailable'))
+    
+    hours = [0] * 24
+    hours[7], hours[8] = 2, 1
+    
+    def check():
+        assert store.openings_by_hour() == {'200': hours}
+        assert store.time_to_rebook() == {'200': 300_000}
+        assert store.time_to_rebook('200', since=seven_am + 3600) == {'200': 300_000}
+        assert len(store.history()['200']) == 6
+    
+    check()
+    # The second segment pushes the campground over max_segments, so both merge into one
+    assert store.compact(max_segments=1) == 3
+    assert store.compact(max_segments=1) == 0
+    assert store.conn.execute('SELECT COUNT(*) FROM history_segments').fetchone()[0] == 1
+    check()
+    store.close()
+
+
+def test_changes_since_is_a_cursor(tmp_path, monkeypatch):
+    """Changes come oldest first, strictly after `since`, and a polling cursor sees each once"""
+    store = AvailabilityStore(str(tmp_path / 'changes.db'))
+    start = 1_780_000_000.0
+    
+    def record(offset: float, *changes):
+        with monkeypatch.context() as patch:
+            patch.setattr(time, 'time', lambda: start + offset)
+            store.record_changes(list(changes))
+    
+    record(0, ('200', 'a', '2026-07-30', 'Available'), ('300', 'b', '2026-07-31', 'Available'))
+    store.compact()
+    record(1.5, ('200', 'a', '2026-07-30', 'Unavailable'))
+    record(2.25, ('300', 'b', '2026-07-31', 'Unavailable'), ('200', 'a', '2026-08-01', 'Available'))
+    
+    def times(since: float) -> list:
+        return [change['changed_at'] - start for change in store.changes_since(since)]
+    
+    assert times(0) == [0, 0, 1.5, 2.25, 2.25]
+    assert times(start) == [1.5, 2.25, 2.25]
+    assert store.changes_since(start + 2.25) == []
+    
+    seen, cursor = [], start - 1
+    for offset in (3, 4):
+        batch = store.changes_since(cursor)
+        seen += batch
+        cursor = batch[-1]['changed_at']
+        assert store.changes_since(cursor) == []
+        record(offset, ('300', 'c', '2026-08-01', 'Available' if offset == 3 else 'Unavailable'))
+    seen += store.changes_since(cursor)
+    
+    keys = [tuple(change.values()) for change in seen]
+    assert len(keys) == len(set(keys)) == 7
+    assert [change['changed_at'] for change in seen] == sorted(change['changed_at'] for change in seen)
+    store.close()
+
+
+def test_index_filters_match_whole_values_ignoring_case():
+    """site_type and loop filters of the query API are case-insensitive exact matches"""
+    window = DateWindow(START_DATE, END_DATE)
+    index = AvailabilityIndex(100)
+    index.update({'200': ('Yosemite', 'Upper Pines', 'campground', {
+        'a': SiteAvailability('200', 'Upper Pines', 'a', '001', 0b1, window, 'TENT ONLY NONELECTRIC', 'Loop A'),
+        'b': SiteAvailability('200', 'Upper Pines', 'b', '002', 0b1, window, 'STANDARD NONELECTRIC', 'LOOP A'),
+        'c': SiteAvailability('200', 'Upper Pines', 'c', '003', 0b1, window, 'STANDARD NONELECTRIC', 'Loop AB')
+    })}, {'200'})
+    
+    def sites(**filters) -> list:
+        return sorted(result['site_id'] for result in index.query(**filters))
+    
+    assert sites(site_type='standard nonelectric') == ['b', 'c']
+    assert sites(site_type='NONELECTRIC') == []
+    assert sites(loop='loop a') == ['a', 'b']
+    assert sites(site_type='Tent Only Nonelectric', loop='LOOP A') == ['a']
+
+
+def make_sites(window: DateWindow, campgrounds: int, sites: int) -> list:
+    """`sites` open sites in each of `campgrounds` campgrounds"""
+    return [
+        SiteAvailability(str(c), f"Campground {c}", f"{c}-{s}", f"{s:03d}", 0b101, window)
+        for c in range(campgrounds) for s in range(sites)
+    ]
+
+
+def test_renderer_digest_caps_sections():
+    """The digest shows at most max_campgrounds blocks of max_sites_per_campground rows"""
+    window = DateWindow(START_DATE, END_DATE)
+    renderer = NotificationRenderer({'max_campgrounds': 2, 'max_sites_per_campground': 3}, window,
+                                    {'start_date': START_DATE, 'end_date': END_DATE})
+    
+    html_body, text_body = renderer.render('Yosemite', make_sites(window, 5, 4), [])
+    
+    assert html_body.count('<div class="site">') == 2
+    assert html_body.count('<span class="dates">') == 6
+    assert '... and 1 more site' in html_body
+    assert '... and 3 more campgrounds' in html_body
+    assert len(text_body) <= NotificationRenderer.SMS_LENGTH
+
+
+def test_renderer_collapses_date_ranges():
+    """Consecutive nights collapse into ranges and the range count is capped"""
+    window = DateWindow('2026-07-01', '2026-07-31')
+    renderer = NotificationRenderer({'max_date_ranges': 2}, window,
+                                    {'start_date': '2026-07-01', 'end_date': '2026-07-31'})
+    
+    # Nights 1-3, 10 and 20 of July
+    mask = 0b111 | 1 << 9 | 1 << 19
+    
+    assert renderer._ranges(mask).endswith('(+1 more)')
+    assert renderer._ranges(mask).count(',') == 1
+
+
+def test_renderer_sms_stays_short():
+    """A burst across many campgrounds still fits one SMS"""
+    window = DateWindow(START_DATE, END_DATE)
+    renderer = NotificationRenderer({}, window, {'start_date': START_DATE, 'end_date': END_DATE})
+    
+    _, text_body = renderer.render('Yosemite', make_sites(window, 60, 2), [])
+    
+    assert len(text_body) <= NotificationRenderer.SMS_LENGTH
+    assert 'more campgrounds' in text_body
+
+
+def make_dispatcher(**config) -> NotificationDispatcher:
+    """A dispatcher with email and webhook enabled whose deliveries are recorded, not sent"""
+    dispatcher = NotificationDispatcher({
+        'email': {'enabled': True}, 'webhook': {'enabled': True}, **config
+    }, logging.getLogger('test'))
+    dispatcher.delivered = []  # (channel, payload) per delivery
+    dispatcher._send_email = lambda subject, body: dispatcher.delivered.append(('email', (subject, body)))
+    dispatcher._send_webhook = lambda data: dispatcher.delivered.append(('webhook', data))
+    return dispatcher
+
+
+def test_dispatcher_coalesces_email_into_one_document():
+    """Alerts within the digest window arrive as one HTML document with a section each"""
+    window = DateWindow(START_DATE, END_DATE)
+    renderer = NotificationRenderer({}, window, {'start_date': START_DATE, 'end_date': END_DATE})
+    dispatcher = make_dispatcher(digest_window_seconds=0.2)
+    
+    for park in ('Yosemite', 'Sequoia'):
+        html_body, _ = renderer.render(park, make_sites(window, 1, 1), [])
+        dispatcher.submit('email', (f"Availability Found: {park}", html_body))
+    dispatcher.close()
+    
+    [(channel, (subject, body))] = dispatcher.delivered
+    assert channel == 'email'
+    assert subject.endswith('2 updates')
+    assert body.count('<html>') == body.count('<body>') == body.count('</html>') == 1
+    assert body.count(NotificationRenderer.FOOTER) == 1
+    assert body.index('for Yosemite!') < body.index('<hr>') < body.index('for Sequoia!')
+
+
+def test_dispatcher_drops_repeated_alerts():
+    """The same message queued twice in one digest window is delivered once"""
+    dispatcher = make_dispatcher(digest_window_seconds=0.2)
+    
+    for park in ('Yosemite', 'Yosemite', 'Sequoia'):
+        dispatcher.submit('webhook', {'park': park, 'campsites': 1, 'permits': 0})
+    dispatcher.close()
+    
+    assert dispatcher.delivered == [('webhook', {'digest': [
+        {'park': 'Yosemite', 'campsites': 1, 'permits': 0},
+        {'park': 'Sequoia', 'campsites': 1, 'permits': 0}
+    ]})]
+
+
+def test_dispatcher_retries_with_backoff():
+    """A failing channel is retried after doubling delays until it gets through"""
+    dispatcher = make_dispatcher(digest_window_seconds=0, retry_delay_seconds=0.05, max_retries=3)
+    attempts = []
+    
+    def flaky_webhook(data):
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise requests.ConnectionError('webhook down')
+        dispatcher.delivered.append(('webhook', data))
+    
+    dispatcher._send_webhook = flaky_webhook
+    dispatcher.submit('webhook', {'park': 'Yosemite'})
+    deadline = time.monotonic() + 5
+    while not dispatcher.delivered and time.monotonic() < deadline:
+        time.sleep(0.01)
+    dispatcher.close()
+    
+    assert dispatcher.delivered == [('webhook', {'park': 'Yosemite'})]
+    assert len(attempts) == 3
+    assert attempts[1] - attempts[0] >= 0.05
+    assert attempts[2] - attempts[1] >= 0.1
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """Answers every GET and POST with 200, recording the request target it was sent"""
+    
+    protocol_version = 'HTTP/1.1'
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.do_GET()
+    
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+    
+    def log_message(self, format, *args):
+        """Keep test output clean"""
+
+
+@pytest.fixture
+def echo_server():
+    """A local HTTP server on 127.0.0.1 only"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), EchoHandler)
+    server.paths = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fake_dns(monkeypatch):
+    """(names, lookups): hosts in `names` resolve to its addresses, and are logged to `lookups`"""
+    names = {}
+    lookups = []
+    getaddrinfo = socket.getaddrinfo
+    
+    def fake(host, port, *args, **kwargs):
+        if host not in names:
+            return getaddrinfo(host, port, *args, **kwargs)
+        lookups.append(host)
+        return [(socket.AF_INET6 if ':' in address else socket.AF_INET, socket.SOCK_STREAM, 6, '',
+                 (address, port)) for address in names[host]]
+    
+    monkeypatch.setattr(socket, 'getaddrinfo', fake)
+    return names, lookups
+
+
+def test_transport_caches_every_address(fake_dns):
+    """The DNS cache keeps the whole address list, in order and without duplicates"""
+    names, lookups = fake_dns
+    names['api.test'] = ['10.0.0.1', '10.0.0.2', '10.0.0.1']
+    transport = HttpTransport({}, logging.getLogger('test'), Metrics())
+    
+    assert transport.resolve('api.test', 443) == ['10.0.0.1', '10.0.0.2']
+    assert transport.resolve('api.test', 443) == ['10.0.0.1', '10.0.0.2']
+    assert lookups == ['api.test']
+    assert transport.stats()['dns_hits'] == 1
+
+
+def test_transport_tries_cached_addresses_in_order(fake_dns, echo_server):
+    """A connection falls through to the next cached address when one refuses"""
+    # Nothing listens on 127.0.0.2 at this port; the server only listens on 127.0.0.1
+    names, lookups = fake_dns
+    names['api.test'] = ['127.0.0.2', '127.0.0.1']
+    transport = HttpTransport({}, logging.getLogger('test'), Metrics())
+    session = transport.session()
+    
+    try:
+        response = session.get(f"http://api.test:{echo_server.server_port}/search", timeout=5)
+    finally:
+        transport.close()
+    
+    assert response.status_code == 200
+    assert lookups == ['api.test']
+
+
+def test_http2_adapter_uses_proxies(echo_server):
+    """Http2Adapter sends through the proxy requests selected for the URL"""
+    pytest.importorskip('httpx')
+    pytest.importorskip('h2')
+    transport = HttpTransport({}, logging.getLogger('test'), Metrics())
+    session = requests.Session()
+    transport.mount(session, Http2Adapter(transport, 4))
+    session.trust_env = False
+    
+    try:
+        response = session.get('http://api.invalid/search', timeout=5,
+                               proxies={'http': f"http://127.0.0.1:{echo_server.server_port}"})
+    finally:
+        session.close()
+    
+    assert response.text == 'ok'
+    assert echo_server.paths == ['http://api.invalid/search']
+
+
+def test_http2_adapter_tls_settings():
+    """verify and cert map onto the SSL context of a client kept per setting"""
+    pytest.importorskip('httpx')
+    pytest.importorskip('h2')
+    adapter = Http2Adapter(HttpTransport({}, logging.getLogger('test'), Metrics()), 4)
+    
+    assert Http2Adapter._ssl_context(False, None).verify_mode == ssl.CERT_NONE
+    assert Http2Adapter._ssl_context(True, None).verify_mode == ssl.CERT_REQUIRED
+    with pytest.raises(OSError):
+        Http2Adapter._ssl_context(True, '/nonexistent/client.pem')
+    
+    try:
+        assert adapter._client(True, None, None) is adapter._client(True, None, None)
+        assert adapter._client(False, None, None) is not adapter._client(True, None, None)
+    finally:
+        adapter.close()
+
+
+def send_stub_requests_to_stub(monkeypatch, stub) -> list:
+    """Route stub.test requests that reach a real HTTPAdapter to the stub, returning every URL sent"""
+    sent = []
+    send = HTTPAdapter.send
+    
+    def send_via_stub(adapter, request, **kwargs):
+        # The recording adapter's HTTP layer talks to the stub instead of the internet
+        sent.append(request.url)
+        if urlparse(request.url).hostname == 'stub.test':
+            return stub.send(request, **kwargs)
+        return send(adapter, request, **kwargs)
+    
+    monkeypatch.setattr(HTTPAdapter, 'send', send_via_stub)
+    return sent
+
+
+def test_replay_holds_notifications_and_stays_offline(make_monitor, stub, echo_server, tmp_path, monkeypatch):
+    """A recorded cycle replays with no HTTP requests and no notification deliveries"""
+    notifications = {
+        'webhook': {'enabled': True, 'url': f"http://127.0.0.1:{echo_server.server_port}/hook"},
+        'digest_window_seconds': 0
+    }
+    archive = str(tmp_path / 'cycles.db')
+    sent = send_stub_requests_to_stub(monkeypatch, stub)  # URLs that reached a real HTTPAdapter
+    
+    live = make_monitor(capture=False, notifications=notifications)
+    live.enable_recording(archive)
+    live.check_all_parks()
+    live.close_notifiers()
+    live.archive.close()
+    assert len(echo_server.paths) == 1
+    
+    replay = make_monitor(capture=False, notifications=notifications)
+    requests_before, sent_before = len(stub.paths), len(sent)
+    replay.enable_replay(archive)
+    replay.check_all_parks()
+    replay.close_notifiers()
+    replay.archive.close()
+    
+    assert open_nights(replay, '200', '200001') == ['2026-07-30', '2026-08-01']
+    assert (len(stub.paths), len(sent)) == (requests_before, sent_before)
+    assert len(echo_server.paths) == 1
+    assert [channel for channel, _ in replay.outbox] == ['webhook']
+
+
+def test_profile_run_writes_report(make_monitor, stub, tmp_path, monkeypatch):
+    """`--profile` replaying a recorded cycle writes the report and raw stats, then exits 0"""
+    send_stub_requests_to_stub(monkeypatch, stub)
+    archive = str(tmp_path / 'cycles.db')
+    live = make_monitor(capture=False)
+    live.enable_recording(archive)
+    live.check_all_parks()
+    live.archive.close()
+    
+    report = tmp_path / 'profile.txt'
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(park_monitor.__file__), '--config', make_monitor().config_path,
+         '--replay', archive, '--profile', str(report)],
+        cwd=tmp_path, capture_output=True, text=True, timeout=120
+    )
+    
+    assert result.returncode == 0, result.stderr
+    text = report.read_text()
+    for heading in ('Profile of one check cycle', 'Hot functions by cumulative time',
+                    'Hot functions by own time', 'Top allocation sites'):
+        assert heading in text
+    assert 'check_all_parks' in text
+    stats = pstats.Stats(str(tmp_path / 'profile.prof'))
+    assert stats.total_calls > 0
+
+
+def edit_config(monitor, **sections):
+    """Rewrite the monitor's config file with `sections` replaced"""
+    with open(monitor.config_path) as f:
+        config = yaml.safe_load(f)
+    config.update(sections)
+    with open(monitor.config_path, 'w') as f:
+        yaml.safe_dump(config, f)
+
+
+def test_reload_diffs_parks(make_monitor, stub):
+    """Added units are checked right away, removed ones retired, untouched ones keep their schedule"""
+    stub.campgrounds['2000'] = [('300', 'Grant Grove')]
+    stub.campgrounds['3000'] = [('400', 'Mather')]
+    stub.open['300'] = {'300001': {'2026-07-31'}}
+    stub.permits['1000'] = [('445', 'Half Dome')]
+    monitor = make_monitor(parks=[
+        {'name': 'Yosemite', 'park_id': '1000', 'check_camping': True},
+        {'name': 'Kings Canyon', 'park_id': '2000', 'check_camping': True}
+    ])
+    monitor._plan_units()
+    monitor.check_all_parks()
+    assert any(key[0] == '300' for key in monitor.fetch_units.units)
+    
+    edit_config(monitor, parks=[
+        {'name': 'Yosemite', 'park_id': '1000', 'check_camping': True, 'check_permits': True},
+        {'name': 'Grand Canyon', 'park_id': '3000', 'check_camping': True}
+    ])
+    assert monitor.reload_config()
+    
+    assert set(monitor.check_scheduler.costs) == {
+        ('campground', 'Yosemite', '200'),
+        ('permits', 'Yosemite', '1000'),
+        ('campground', 'Grand Canyon', '400')
+    }
+    assert set(monitor.check_scheduler.pop_due()) == {
+        ('permits', 'Yosemite', '1000'),
+        ('campground', 'Grand Canyon', '400')
+    }
+    assert not any(key[0] == '300' for key in monitor.fetch_units.units)
+    assert any(key[0] == '200' for key in monitor.fetch_units.units)
+    assert not monitor.reload_config()
+
+
+def test_reload_window_round_trip_keeps_notified_nights(make_monitor):
+    """Nights that leave the window and come back are not reported or logged as new openings"""
+    monitor = make_monitor()
+    monitor.check_all_parks()
+    assert len(monitor.sent) == 1
+    
+    edit_config(monitor, target_dates={'start_date': '2026-07-31', 'end_date': END_DATE})
+    assert monitor.reload_config()
+    monitor.check_all_parks()
+    assert open_nights(monitor, '200', '200001') == ['2026-08-01']
+    
+    edit_config(monitor, target_dates={'start_date': START_DATE, 'end_date': END_DATE})
+    assert monitor.reload_config()
+    assert open_nights(monitor, '200', '200001') == ['2026-07-30', '2026-08-01']
+    monitor.check_all_parks()
+    
+    assert len(monitor.sent) == 1
+    assert monitor.store.conn.execute(
+        'SELECT COUNT(*) FROM changes WHERE date = ? AND status = ?', ('2026-07-30', 'Available')
+    ).fetchone()[0] == 1
+
+
+def test_config_snapshot_hit_and_miss(make_monitor, monkeypatch):
+    """An unchanged config loads from its snapshot; any edit, even a same-size one at the same mtime, misses"""
+    monitor = make_monitor()
+    path = monitor.config_path
+    parsed = []
+    safe_load = yaml.safe_load
+    monkeypatch.setattr(yaml, 'safe_load', lambda stream: parsed.append(stream) or safe_load(stream))
+    
+    assert monitor._load_config(path) == monitor.config
+    assert parsed == []
+    
+    stat = os.stat(path)
+    with open(path) as f:
+        text = f.read()
+    with open(path, 'w') as f:
+        f.write(text.replace(START_DATE, '2026-07-31'))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(path).st_size == stat.st_size
+    
+    assert monitor.reload_config_if_changed()
+    assert len(parsed) == 1
+    assert monitor.start_date == '2026-07-31'
+    assert not monitor.reload_config_if_changed()
+    assert monitor._load_config(path)['target_dates']['start_date'] == '2026-07-31'
+    assert len(parsed) == 1
+
+
+@pytest.mark.parametrize('config, message', [
+    ([], 'expected a mapping at the top level'),
+    ({'parks': None}, 'parks must be a list'),
+    ({'parks': [{'name': 'Yosemite'}]}, r'parks\[0\] needs a name and a park_id'),
+    ({'target_dates': {'start_date': 'July'}}, 'target_dates needs start_date and end_date as YYYY-MM-DD'),
+    ({'target_dates': {'start_date': END_DATE, 'end_date': START_DATE}},
+     'target_dates start_date is after end_date'),
+    ({'notifications': {'webhook': {'enabled': True}}}, 'notifications.webhook is enabled but missing url'),
+    ({'subscriptions': [{'target_dates': []}]},
+     r'subscriptions\[0\].target_dates must be a mapping with start_date and end_date'),
+])
+def test_config_validation_messages(config, message):
+    """Each invalid config is rejected with a message naming the problem"""
+    if isinstance(config, dict):
+        config = {'parks': [], 'target_dates': {'start_date': START_DATE, 'end_date': END_DATE}, **config}
+    with pytest.raises(ValueError, match=f"^Invalid config: {message}$"):
+        ParkAvailabilityMonitor._validate_config(config)
+
+
+def test_invalid_config_keeps_running_config(make_monitor):
+    """A reload that fails validation leaves the running config and snapshot in place"""
+    monitor = make_monitor()
+    config = monitor.config
+    
+    edit_config(monitor, parks='Yosemite')
+    
+    assert not monitor.reload_config()
+    assert monitor.config is config
+    with pytest.raises(ValueError, match='parks must be a list'):
+        monitor._load_config(monitor.config_path)
+
+
+def test_json_log_formatter_shape():
+    """Each record is one JSON object, with `extra` fields as top-level keys"""
+    logger = logging.getLogger('ParkMonitor.test')
+    # Values JSON cannot encode, like the window, are written as their str()
+    extra = {'park': 'Yosemite', 'latency_ms': 12.5, 'window': DateWindow(START_DATE, END_DATE)}
+    record = logger.makeRecord('ParkMonitor.test', logging.WARNING, __file__, 1, "Checked %s in %dms",
+                               ('Upper Pines', 12), None, extra=extra)
+    
+    entry = json.loads(JsonLogFormatter().format(record))
+    
+    assert set(entry) == {'time', 'level', 'logger', 'message', 'park', 'latency_ms', 'window'}
+    assert entry['level'] == 'WARNING'
+    assert entry['logger'] == 'ParkMonitor.test'
+    assert entry['message'] == 'Checked Upper Pines in 12ms'
+    assert (entry['park'], entry['latency_ms']) == ('Yosemite', 12.5)
+    assert isinstance(entry['window'], str)
+    assert datetime.fromisoformat(entry['time'])
+    
+    try:
+        raise RuntimeError('boom')
+    except RuntimeError:
+        record = logger.makeRecord('ParkMonitor.test', logging.ERROR, __file__, 1, 'Failed', (), sys.exc_info())
+    assert 'RuntimeError: boom' in json.loads(JsonLogFormatter().format(record))['exception']
+
+
+def test_rotating_log_file_gzips_and_prunes(tmp_path):
+    """Crossing max_bytes rotates to gzipped backups, keeping only backup_count of them"""
+    path = tmp_path / 'monitor.log'
+    handler = RotatingLogFile(str(path), max_bytes=100, backup_count=2, compress=True)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger = logging.getLogger('test.rotation')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        # Each line is 40 bytes, so every file holds two
+        for number in range(8):
+            logger.warning(f"line {number} ".ljust(39, '.'))
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+    
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['monitor.log', 'monitor.log.1.gz', 'monitor.log.2.gz']
+    assert path.stat().st_size <= 100
+    
+    def numbers(text: str) -> list:
+        return [int(line.split()[1]) for line in text.splitlines()]
+    
+    assert numbers(path.read_text()) == [6, 7]
+    assert numbers(gzip.decompress((tmp_path / 'monitor.log.1.gz').read_bytes()).decode()) == [4, 5]
+    assert numbers(gzip.decompress((tmp_path / 'monitor.log.2.gz').read_bytes()).decode()) == [2, 3]
+
+
+def test_async_logging_flushes_on_close(make_monitor, tmp_path):
+    """Records queued by the logging thread are all written by close_logging()"""
+    path = tmp_path / 'monitor.jsonl'
+    monitor = make_monitor(logging={'level': 'INFO', 'async': True, 'log_file': str(path), 'format': 'json'})
+    try:
+        assert any(isinstance(handler, LogQueueHandler) for handler in monitor.logger.handlers)
+        for number in range(500):
+            monitor.logger.info(f"Record {number}", extra={'park': 'Yosemite'})
+        monitor.close_logging()
+    finally:
+        for handler in list(monitor.logger.handlers):
+            monitor.logger.removeHandler(handler)
+            handler.close()
+    
+    entries = [json.loads(line) for line in path.read_text().splitlines()]
+    records = [entry for entry in entries if entry['message'].startswith('Record ')]
+    assert [entry['message'] for entry in records] == [f"Record {number}" for number in range(500)]
+    assert all(entry['park'] == 'Yosemite' for entry in records)
+    assert monitor.log_listener is None
+
+
+def test_metrics_render_prometheus_format():
+    """Counters, gauges and cumulative histogram buckets in the text exposition format"""
+    metrics = Metrics()
+    metrics.inc('parkmonitor_requests_total', endpoint='search', status='200')
+    metrics.inc('parkmonitor_requests_total', 2, endpoint='search', status='200')
+    metrics.inc('parkmonitor_requests_total', endpoint='availability', status='429')
+    metrics.set('parkmonitor_known_sites', 12)
+    metrics.inc('parkmonitor_notifications_total', park='Say "hi"\\now\nplease')
+    for seconds in (0.005, 0.3, 0.3, 1000):
+        metrics.observe('parkmonitor_send_seconds', seconds, channel='email')
+    
+    lines = metrics.render().splitlines()
+    
+    assert lines[:6] == [
+        '# TYPE parkmonitor_notifications_total counter',
+        'parkmonitor_notifications_total{park="Say \\"hi\\"\\\\now\\nplease"} 1',
+        '# TYPE parkmonitor_requests_total counter',
+        'parkmonitor_requests_total{endpoint="availability",status="429"} 1',
+        'parkmonitor_requests_total{endpoint="search",status="200"} 3',
+        '# TYPE parkmonitor_known_sites gauge',
+    ]
+    assert lines[6] == 'parkmonitor_known_sites 12'
+    assert lines[7] == '# TYPE parkmonitor_send_seconds histogram'
+    buckets = lines[8:8 + len(Metrics.BOUNDS)]
+    assert buckets[0] == 'parkmonitor_send_seconds_bucket{channel="email",le="0.005"} 1'
+    assert 'parkmonitor_send_seconds_bucket{channel="email",le="0.25"} 1' in buckets
+    assert 'parkmonitor_send_seconds_bucket{channel="email",le="0.5"} 3' in buckets
+    assert buckets[-2:] == ['parkmonitor_send_seconds_bucket{channel="email",le="900"} 3',
+                            'parkmonitor_send_seconds_bucket{channel="email",le="+Inf"} 4']
+    assert lines[8 + len(Metrics.BOUNDS):] == ['parkmonitor_send_seconds_sum{channel="email"} 1000.605',
+                                               'parkmonitor_send_seconds_count{channel="email"} 4']